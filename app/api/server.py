@@ -0,0 +1,328 @@
+"""
+Headless HTTP API for form filling: parse, prefill, chat and fill.
+
+Run it with:
+    uvicorn app.api.server:app --port 7861
+
+Every request must carry an `X-Tenant-ID` header. Sessions are kept server-side and are only
+visible to the tenant that created them. Model clients and the compiled chat graph are shared
+by all sessions, and each tenant gets a bounded number of concurrent requests.
+"""
+import os
+import json
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+from fastapi import FastAPI, File, Header, HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from app.api.sessions import Session, SessionStore, TenantLimiter, TenantLimitExceeded
+from app.chat_agent.graph import ChatAgentState, create_chat_graph
+from app.chat_agent.helpers import is_form_question
+from app.context.loader import load_file_into_context
+from app.context.store import get_document_store
+from app.doc_handlers.pdf import parse_pdf_form, fill_pdf_form
+from app.form.computed import recompute_fields
+from app.form.draft import undo_changes
+from app.form.memory import recall_answers, remember_answers
+from app.form.prefill import prefill_in_memory_form, remove_support_docs
+from app.form.status import get_prefilled_fields_status, get_reprefilled_fields_status, check_if_form_complete
+from app.form.update import update_draft_form
+from app.utils.files import detach_upload, source_digest
+from app.utils.llm import clean_llm_response
+from app.utils.metrics import render_prometheus
+from app.utils.model_manager import start_model_manager
+from app.utils.misc import persist_uploads
+from app.utils.scheduler import set_llm_session
+from app.utils.setup import setup
+
+FORM_COMPLETE_MESSAGE = "All fields have been answered. Feel free to download the form. Thank you for using Form Pilot!"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    setup()
+    # Warm up the local models in the background
+    start_model_manager()
+    support_docs_path = os.path.join(os.getcwd(), os.getenv("SUPPORT_DOCS_PATH", "support_docs"))
+    forms_path = os.path.join(os.getcwd(), os.getenv("FORMS_PATH", "forms"))
+    app.state.sessions = SessionStore(support_docs_path, forms_path)
+    app.state.limiter = TenantLimiter()
+    # One compiled graph (and one set of model clients, see `get_llm`) for all the sessions
+    app.state.chat_graph = create_chat_graph()
+    yield
+
+app = FastAPI(title="Form Pilot API", lifespan=lifespan)
+
+class ChatRequest(BaseModel):
+    message: str
+
+@app.exception_handler(TenantLimitExceeded)
+async def tenant_limit_exceeded_handler(request: Request, e: TenantLimitExceeded):
+    return JSONResponse(status_code=429, content={"detail": str(e)})
+
+def get_session(request: Request, session_id: str, tenant_id: str) -> Session:
+    session = request.app.state.sessions.get(session_id, tenant_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    # The request's LLM calls (including the streamed responses') are shared fairly with other sessions
+    set_llm_session(session.id)
+    return session
+
+def require_form(session: Session) -> None:
+    if session.draft_form is None:
+        raise HTTPException(status_code=409, detail="Upload a form first")
+
+def message_to_dict(message) -> Dict[str, str]:
+    role = "user" if isinstance(message, HumanMessage) else "assistant"
+    return {"role": role, "content": clean_llm_response(message.content)}
+
+def remove_session_docs(session: Session, doc_names: List[str]) -> List[int]:
+    """
+    Remove support documents from the session and clear the fields whose values were found in them.
+
+    Returns:
+        The indexes of the cleared fields
+    """
+    removed_doc_ids = {session.uploaded_docs.pop(name) for name in doc_names}
+    # The same document may have been uploaded under another name
+    removed_doc_ids -= set(session.uploaded_docs.values())
+    removed_doc_ids.discard(None)
+    session.context_docs, cleared_indexes = remove_support_docs(session.draft_form, session.context_docs, removed_doc_ids)
+    return cleared_indexes
+
+def ndjson(event: Dict[str, Any]) -> bytes:
+    # Form fields are read-only mappings (see app/form/fields.py)
+    return (json.dumps(event, default=dict) + "\n").encode("utf-8")
+
+async def stream_with_slot(request: Request, tenant_id: str, events: AsyncIterator[bytes]) -> StreamingResponse:
+    """
+    Take the tenant's concurrency slot before the response starts, so a tenant over its limit gets a 429
+    (see `tenant_limit_exceeded_handler`), and hold it for as long as the response is streamed
+    """
+    slot = request.app.state.limiter.slot(tenant_id)
+    await slot.__aenter__()
+
+    async def stream() -> AsyncIterator[bytes]:
+        try:
+            async for event in events:
+                yield event
+        finally:
+            await events.aclose()
+            await slot.__aexit__(None, None, None)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.get("/health")
+async def health(request: Request):
+    return {"status": "ok", "sessions": len(request.app.state.sessions)}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    LLM call, graph node and cache metrics in the Prometheus text format
+    """
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.post("/sessions")
+async def create_session(request: Request, x_tenant_id: str = Header(), x_user_id: Optional[str] = Header(None)):
+    """
+    Create a session. With an `X-User-ID` header, the user's answers are remembered across forms
+    when the answer memory is enabled (see app/form/memory.py).
+    """
+    session = request.app.state.sessions.create(x_tenant_id, x_user_id)
+    session.messages = [SystemMessage(content="You are a friendly and helpful assistant responsible for helping a user fill out a form.")]
+    return {"session_id": session.id}
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(request: Request, session_id: str, x_tenant_id: str = Header()):
+    get_session(request, session_id, x_tenant_id)
+    request.app.state.sessions.delete(session_id)
+    return {"deleted": session_id}
+
+@app.post("/sessions/{session_id}/form")
+async def upload_form(request: Request, session_id: str, file: UploadFile = File(...), x_tenant_id: str = Header()):
+    """
+    Upload the form to be filled and parse it into a draft form
+    """
+    session = get_session(request, session_id, x_tenant_id)
+    async with request.app.state.limiter.slot(x_tenant_id), session.lock:
+        session.form_bytes = await file.read()
+        if persist_uploads():
+            get_document_store(request.app.state.sessions.forms_path).put(session.form_bytes, file.filename, session.id)
+        session.draft_form = await asyncio.to_thread(parse_pdf_form, session.form_bytes, file.filename)
+        # Fields the user already answered in previous forms are neither prefilled nor asked
+        await asyncio.to_thread(recall_answers, session.draft_form, session.user_id)
+        return session.draft_form
+
+@app.get("/sessions/{session_id}/form")
+async def get_form(request: Request, session_id: str, x_tenant_id: str = Header()):
+    session = get_session(request, session_id, x_tenant_id)
+    require_form(session)
+    return session.draft_form
+
+@app.post("/sessions/{session_id}/form/undo")
+async def undo_form_changes(request: Request, session_id: str, to_revision: Optional[int] = None, x_tenant_id: str = Header()):
+    """
+    Undo the changes made to the draft form after `to_revision` (by default, the last change)
+    """
+    session = get_session(request, session_id, x_tenant_id)
+    require_form(session)
+    async with session.lock:
+        undone_changes = undo_changes(session.draft_form, to_revision)
+        # The computed fields follow the fields they're computed from (see app/form/computed.py)
+        recompute_fields(session.draft_form, [change["index"] for change in undone_changes])
+        return {"revision": session.draft_form["revision"], "undone_changes": undone_changes}
+
+@app.post("/sessions/{session_id}/documents")
+async def upload_documents(request: Request, session_id: str, files: List[UploadFile] = File(...), x_tenant_id: str = Header()):
+    """
+    Upload support documents and prefill the form with them.
+    Uploading a document with the name of a previously uploaded one replaces it: the values that were
+    found in the previous version are cleared first.
+    The response is a stream of NDJSON progress events, followed by the changed fields.
+    """
+    session = get_session(request, session_id, x_tenant_id)
+    require_form(session)
+    store = get_document_store(request.app.state.sessions.support_docs_path)
+    # The request's files are closed before the response is streamed: copy them out of the request first
+    uploads = [(file.filename, detach_upload(file.file)) for file in files]
+
+    async def events() -> AsyncIterator[bytes]:
+        async with session.lock:
+            new_uploads = []
+            for filename, doc_file in uploads:
+                digest = source_digest(doc_file)
+                if filename in session.uploaded_docs and session.uploaded_docs[filename] == digest:
+                    doc_file.close()
+                else:
+                    new_uploads.append((filename, doc_file, digest))
+            replaced_doc_names = [filename for filename, _, _ in new_uploads if filename in session.uploaded_docs]
+            if replaced_doc_names:
+                remove_session_docs(session, replaced_doc_names)
+
+            for filename, doc_file, digest in new_uploads:
+                yield ndjson({"type": "progress", "message": f"Reading {filename} ..."})
+                with doc_file:
+                    store.put(doc_file, filename, session.id, persist=persist_uploads(), digest=digest)
+                    support_doc = await load_file_into_context(doc_file, filename, store, digest=digest)
+                if support_doc and support_doc["docId"] not in {doc["docId"] for doc in session.context_docs}:
+                    session.context_docs.append(support_doc)
+                session.uploaded_docs[filename] = support_doc["docId"] if support_doc else None
+
+            revision = session.draft_form["revision"]
+            progress = asyncio.Queue()
+            prefill_task = asyncio.create_task(prefill_in_memory_form(
+                session.draft_form,
+                session.context_docs,
+                session.chunk_cache,
+                lambda processed, total: progress.put_nowait({"type": "progress", "processed": processed, "total": total}),
+            ))
+            try:
+                while not prefill_task.done() or not progress.empty():
+                    getter = asyncio.ensure_future(progress.get())
+                    try:
+                        await asyncio.wait([getter, prefill_task], return_when=asyncio.FIRST_COMPLETED)
+                    finally:
+                        if not getter.done():
+                            getter.cancel()
+                    if getter.done() and not getter.cancelled():
+                        yield ndjson(getter.result())
+            finally:
+                # The client went away: the prefill isn't left running
+                if not prefill_task.done():
+                    prefill_task.cancel()
+
+            if prefill_task.exception() is not None:
+                logging.error(f"Could not prefill the form of session {session.id}: {str(prefill_task.exception())}")
+                yield ndjson({"type": "error", "message": "Could not prefill the form"})
+                return
+            session.draft_form = prefill_task.result()
+            fields_changes = get_prefilled_fields_status(session.draft_form, revision)
+            yield ndjson({"type": "done", "replaced": replaced_doc_names, **fields_changes})
+
+    try:
+        return await stream_with_slot(request, x_tenant_id, events())
+    except TenantLimitExceeded:
+        for _, doc_file in uploads:
+            doc_file.close()
+        raise
+
+@app.delete("/sessions/{session_id}/documents/{filename}")
+async def delete_document(request: Request, session_id: str, filename: str, x_tenant_id: str = Header()):
+    """
+    Remove a support document. The values that were found in it are cleared, and only these fields
+    are prefilled again, from the remaining support documents.
+    """
+    session = get_session(request, session_id, x_tenant_id)
+    require_form(session)
+    async with request.app.state.limiter.slot(x_tenant_id), session.lock:
+        # Checked under the lock: a concurrent upload or removal may have changed the documents in the meantime
+        if filename not in session.uploaded_docs:
+            raise HTTPException(status_code=404, detail="Document not found")
+        cleared_indexes = remove_session_docs(session, [filename])
+        if cleared_indexes and session.context_docs:
+            await prefill_in_memory_form(session.draft_form, session.context_docs, session.chunk_cache, indexes=cleared_indexes)
+        return get_reprefilled_fields_status(session.draft_form, cleared_indexes)
+
+@app.post("/sessions/{session_id}/chat")
+async def chat(request: Request, session_id: str, body: ChatRequest, x_tenant_id: str = Header()):
+    """
+    Send a message to the chat agent.
+    The response is a stream of NDJSON events: the tokens of the reply as they are generated,
+    followed by the complete reply.
+    """
+    session = get_session(request, session_id, x_tenant_id)
+    require_form(session)
+    chat_graph = request.app.state.chat_graph
+
+    async def events() -> AsyncIterator[bytes]:
+        async with session.lock:
+            # Check if the user is submitting an answer to a form field
+            if is_form_question(session.messages[-1].content):
+                session.draft_form = await update_draft_form(session.draft_form, body.message)
+            session.messages.append(HumanMessage(content=body.message))
+
+            if check_if_form_complete(session.draft_form):
+                done_message = AIMessage(content=FORM_COMPLETE_MESSAGE)
+                session.messages.append(done_message)
+                yield ndjson({"type": "message", **message_to_dict(done_message), "form_complete": True})
+                return
+
+            state = ChatAgentState(messages=session.messages, draft_form=session.draft_form, form_filepath=session.draft_form["formFileName"])
+            final_state = None
+            async for mode, chunk in chat_graph.astream(state, stream_mode=["messages", "values"]):
+                if mode == "messages":
+                    message_chunk, metadata = chunk
+                    # The supervisor's output is a routing decision, not a reply to the user
+                    if metadata.get("langgraph_node") != "Supervisor" and message_chunk.content:
+                        yield ndjson({"type": "token", "content": message_chunk.content})
+                else:
+                    final_state = chunk
+
+            session.messages = final_state["messages"]
+            yield ndjson({"type": "message", **message_to_dict(session.messages[-1]), "form_complete": False})
+
+    return await stream_with_slot(request, x_tenant_id, events())
+
+@app.get("/sessions/{session_id}/messages")
+async def get_messages(request: Request, session_id: str, x_tenant_id: str = Header()):
+    session = get_session(request, session_id, x_tenant_id)
+    return [
+        message_to_dict(message) for message in session.messages
+        if not isinstance(message, (SystemMessage, ToolMessage)) and not getattr(message, "tool_calls", None)
+    ]
+
+@app.get("/sessions/{session_id}/form.pdf")
+async def download_form(request: Request, session_id: str, x_tenant_id: str = Header()):
+    """
+    Fill the PDF form with the draft form's values
+    """
+    session = get_session(request, session_id, x_tenant_id)
+    require_form(session)
+    async with request.app.state.limiter.slot(x_tenant_id):
+        pdf_bytes = await asyncio.to_thread(fill_pdf_form, session.form_bytes, session.draft_form)
+        # Downloading the filled form confirms its answers
+        await asyncio.to_thread(remember_answers, session.draft_form, session.user_id)
+    return Response(content=pdf_bytes, media_type="application/pdf")
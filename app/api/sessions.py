@@ -0,0 +1,102 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from langchain_core.messages.base import BaseMessage
+from app.context.chunks import ChunkCache
+from app.context.store import get_document_store
+from app.models import DraftForm, SupportDoc
+
+@dataclass
+class Session:
+    """
+    Server-side state of a form filling session (the API equivalent of Streamlit's session state)
+    """
+    id: str
+    tenant_id: str
+    # The user's answer memory is used when the session is created with a user ID (see app/form/memory.py)
+    user_id: Optional[str] = None
+    form_bytes: Optional[bytes] = None
+    draft_form: Optional[DraftForm] = None
+    context_docs: List[SupportDoc] = field(default_factory=list)
+    uploaded_docs: Dict[str, Optional[str]] = field(default_factory=dict)  # Uploaded support docs: name -> document ID
+    messages: List[BaseMessage] = field(default_factory=list)
+    chunk_cache: ChunkCache = field(default_factory=ChunkCache)
+    last_access: float = field(default_factory=time.monotonic)
+    # Requests of a session are processed one at a time
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+class SessionStore:
+    """
+    In-memory store of the sessions of the API server.
+    Sessions that haven't been used for SESSION_TTL_MINUTES (defaults to 60) are evicted.
+    """
+
+    def __init__(self, support_docs_path: str, forms_path: str):
+        self.ttl_seconds = float(os.getenv("SESSION_TTL_MINUTES", "60")) * 60
+        self.support_docs_path = support_docs_path
+        self.forms_path = forms_path
+        self._sessions: Dict[str, Session] = {}
+
+    def create(self, tenant_id: str, user_id: Optional[str] = None) -> Session:
+        self.evict_expired()
+        session = Session(id=uuid.uuid4().hex, tenant_id=tenant_id, user_id=f"{tenant_id}/{user_id}" if user_id else None)
+        self._sessions[session.id] = session
+        return session
+
+    def get(self, session_id: str, tenant_id: str) -> Optional[Session]:
+        """
+        Get a session. Sessions are only visible to the tenant that created them.
+        """
+        session = self._sessions.get(session_id)
+        if session is None or session.tenant_id != tenant_id:
+            return None
+        session.last_access = time.monotonic()
+        return session
+
+    def delete(self, session_id: str) -> None:
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            get_document_store(self.support_docs_path).release(session.id)
+            get_document_store(self.forms_path).release(session.id)
+
+    def evict_expired(self) -> None:
+        now = time.monotonic()
+        expired = [session.id for session in self._sessions.values() if now - session.last_access > self.ttl_seconds]
+        for session_id in expired:
+            logging.info(f"Evicting expired session {session_id}")
+            self.delete(session_id)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+class TenantLimitExceeded(Exception):
+    pass
+
+class TenantLimiter:
+    """
+    Limits the number of requests processed concurrently for each tenant to TENANT_MAX_CONCURRENCY
+    (defaults to 4). Requests over the limit wait up to TENANT_QUEUE_TIMEOUT seconds (defaults to 30)
+    for a slot before being rejected.
+    """
+
+    def __init__(self):
+        self.max_concurrency = int(os.getenv("TENANT_MAX_CONCURRENCY", "4"))
+        self.queue_timeout = float(os.getenv("TENANT_QUEUE_TIMEOUT", "30"))
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    @asynccontextmanager
+    async def slot(self, tenant_id: str):
+        semaphore = self._semaphores.setdefault(tenant_id, asyncio.Semaphore(self.max_concurrency))
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise TenantLimitExceeded(f"Too many concurrent requests for tenant {tenant_id}")
+        try:
+            yield
+        finally:
+            semaphore.release()
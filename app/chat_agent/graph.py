@@ -1,20 +1,16 @@
 from typing import List, Annotated
 import operator
-import streamlit as st
-import asyncio
 from typing import Dict, Any, List
 from dataclasses import dataclass
-from langgraph.graph import StateGraph, END
 from langchain_core.messages.base import BaseMessage
-from langchain_core.messages import AIMessage, SystemMessage, ToolMessage
-from langchain_core.tools import tool
-import json
-from app.utils.llm import get_llm
-from langgraph.prebuilt import ToolNode
-from app.models import DraftForm
-from app.form.inquire import field_surveyor
+from langchain_core.messages import AIMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.output_parsers.openai_functions import JsonOutputFunctionsParser
+from app.utils.llm import ainvoke_llm
+from app.utils.metrics import instrumented
+from app.models import DraftForm
+from app.form.inquire import field_surveyor, group_field_surveyor
+from app.form.layout import get_pending_group
+from app.form.computed import rejected_answers_hint
 
 @dataclass
 class ChatAgentState:
@@ -23,8 +19,11 @@ class ChatAgentState:
     draft_form: DraftForm = None
     next: str = None  # For storing supervisor routing decisions
 
-llm = None
+async def ainvoke_chat_llm(messages: List[BaseMessage], kind: str) -> BaseMessage:
+    # Model clients are shared by all the sessions of the process (see `get_llm`)
+    return await ainvoke_llm("CHAT_LLM", messages, kind, temperature=0.0)
 
+@instrumented("WorkflowGuide", kind="node")
 async def workflow_guide_node(state: ChatAgentState) -> Dict[str, Any]:
     SYSTEM_PROMPT = """
     You are a friendly and cheerful assistant. 
@@ -40,10 +39,11 @@ async def workflow_guide_node(state: ChatAgentState) -> Dict[str, Any]:
             MessagesPlaceholder(variable_name="messages"),   
     ])
     messages = prompt.format_messages(messages=state.messages)
-    response = await llm.ainvoke(messages)
+    response = await ainvoke_chat_llm(messages, "workflow_guide")
     return {"messages" : [response]}
 
 
+@instrumented("FormAssistant", kind="node")
 async def form_assistant_node(state: ChatAgentState) -> Dict[str, Any]:
     SYSTEM_PROMPT = """
     You are a friendly and cheerful assistant. 
@@ -58,32 +58,37 @@ async def form_assistant_node(state: ChatAgentState) -> Dict[str, Any]:
             ("system", SYSTEM_PROMPT),
             MessagesPlaceholder(variable_name="messages"),   
     ])
-    messages = prompt.format_messages(messages=state.messages, draft_form=state.draft_form)
-    response = await llm.ainvoke(messages)
+    # The change log and the field groups are for the app, not the model: keep them out of the prompt
+    draft_form = {key: value for key, value in state.draft_form.items() if key not in ("changeLog", "groups", "fingerprint")}
+    messages = prompt.format_messages(messages=state.messages, draft_form=draft_form)
+    response = await ainvoke_chat_llm(messages, "form_assistant")
     return {"messages" : [response]}
 
 
+@instrumented("FormInquirer", kind="node")
 async def form_inquirer_node(state: ChatAgentState) -> Dict[str, Any]:
-    draft_form = state.draft_form
-    messages = state.messages
-    unanswered_fields = []
+    fields = state.draft_form["fields"]
+    index = fields.first_unanswered()
 
-    for field in draft_form["fields"]:
-        # TODO: Extend this to support other field types
-        if field["value"] == "" and field["type"] == "text":
-            unanswered_fields.append(field)
-
-    if len(unanswered_fields) > 0:
-        unanswered_field = unanswered_fields[0]
-        question = await field_surveyor(draft_form["fields"], unanswered_field)
-        return {"messages" : [AIMessage(content=f"[fields left: {len(unanswered_fields)}] {question}")]}
+    if index is not None:
+        # The fields of a logical block (e.g. an address) are asked in one question
+        group = get_pending_group(state.draft_form)
+        if len(group) > 1:
+            question = await group_field_surveyor(fields, [fields[i] for i in group])
+        else:
+            question = await field_surveyor(fields, fields[index])
+        # The user's last answer to the field was rejected (e.g. not a number for an input of a computed field)
+        hint = rejected_answers_hint(state.draft_form, group if len(group) > 1 else [index])
+        if hint:
+            question = f"{hint} {question}"
+        return {"messages" : [AIMessage(content=f"[fields left: {fields.unanswered_count()}] {question}")]}
     else:
         return {"messages" : [AIMessage(content="All fields have been answered. Feel free to download the form. Thank you for using Form Pilot!")]}
 
 
+@instrumented("Supervisor", kind="node")
 async def supervisor_node(state: ChatAgentState) -> Dict[str, Any]:
     """Wrapper node for the supervisor to handle state properly"""
-    global llm
     """An LLM-based router."""
     
     members = ["WorkflowGuide", "FormAssistant", "FormInquirer"]
@@ -97,23 +102,6 @@ async def supervisor_node(state: ChatAgentState) -> Dict[str, Any]:
     You are a supervisor responsible for helping a user fill out a form. 
     /no_think
     """
-    function_def = {
-        "name": "route",
-        "description": "Select the next role.",
-        "parameters": {
-            "title": "routeSchema",
-            "type": "object",
-            "properties": {
-                "next": {
-                    "title": "Next",
-                    "anyOf": [
-                        {"enum": members},
-                    ],
-                },
-            },
-            "required": ["next"],
-        },
-    }
     prompt = ChatPromptTemplate([
         ("system", SYSTEM_PROMPT),
         MessagesPlaceholder(variable_name="messages"),
@@ -121,15 +109,18 @@ async def supervisor_node(state: ChatAgentState) -> Dict[str, Any]:
     ])
     messages = prompt.format_messages(messages=state.messages, members=members, members_descriptions=members_descriptions)
     
-    llm.bind_functions(functions=[function_def], function_call="route")
-    response = await llm.ainvoke(messages)
+    response = await ainvoke_chat_llm(messages, "supervisor")
     return {"next": response.content}
     
 # Create the graph
 def create_chat_graph():
-    global llm
-    llm = get_llm(type="CHAT_LLM", temperature=0.0)
-    
+    """
+    Compile the chat graph. The compiled graph holds no per-session data (it all travels in
+    `ChatAgentState`), so it's compiled once per process and shared by all the sessions.
+    """
+    # LangGraph is imported on first use to keep the app's cold start fast
+    from langgraph.graph import StateGraph, END
+
     workflow = StateGraph(ChatAgentState)
     
     # Add nodes
@@ -1,10 +1,12 @@
 import re
-from typing import Any, List, Dict
-from langgraph.graph.graph import CompiledGraph
+from typing import TYPE_CHECKING, Any, List, Dict
 from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
 from app.chat_agent.graph import ChatAgentState
 from app.models import DraftForm, FormField
 
+if TYPE_CHECKING:
+    from langgraph.graph.graph import CompiledGraph
+
 def is_form_question(message: str) -> bool:
     """
     Check if the message is a question about a form field.
@@ -13,7 +15,7 @@ def is_form_question(message: str) -> bool:
     pattern = r'^\[fields left: \d+\].*\?$'
     return bool(re.match(pattern, message))
 
-async def trigger_chat_agent_response(agent_graph: CompiledGraph, messages: List[BaseMessage], human_message: str, **kwargs: Any) -> str:
+async def trigger_chat_agent_response(agent_graph: "CompiledGraph", messages: List[BaseMessage], human_message: str, **kwargs: Any) -> str:
     """
     Trigger the chat agent to respond to a human message.
     """
@@ -24,7 +26,7 @@ async def trigger_chat_agent_response(agent_graph: CompiledGraph, messages: List
     result = await agent_graph.ainvoke(state)
     return result
 
-async def feedback_on_file_upload(agent_graph: CompiledGraph, messages: List[BaseMessage], draft_form: DraftForm) -> List[AIMessage]:
+async def feedback_on_file_upload(agent_graph: "CompiledGraph", messages: List[BaseMessage], draft_form: DraftForm) -> List[AIMessage]:
     """
     Provide the user with feedback on the file they uploaded.
     Guide the user to next steps.
@@ -41,7 +43,7 @@ async def feedback_on_file_upload(agent_graph: CompiledGraph, messages: List[Bas
     
     return [empty_fields_response, next_steps_response]
 
-async def feedback_on_support_docs_update(agent_graph: CompiledGraph, fields_changes: Dict[str, List[FormField]]) -> List[AIMessage]:
+async def feedback_on_support_docs_update(agent_graph: "CompiledGraph", fields_changes: Dict[str, List[FormField]]) -> List[AIMessage]:
     """
     Provide the user with feedback on the support docs they uploaded and any fields that were prefilled.
     Guide the user to next steps.
@@ -67,4 +69,23 @@ async def feedback_on_support_docs_update(agent_graph: CompiledGraph, fields_cha
 
     next_steps_response = AIMessage(content="Do you have more support documents to upload or should we move on to filling out the form?")
     
-    return [ack_response, prefilled_fields_response, next_steps_response]
\ No newline at end of file
+    return [ack_response, prefilled_fields_response, next_steps_response]
+
+
+def feedback_on_support_docs_removal(doc_names: List[str], fields_changes: Dict[str, List[FormField]]) -> List[AIMessage]:
+    """
+    Provide the user with feedback on the support docs they removed or replaced: the values that came from them
+    were cleared, and prefilled again from the remaining support docs where possible.
+    """
+    ack_response = AIMessage(content=f"I removed the information from {', '.join(doc_names)}.")
+
+    responses = [ack_response]
+    if fields_changes["prefilled_fields"]:
+        prefilled_message = "PREFILLED AGAIN FROM THE OTHER DOCUMENTS:\n\n"
+        for field in fields_changes["prefilled_fields"]:
+            prefilled_message += f"{field['label']} was assigned a value of \"{field['value']}\"\n\n"
+        responses.append(AIMessage(content=prefilled_message))
+    if fields_changes["empty_fields"]:
+        empty_labels = ", ".join(field["label"] for field in fields_changes["empty_fields"])
+        responses.append(AIMessage(content=f"CLEARED FIELDS:\n\n{empty_labels}."))
+    return responses
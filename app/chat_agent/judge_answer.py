@@ -1,11 +1,10 @@
 from typing import Dict, List, TypedDict, Annotated, Union
 import os
 from datetime import datetime
-from langchain_ollama import ChatOllama
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
 from langchain_core.messages import SystemMessage
-from app.utils.llm import clean_llm_response
+from app.utils.llm import ainvoke_llm, clean_llm_response
 
 general_system_message = """
     You are a helpful assistant that judges an answer provided to a field in a form. 
@@ -56,8 +55,7 @@ async def judge_answer(state: AgentState):
     Return a boolean value indicating if the answer is valid. /no_think
     """
 
-    model = ChatOllama(model=os.getenv("ANSWER_JUDGE_LLM"), temperature=0.0)
-    response = await model.ainvoke(PROMPT)
+    response = await ainvoke_llm("ANSWER_JUDGE_LLM", PROMPT, "judge_answer")
     valid = clean_llm_response(response.content).lower() == "true"
     return {"valid": valid}
 
@@ -0,0 +1,192 @@
+import re
+import os
+import sys
+import json
+import math
+import threading
+from collections import OrderedDict
+from typing import BinaryIO, Dict, List, Tuple
+from app.models import SupportDoc
+from app.utils.metrics import record_cache
+
+CHUNK_SIZE = 4000
+TERM_PATTERN = re.compile(r"[a-z0-9]{3,}")
+
+def extract_terms(text: str) -> set:
+    """
+    Extract the set of normalized search terms (lowercase words of 3+ characters) of a text
+    """
+    return set(TERM_PATTERN.findall(text.lower()))
+
+class ChunkWriter:
+    """
+    Streams the text of a document into a content file, splitting it into chunks of about
+    `chunk_size` characters (preferably at line boundaries) as it goes, so the full text of
+    the document is never held in memory.
+
+    While writing, it builds the chunk metadata (byte offsets in the content file) and an
+    inverted index of the terms found in each chunk.
+    """
+
+    def __init__(self, file: BinaryIO, chunk_size: int = CHUNK_SIZE):
+        self._file = file
+        self._chunk_size = chunk_size
+        self._pending = ""
+        self._offset = 0
+        self.chunks: List[Dict[str, int]] = []
+        self.index: Dict[str, List[int]] = {}
+
+    def write(self, text: str) -> None:
+        self._pending += text
+        while len(self._pending) >= self._chunk_size:
+            # Look for the last line break in the second half of the chunk
+            end = self._pending.rfind("\n", self._chunk_size // 2, self._chunk_size) + 1 or self._chunk_size
+            self._write_chunk(self._pending[:end])
+            self._pending = self._pending[end:]
+
+    def _write_chunk(self, text: str) -> None:
+        data = text.encode("utf-8")
+        chunk_index = len(self.chunks)
+        self._file.write(data)
+        self.chunks.append({"index": chunk_index, "start": self._offset, "end": self._offset + len(data)})
+        for term in extract_terms(text):
+            self.index.setdefault(term, []).append(chunk_index)
+        self._offset += len(data)
+
+    def close(self) -> None:
+        if self._pending.strip():
+            self._write_chunk(self._pending)
+        self._pending = ""
+
+    @property
+    def size(self) -> int:
+        return self._offset
+
+def read_chunk(support_doc: SupportDoc, chunk_index: int) -> str:
+    """
+    Read a single chunk of a document from its content file
+    """
+    chunk = support_doc["chunks"][chunk_index]
+    with open(support_doc["contentPath"], "rb") as f:
+        f.seek(chunk["start"])
+        return f.read(chunk["end"] - chunk["start"]).decode("utf-8")
+
+class ChunkCache:
+    """
+    Per-session LRU cache of the materialized document chunks (and term indexes).
+
+    It enforces the session memory cap: when adding an entry would exceed `limit_bytes`,
+    the least recently used entries are dropped. They are read from disk again when needed.
+    The cache is shared by the session's script thread and its background jobs, so it's thread-safe.
+    """
+
+    def __init__(self, limit_bytes: int = None):
+        if limit_bytes is None:
+            limit_bytes = int(os.getenv("SESSION_MEMORY_LIMIT_MB", "64")) * 1024 * 1024
+        self.limit_bytes = limit_bytes
+        self.size = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: Tuple, load, measure):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                record_cache("chunks", True)
+                return self._entries[key][0]
+        record_cache("chunks", False)
+        value = load()
+        size = measure(value)
+        with self._lock:
+            if key in self._entries:
+                return value
+            while self._entries and self.size + size > self.limit_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+            if size <= self.limit_bytes:
+                self._entries[key] = (value, size)
+                self.size += size
+        return value
+
+    def get_chunk(self, support_doc: SupportDoc, chunk_index: int) -> str:
+        return self._get(
+            (support_doc["docId"], chunk_index),
+            lambda: read_chunk(support_doc, chunk_index),
+            sys.getsizeof,
+        )
+
+    def get_index(self, support_doc: SupportDoc) -> Dict[str, List[int]]:
+        def load():
+            with open(support_doc["indexPath"], "r", encoding="utf-8") as f:
+                return json.load(f)
+        # The in-memory size of a parsed index is a few times the size of its JSON file
+        return self._get(
+            (support_doc["docId"], "index"),
+            load,
+            lambda _: 4 * os.path.getsize(support_doc["indexPath"]),
+        )
+
+    def get_facts(self, support_doc: SupportDoc) -> List[Dict]:
+        """
+        Get the fact sheet of a document (see app/context/facts.py), or no facts if it wasn't extracted
+        """
+        if not support_doc.get("factsPath"):
+            return []
+        def load():
+            with open(support_doc["factsPath"], "r", encoding="utf-8") as f:
+                return json.load(f)
+        # Retrying the failed chunks changes the fact sheet
+        return self._get(
+            (support_doc["docId"], "facts", tuple(support_doc.get("factsFailedChunks") or ())),
+            load,
+            lambda _: 4 * os.path.getsize(support_doc["factsPath"]),
+        )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+def select_chunks(query: str, docs_data: List[SupportDoc], chunk_cache: ChunkCache, max_chars: int) -> List[Tuple[SupportDoc, int]]:
+    """
+    Select the document chunks most relevant to a query, up to `max_chars` characters in total.
+    Chunks are ranked by the IDF-weighted number of query terms they contain, and chunks that
+    don't contain any query term are left out. If no chunk matches the query, the first chunks
+    of each document are selected.
+
+    Returns:
+        A list of (support_doc, chunk_index) tuples in document order
+    """
+    query_terms = extract_terms(query)
+    scores = []
+    for doc_order, doc in enumerate(docs_data):
+        total_chunks = len(doc["chunks"])
+        if total_chunks == 0:
+            continue
+        index = chunk_cache.get_index(doc) if query_terms else {}
+        chunk_scores: Dict[int, float] = {}
+        for term in query_terms:
+            chunk_indices = index.get(term, [])
+            if chunk_indices:
+                idf = math.log(1 + total_chunks / len(chunk_indices))
+                for chunk_index in chunk_indices:
+                    chunk_scores[chunk_index] = chunk_scores.get(chunk_index, 0.0) + idf
+        for chunk in doc["chunks"]:
+            scores.append((-chunk_scores.get(chunk["index"], 0.0), chunk["index"], doc_order, doc, chunk))
+
+    # Best scores first, then earlier chunks first
+    scores.sort(key=lambda entry: entry[:3])
+    has_matches = bool(scores) and scores[0][0] < 0
+    selected = []
+    total_chars = 0
+    for score, chunk_index, doc_order, doc, chunk in scores:
+        if has_matches and score == 0:
+            break
+        chunk_size = chunk["end"] - chunk["start"]
+        if total_chars + chunk_size > max_chars:
+            continue
+        selected.append((doc_order, chunk_index, doc))
+        total_chars += chunk_size
+
+    selected.sort(key=lambda entry: entry[:2])
+    return [(doc, chunk_index) for _, chunk_index, doc in selected]
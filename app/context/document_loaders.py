@@ -1,63 +1,58 @@
-from datetime import datetime
-from langchain_community.document_loaders.word_document import UnstructuredWordDocumentLoader
-import PyPDF2
-from app.models import SupportDoc
+import codecs
+from typing import Iterator
+from app.context.ocr import ocr_images
+from app.utils.files import FileSource, open_file_source, read_source_bytes
 
-def word_document_loader(filepath: str) -> SupportDoc:
-    """
-    Load a Word document into a doc dictionary
-    """
-    # Return only the filename as the docId
-    doc_id = filepath.split("/")[-1]
-    date_created = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    docs = list(UnstructuredWordDocumentLoader(filepath, mode="single").lazy_load())
-    content = "".join([doc.page_content for doc in docs])
-    return {
-        "docId": doc_id,
-        "docType": "docx",
-        "dateCreated": date_created,  
-        "content": content
-    }
+TEXT_BLOCK_SIZE = 64 * 1024
 
-def pdf_document_loader(filepath: str) -> SupportDoc:
+def word_document_loader(source: FileSource) -> Iterator[str]:
     """
-    Load a PDF document into a doc dictionary
+    Stream the text of a Word document, element by element
     """
-    doc_id = filepath + "__" + datetime.now().strftime("%Y%m%d%H%M%S")
-    date_created = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
+    # unstructured is slow to import: only import it when a Word document is loaded
+    from unstructured.partition.docx import partition_docx
+
+    with open_file_source(source) as f:
+        elements = partition_docx(file=f)
+    for element in elements:
+        yield str(element) + "\n\n"
+
+def pdf_document_loader(source: FileSource) -> Iterator[str]:
+    """
+    Stream the text of a PDF document, page by page
+    """
+    import PyPDF2
+
     try:
-        with open(filepath, "rb") as f:
+        with open_file_source(source) as f:
             reader = PyPDF2.PdfReader(f)
-            content = ""
             for page in reader.pages:
-                content += page.extract_text() + "\n"
-                
-        return {
-            "docId": doc_id,
-            "docType": "pdf",
-            "dateCreated": date_created,
-            "content": content.strip()
-        }
+                page_text = page.extract_text()
+                if not page_text.strip():
+                    # Image-only page (e.g. a scanned document): fall back to OCR
+                    page_text = "\n".join(ocr_images([image.data for image in page.images]))
+                yield page_text + "\n"
     except Exception as e:
         raise Exception(f"Error loading PDF: {str(e)}")
 
-def text_document_loader(filepath: str) -> SupportDoc:
+def text_document_loader(source: FileSource) -> Iterator[str]:
+    """
+    Stream the text of a text file, block by block
+    """
+    try:
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        with open_file_source(source) as f:
+            while block := f.read(TEXT_BLOCK_SIZE):
+                yield decoder.decode(block)
+        yield decoder.decode(b"", final=True)
+    except Exception as e:
+        raise Exception(f"Error loading text file: {str(e)}")
+
+def image_document_loader(source: FileSource) -> Iterator[str]:
     """
-    Load a text file into a doc dictionary
+    Stream the text of an image (e.g. a scanned document) using OCR
     """
-    doc_id = filepath + "__" + datetime.now().strftime("%Y%m%d%H%M%S")
-    date_created = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
     try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            content = f.read()
-            
-        return {
-            "docId": doc_id,
-            "docType": "text",
-            "dateCreated": date_created,
-            "content": content.strip()
-        }
+        yield ocr_images([read_source_bytes(source)])[0]
     except Exception as e:
-        raise Exception(f"Error loading text file: {str(e)}")
\ No newline at end of file
+        raise Exception(f"Error loading image: {str(e)}")
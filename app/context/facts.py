@@ -0,0 +1,176 @@
+"""
+Fact sheets: a compact list of the facts of a support document, extracted once when the document is loaded
+into context, so prefill prompts hold the few facts relevant to a field instead of pages of raw text.
+
+Every chunk of the document goes to FACT_SHEET_LLM (defaults to PREFILL_LLM), which lists its facts as
+{"entity", "attribute", "value", "source"}: the source is a quote of the chunk, located in the document
+(as the byte span of the quote in the content file). Facts whose source isn't found in the chunk are dropped.
+The fact sheet is saved in the document's store entry, so it's extracted once per document (see
+`DocumentStore.write_facts`), except for the chunks whose extraction failed: they are retried when the document
+is loaded again. The extraction is disabled with FACT_SHEETS=false.
+"""
+import os
+import re
+import json
+import math
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from app.models import SupportDoc
+from app.context.chunks import ChunkCache, extract_terms, read_chunk
+from app.utils.llm import ainvoke_llm, clean_llm_response
+from app.utils.metrics import instrumented
+from app.utils.scheduler import llm_context, PRIORITY_BULK
+
+FACT_MIN_RELATIVE_SCORE = 0.5
+
+def is_fact_sheets_enabled() -> bool:
+    return os.getenv("FACT_SHEETS", "true").lower() == "true"
+
+def parse_facts(content: str) -> List[Dict[str, str]]:
+    """
+    Parse the facts listed by the model ({"facts": [...]} or a list of facts)
+    """
+    content = clean_llm_response(content).removeprefix("```json").removeprefix("```").removesuffix("```").strip()
+    data = json.loads(content)
+    if isinstance(data, dict):
+        data = data.get("facts", [])
+    if not isinstance(data, list):
+        raise ValueError("The facts are not a JSON list")
+    facts = []
+    for fact in data:
+        if isinstance(fact, dict) and fact.get("value") not in (None, "") and fact.get("source"):
+            facts.append({key: str(fact.get(key) or "").strip() for key in ("entity", "attribute", "value", "source")})
+    return facts
+
+def locate_source(chunk: str, source: str) -> Optional[Tuple[int, int]]:
+    """
+    Find a quote in a chunk, ignoring differences in whitespace and case
+
+    Returns:
+        The byte span of the quote in the chunk, or None if it isn't found
+    """
+    words = source.split()
+    if not words:
+        return None
+    pattern = r"\s+".join(re.escape(word) for word in words)
+    match = re.search(pattern, chunk, re.IGNORECASE)
+    if match is None:
+        return None
+    start = len(chunk[:match.start()].encode("utf-8"))
+    return start, start + len(match.group(0).encode("utf-8"))
+
+async def extract_chunk_facts(support_doc: SupportDoc, chunk_index: int) -> List[Dict[str, Any]]:
+    chunk = support_doc["chunks"][chunk_index]
+    text = await asyncio.to_thread(read_chunk, support_doc, chunk_index)
+    PROMPT = f"""
+    Extract the facts of the following document excerpt: names, dates, numbers, addresses, identifiers and any other data
+    that could answer the fields of a form. Leave out boilerplate, legal text and layout.
+
+    <document>
+        {text}
+    </document>
+
+    Respond with valid JSON only, e.g.:
+    {{"facts": [{{"entity": "<who or what the fact is about>", "attribute": "<what the value is, e.g. date of birth>", "value": "<the value>", "source": "<exact quote of the document that contains the value>"}}]}}
+    /no_think
+    """
+    llm_type = "FACT_SHEET_LLM" if os.getenv("FACT_SHEET_LLM") else "PREFILL_LLM"
+    response = await ainvoke_llm(llm_type, PROMPT, "fact_extraction")
+    facts = []
+    for fact in parse_facts(response.content):
+        span = locate_source(text, fact["source"])
+        if span is None:
+            continue
+        facts.append(dict(fact, chunk=chunk_index, span=[chunk["start"] + span[0], chunk["start"] + span[1]]))
+    return facts
+
+def read_facts(support_doc: SupportDoc) -> List[Dict[str, Any]]:
+    with open(support_doc["factsPath"], "r", encoding="utf-8") as f:
+        return json.load(f)
+
+@instrumented("extract_fact_sheet", kind="context")
+async def extract_fact_sheet(support_doc: SupportDoc, store) -> SupportDoc:
+    """
+    Extract the fact sheet of a document and save it in the document store, unless it was extracted before.
+    The facts of the chunks that fail are left out, and the failed chunks are saved with the fact sheet, to be
+    retried the next time the document is loaded. If every chunk fails, the document has no fact sheet:
+    prefill uses its raw text.
+
+    Returns:
+        The document, with the path of its fact sheet if it was extracted
+    """
+    retried_chunks = support_doc.get("factsFailedChunks") or []
+    if (support_doc.get("factsPath") and not retried_chunks) or not support_doc["chunks"] or not is_fact_sheets_enabled():
+        return support_doc
+    chunk_indexes = retried_chunks if support_doc.get("factsPath") else [chunk["index"] for chunk in support_doc["chunks"]]
+    # Extraction calls are background work, like the prefill calls (see app/utils/scheduler.py)
+    with llm_context(priority=PRIORITY_BULK):
+        chunk_facts = await asyncio.gather(
+            *[extract_chunk_facts(support_doc, chunk_index) for chunk_index in chunk_indexes],
+            return_exceptions=True,
+        )
+    facts = []
+    failed_chunks = []
+    for chunk_index, result in zip(chunk_indexes, chunk_facts):
+        if isinstance(result, asyncio.CancelledError):
+            raise result
+        if isinstance(result, BaseException):
+            logging.warning(f"Could not extract the facts of chunk {chunk_index} of document {support_doc['docId']}: {str(result)}")
+            failed_chunks.append(chunk_index)
+        else:
+            facts.extend(result)
+    if support_doc.get("factsPath"):
+        facts = sorted(await asyncio.to_thread(read_facts, support_doc) + facts, key=lambda fact: fact["chunk"])
+    elif len(failed_chunks) == len(chunk_indexes):
+        logging.warning(f"Could not extract the fact sheet of document {support_doc['docId']}")
+        return support_doc
+    logging.info(f"Extracted {len(facts)} facts from document {support_doc['docId']} ({len(failed_chunks)} chunks failed)")
+    return await asyncio.to_thread(store.write_facts, support_doc["docId"], facts, failed_chunks)
+
+def select_facts(query: str, docs_data: List[SupportDoc], chunk_cache: ChunkCache, max_facts: int) -> List[Tuple[SupportDoc, Dict[str, Any]]]:
+    """
+    Select the facts most relevant to a query, up to `max_facts`. Facts are ranked by the IDF-weighted number of
+    query terms in their entity, attribute and source, and facts scoring less than FACT_MIN_RELATIVE_SCORE of the
+    best score (or without any query term) are left out.
+
+    Returns:
+        A list of (support_doc, fact) tuples, best first
+    """
+    query_terms = extract_terms(query)
+    if not query_terms:
+        return []
+    candidates = []
+    document_frequency: Dict[str, int] = {}
+    for doc in docs_data:
+        for fact in chunk_cache.get_facts(doc):
+            terms = extract_terms(f"{fact['entity']} {fact['attribute']} {fact['source']}") & query_terms
+            for term in terms:
+                document_frequency[term] = document_frequency.get(term, 0) + 1
+            if terms:
+                candidates.append((doc, fact, terms))
+    total_facts = sum(len(chunk_cache.get_facts(doc)) for doc in docs_data)
+    scored = [
+        (sum(math.log(1 + total_facts / document_frequency[term]) for term in terms), order, doc, fact)
+        for order, (doc, fact, terms) in enumerate(candidates)
+    ]
+    scored.sort(key=lambda entry: (-entry[0], entry[1]))
+    # Facts that only share common words with the query (e.g. "box") fall behind the best matches
+    min_score = scored[0][0] * FACT_MIN_RELATIVE_SCORE if scored else 0
+    return [(doc, fact) for score, _, doc, fact in scored[:max_facts] if score >= min_score]
+
+def facts_to_string(doc_data: SupportDoc, facts: List[Dict[str, Any]]) -> str:
+    """
+    Convert some facts of a document to a string, like `doc_data_to_string` in app/form/prefill.py
+    """
+    content = "\n".join(f"- {fact['entity']} | {fact['attribute']}: {fact['value']} (\"{fact['source']}\")" for fact in facts)
+    return f"""
+    <reference>
+        <document_id>
+            {doc_data['docId']}
+        </document_id>
+        <facts>
+            {content}
+        </facts>
+    </reference>
+    """
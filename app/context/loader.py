@@ -1,33 +1,70 @@
+import os
+import asyncio
 from typing import List, Dict
 from datetime import datetime
-from app.context.document_loaders import word_document_loader, pdf_document_loader, text_document_loader
+from app.context.document_loaders import word_document_loader, pdf_document_loader, text_document_loader, image_document_loader
+from app.context.store import DocumentStore, get_document_store
+from app.context.facts import extract_fact_sheet
 from app.models import SupportDoc
+from app.utils.files import FileSource, source_digest
+from app.utils.metrics import instrumented, record_cache
 import logging
 
-async def load_file_into_context(filepath: str) -> SupportDoc:
+@instrumented("load_file_into_context", kind="context")
+async def load_file_into_context(source: FileSource, filename: str = None, store: DocumentStore = None, digest: str = None) -> SupportDoc:
     """
-    Load the content of a supporting document into a data structure in memory
+    Load a supporting document into context.
+
+    The document can be a path on disk or an in-memory buffer (e.g. a Streamlit upload), in
+    which case `filename` is used to find out the document type.
+    The text of the document is streamed into the document store as a sequence of chunks, so
+    the full text is never held in memory: the returned document only holds the chunk metadata,
+    and chunks are read from disk when a prompt needs them (see `app/context/chunks.py`).
+    The document ID is the SHA-256 of the document bytes (`digest`, if the caller already computed it, e.g. with
+    `DocumentStore.put`), so the same document is never extracted twice.
+    The fact sheet of the document is extracted once too, for the prefill prompts (see `app/context/facts.py`).
     """
+    filepath = filename or source
     logging.info(f"Loading {filepath} into context ...")
-    
+
+    if store is None:
+        store = get_document_store(os.path.join(os.getcwd(), os.getenv("SUPPORT_DOCS_PATH", "support_docs")))
+
+    doc_id = digest or (isinstance(source, str) and store.digest_from_path(source)) or source_digest(source)
+    cached_doc = store.get_document(doc_id)
+    record_cache("documents", cached_doc is not None)
+    if cached_doc:
+        logging.info(f"Loaded document {doc_id} from the document store")
+        # The fact sheet (or some of its chunks) may have failed or been disabled when the document was first loaded
+        return await extract_fact_sheet(cached_doc, store)
+
     try:
         if filepath.endswith(".docx"):
-            support_doc = word_document_loader(filepath)
+            doc_type, text_pieces = "docx", word_document_loader(source)
         elif filepath.endswith(".pdf"):
-            support_doc = pdf_document_loader(filepath)
+            doc_type, text_pieces = "pdf", pdf_document_loader(source)
         elif filepath.endswith(".txt"):
-            support_doc = text_document_loader(filepath)
+            doc_type, text_pieces = "text", text_document_loader(source)
+        elif filepath.lower().endswith((".png", ".jpg", ".jpeg")):
+            doc_type, text_pieces = "image", image_document_loader(source)
         else:
             logging.warning(f"Unsupported file type: {filepath}")
             return None
-            
-        if support_doc and support_doc.get("content"):
-            logging.info(f"Successfully loaded document. Loaded {len(support_doc['content'])} characters")
+
+        # Text extraction (and OCR) is blocking: run it in a worker thread to keep the event loop responsive
+        support_doc = await asyncio.to_thread(store.write_document, doc_id, {
+            "docId": doc_id,
+            "docType": doc_type,
+            "dateCreated": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }, text_pieces)
+
+        if support_doc["chunks"]:
+            logging.info(f"Successfully loaded document. Loaded {support_doc['size']} bytes in {len(support_doc['chunks'])} chunks")
         else:
             logging.warning(f"Warning: No content extracted from {filepath}")
-            
+
     except Exception as e:
         logging.error(f"Error loading document {filepath}: {str(e)}")
         return None
 
-    return support_doc
\ No newline at end of file
+    return await extract_fact_sheet(support_doc, store)
@@ -0,0 +1,131 @@
+import os
+import io
+import hashlib
+import logging
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+from app.utils.metrics import record_cache
+
+_pool = None
+
+def get_ocr_pool() -> ProcessPoolExecutor:
+    """
+    Get the process pool used to run OCR jobs. The pool is created on first use and
+    bounded by the OCR_MAX_WORKERS environment variable (defaults to 2 workers).
+    """
+    global _pool
+    if _pool is None:
+        max_workers = int(os.getenv("OCR_MAX_WORKERS", "2"))
+        _pool = ProcessPoolExecutor(max_workers=max_workers)
+    return _pool
+
+def _otsu_threshold(histogram: List[int]) -> int:
+    """
+    Compute the Otsu threshold of a grayscale histogram (256 bins).
+    """
+    total = sum(histogram)
+    sum_all = sum(i * count for i, count in enumerate(histogram))
+    sum_background = 0
+    weight_background = 0
+    best_threshold = 127
+    best_variance = 0.0
+
+    for i, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
+            continue
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        sum_background += i * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_all - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_variance = variance
+            best_threshold = i
+    return best_threshold
+
+def _ocr_worker(image_bytes: bytes, max_dimension: int, language: str, timeout: int) -> str:
+    """
+    Run OCR on a single image. This function is executed in a worker process.
+
+    The image is downscaled so that its largest side is at most `max_dimension` pixels,
+    converted to grayscale and binarized, which keeps the OCR time predictable regardless
+    of the resolution of the scan.
+    """
+    from PIL import Image, ImageOps
+    import pytesseract
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("L")
+        image.thumbnail((max_dimension, max_dimension))
+        threshold = _otsu_threshold(image.histogram())
+        image = image.point(lambda p: 255 if p > threshold else 0, mode="1")
+        return pytesseract.image_to_string(image, lang=language, timeout=timeout).strip()
+
+def _cache_filepath(digest: str) -> str:
+    cache_path = os.path.join(os.getcwd(), os.getenv("OCR_CACHE_PATH", "ocr_cache"))
+    return os.path.join(cache_path, digest[:2], f"{digest}.txt")
+
+def _read_cache(digest: str) -> str | None:
+    try:
+        with open(_cache_filepath(digest), "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def _write_cache(digest: str, text: str) -> None:
+    filepath = _cache_filepath(digest)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    # Write to a temporary file first so that concurrent readers never see a partial entry
+    fd, tmp_filepath = tempfile.mkstemp(dir=os.path.dirname(filepath), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_filepath, filepath)
+
+def ocr_images(images: List[bytes | memoryview]) -> List[str]:
+    """
+    Extract the text of a list of images using a local OCR engine (Tesseract).
+
+    Results are cached by the SHA-256 of the image bytes, so the same scan is never OCR'd twice.
+    Cache misses are processed in parallel on the bounded OCR process pool.
+
+    Args:
+        images (List[bytes]): The raw bytes of each image (PNG, JPEG, etc.)
+
+    Returns:
+        List[str]: The text extracted from each image, in the same order as the input
+    """
+    max_dimension = int(os.getenv("OCR_MAX_DIMENSION", "2000"))
+    language = os.getenv("OCR_LANGUAGE", "eng")
+    timeout = int(os.getenv("OCR_TIMEOUT", "60"))
+
+    digests = [hashlib.sha256(image).hexdigest() for image in images]
+    results: Dict[str, str] = {}
+    futures = {}
+
+    for digest, image in zip(digests, images):
+        if digest in results or digest in futures:
+            continue
+        cached_text = _read_cache(digest)
+        record_cache("ocr", cached_text is not None)
+        if cached_text is not None:
+            logging.info(f"OCR cache hit for {digest}")
+            results[digest] = cached_text
+        else:
+            futures[digest] = get_ocr_pool().submit(_ocr_worker, bytes(image), max_dimension, language, timeout)
+
+    for digest, future in futures.items():
+        try:
+            text = future.result()
+        except Exception as e:
+            logging.error(f"Error running OCR on image {digest}: {str(e)}")
+            results[digest] = ""
+            continue
+        _write_cache(digest, text)
+        results[digest] = text
+
+    return [results[digest] for digest in digests]
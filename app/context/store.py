@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import logging
+import tempfile
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.models import SupportDoc
+from app.context.chunks import ChunkWriter
+from app.utils.files import FileSource, open_file_source, source_digest
+
+GC_INTERVAL_SECONDS = 600
+
+def _write_atomic(filepath: str, source: FileSource) -> None:
+    """
+    Write a file atomically: concurrent readers see either the previous content or the new one.
+    """
+    fd, tmp_filepath = tempfile.mkstemp(dir=os.path.dirname(filepath), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f, open_file_source(source) as src:
+            shutil.copyfileobj(src, f)
+        os.replace(tmp_filepath, filepath)
+    except BaseException:
+        os.unlink(tmp_filepath)
+        raise
+
+class DocumentStore:
+    """
+    Content-addressed store for uploaded documents.
+
+    Every document is keyed on the SHA-256 of its bytes, so the same document uploaded twice
+    (or by two users) is stored and extracted only once, and same-named files never overwrite
+    each other. The store layout is:
+
+        <root>/objects/<digest[:2]>/<digest>/blob<ext>   The document bytes (optional)
+        <root>/objects/<digest[:2]>/<digest>/content.txt The extracted text of the document
+        <root>/objects/<digest[:2]>/<digest>/index.json  Inverted index of the terms of each chunk
+        <root>/objects/<digest[:2]>/<digest>/facts.json  Fact sheet of the document (see app/context/facts.py)
+        <root>/objects/<digest[:2]>/<digest>/facts_failed.json  Chunks left out of the fact sheet (retried)
+        <root>/objects/<digest[:2]>/<digest>/doc.json    Document and chunk metadata
+        <root>/refs/<session_id>/<digest>                 References held by each session
+
+    Writes are atomic and the store is guarded by a file lock, so it's safe to share between
+    concurrent sessions and processes. Entries that are not referenced by any session are
+    garbage collected by age and total size.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.objects_path = os.path.join(root, "objects")
+        self.refs_path = os.path.join(root, "refs")
+        os.makedirs(self.objects_path, exist_ok=True)
+        os.makedirs(self.refs_path, exist_ok=True)
+
+    @contextmanager
+    def _lock(self, exclusive: bool = False):
+        """
+        Writers take a shared lock and the garbage collector takes an exclusive lock, so an entry
+        is never collected while it's being written or referenced.
+        """
+        with open(os.path.join(self.root, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _entry_path(self, digest: str) -> str:
+        return os.path.join(self.objects_path, digest[:2], digest)
+
+    def blob_path(self, digest: str) -> Optional[str]:
+        """
+        Get the path of the stored bytes of a document, if they exist
+        """
+        entry_path = self._entry_path(digest)
+        try:
+            for filename in os.listdir(entry_path):
+                if filename.startswith("blob"):
+                    return os.path.join(entry_path, filename)
+        except FileNotFoundError:
+            pass
+        return None
+
+    def digest_from_path(self, filepath: str) -> Optional[str]:
+        """
+        Get the digest of a document from the path of its stored bytes.
+        Returns None if the path doesn't belong to this store.
+        """
+        entry_path = os.path.dirname(os.path.abspath(filepath))
+        if os.path.dirname(os.path.dirname(entry_path)) != os.path.abspath(self.objects_path):
+            return None
+        return os.path.basename(entry_path)
+
+    def put(self, source: FileSource, filename: str, session_id: Optional[str] = None, persist: bool = True, digest: Optional[str] = None) -> str:
+        """
+        Add a document to the store (if it's not already there) and return its digest.
+        If a session id is provided, the session is registered as a reference to the document.
+        If `persist` is False, the document bytes are not written to disk: the entry only holds
+        the cached extracted text of the document.
+        The digest of the document is computed unless the caller already has it.
+        Adding a document runs the garbage collector when it's due (see `maybe_gc`).
+        """
+        digest = digest or source_digest(source)
+        extension = os.path.splitext(filename)[1].lower()
+        with self._lock():
+            entry_path = self._entry_path(digest)
+            os.makedirs(entry_path, exist_ok=True)
+            if self.blob_path(digest) is not None:
+                logging.info(f"Document {filename} already in store ({digest})")
+            elif persist:
+                _write_atomic(os.path.join(entry_path, f"blob{extension}"), source)
+            os.utime(entry_path)
+            if session_id:
+                self._add_ref(digest, session_id)
+        self.maybe_gc()
+        return digest
+
+    def _add_ref(self, digest: str, session_id: str) -> None:
+        session_refs_path = os.path.join(self.refs_path, session_id)
+        os.makedirs(session_refs_path, exist_ok=True)
+        with open(os.path.join(session_refs_path, digest), "a"):
+            pass
+        os.utime(os.path.join(session_refs_path, digest))
+
+    def add_ref(self, digest: str, session_id: str) -> None:
+        """
+        Register a session as a reference to a document
+        """
+        with self._lock():
+            self._add_ref(digest, session_id)
+
+    def release(self, session_id: str) -> None:
+        """
+        Drop all the references held by a session
+        """
+        shutil.rmtree(os.path.join(self.refs_path, session_id), ignore_errors=True)
+
+    def get_document(self, digest: str) -> Optional[SupportDoc]:
+        """
+        Get the metadata of a document (its chunks are read from disk on demand), if it was
+        extracted before
+        """
+        entry_path = self._entry_path(digest)
+        try:
+            with open(os.path.join(entry_path, "doc.json"), "r", encoding="utf-8") as f:
+                support_doc = json.load(f)
+        except FileNotFoundError:
+            return None
+        support_doc["contentPath"] = os.path.join(entry_path, "content.txt")
+        support_doc["indexPath"] = os.path.join(entry_path, "index.json")
+        facts_path = os.path.join(entry_path, "facts.json")
+        support_doc["factsPath"] = facts_path if os.path.exists(facts_path) else None
+        support_doc["factsFailedChunks"] = []
+        if support_doc["factsPath"]:
+            try:
+                with open(os.path.join(entry_path, "facts_failed.json"), "r", encoding="utf-8") as f:
+                    support_doc["factsFailedChunks"] = json.load(f)
+            except FileNotFoundError:
+                pass
+        return support_doc
+
+    def write_document(self, digest: str, metadata: Dict[str, Any], text_pieces: Iterable[str]) -> SupportDoc:
+        """
+        Stream the extracted text of a document into the store, chunk by chunk, and save the
+        document metadata together with the chunk metadata and term index.
+        """
+        with self._lock():
+            entry_path = self._entry_path(digest)
+            os.makedirs(entry_path, exist_ok=True)
+            fd, tmp_content_path = tempfile.mkstemp(dir=entry_path, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    writer = ChunkWriter(f)
+                    for text in text_pieces:
+                        writer.write(text)
+                    writer.close()
+                os.replace(tmp_content_path, os.path.join(entry_path, "content.txt"))
+            except BaseException:
+                os.unlink(tmp_content_path)
+                raise
+            _write_atomic(os.path.join(entry_path, "index.json"), json.dumps(writer.index).encode("utf-8"))
+            # doc.json is written last: an entry is complete once it exists
+            document = dict(metadata, size=writer.size, chunks=writer.chunks)
+            _write_atomic(os.path.join(entry_path, "doc.json"), json.dumps(document).encode("utf-8"))
+        return self.get_document(digest)
+
+    def write_facts(self, digest: str, facts: List[Dict[str, Any]], failed_chunks: List[int] = None) -> SupportDoc:
+        """
+        Save the fact sheet of a document, with the chunks whose facts couldn't be extracted (to retry them)
+        """
+        with self._lock():
+            entry_path = self._entry_path(digest)
+            failed_path = os.path.join(entry_path, "facts_failed.json")
+            # The failed chunks are written first: a fact sheet is never complete by mistake
+            if failed_chunks:
+                _write_atomic(failed_path, json.dumps(failed_chunks).encode("utf-8"))
+            _write_atomic(os.path.join(entry_path, "facts.json"), json.dumps(facts).encode("utf-8"))
+            if not failed_chunks and os.path.exists(failed_path):
+                os.unlink(failed_path)
+        return self.get_document(digest)
+
+    def _referenced_digests(self, ref_ttl_seconds: float) -> set:
+        """
+        Collect the digests referenced by any session. References that haven't been touched
+        within `ref_ttl_seconds` belong to dead sessions and are removed.
+        """
+        now = time.time()
+        referenced = set()
+        for session_id in os.listdir(self.refs_path):
+            session_refs_path = os.path.join(self.refs_path, session_id)
+            for digest in os.listdir(session_refs_path):
+                ref_path = os.path.join(session_refs_path, digest)
+                if now - os.path.getmtime(ref_path) > ref_ttl_seconds:
+                    os.unlink(ref_path)
+                else:
+                    referenced.add(digest)
+            if not os.listdir(session_refs_path):
+                os.rmdir(session_refs_path)
+        return referenced
+
+    def gc(self, max_bytes: int, max_age_seconds: float, ref_ttl_seconds: float) -> List[str]:
+        """
+        Garbage collect unreferenced entries. Entries older than `max_age_seconds` are removed, then
+        the least recently used entries are removed until the store is smaller than `max_bytes`.
+
+        Returns:
+            The digests of the removed entries
+        """
+        removed = []
+        with self._lock(exclusive=True):
+            referenced = self._referenced_digests(ref_ttl_seconds)
+            now = time.time()
+            entries = []
+            total_bytes = 0
+            for prefix in os.listdir(self.objects_path):
+                for digest in os.listdir(os.path.join(self.objects_path, prefix)):
+                    entry_path = self._entry_path(digest)
+                    size = sum(entry.stat().st_size for entry in os.scandir(entry_path) if entry.is_file())
+                    total_bytes += size
+                    if digest not in referenced:
+                        entries.append((os.path.getmtime(entry_path), digest, size))
+
+            # Least recently used first
+            entries.sort()
+            for last_access, digest, size in entries:
+                if now - last_access > max_age_seconds or total_bytes > max_bytes:
+                    shutil.rmtree(self._entry_path(digest), ignore_errors=True)
+                    total_bytes -= size
+                    removed.append(digest)
+
+        if removed:
+            logging.info(f"Removed {len(removed)} unreferenced documents from {self.root}")
+        return removed
+
+    def maybe_gc(self) -> None:
+        """
+        Run the garbage collector if it hasn't run in the last GC_INTERVAL_SECONDS.
+        Limits are configured with the STORE_MAX_MB, STORE_MAX_AGE_HOURS and STORE_REF_TTL_HOURS
+        environment variables.
+        """
+        marker_path = os.path.join(self.root, ".last_gc")
+        try:
+            if time.time() - os.path.getmtime(marker_path) < GC_INTERVAL_SECONDS:
+                return
+        except FileNotFoundError:
+            pass
+        with open(marker_path, "a"):
+            pass
+        os.utime(marker_path)
+
+        self.gc(
+            max_bytes=int(os.getenv("STORE_MAX_MB", "1024")) * 1024 * 1024,
+            max_age_seconds=float(os.getenv("STORE_MAX_AGE_HOURS", "168")) * 3600,
+            ref_ttl_seconds=float(os.getenv("STORE_REF_TTL_HOURS", "24")) * 3600,
+        )
+
+_stores: Dict[str, DocumentStore] = {}
+
+def get_document_store(root: str) -> DocumentStore:
+    """
+    Get the document store located at `root` (one instance per root and process)
+    """
+    if root not in _stores:
+        _stores[root] = DocumentStore(root)
+    return _stores[root]
@@ -1,18 +1,47 @@
-import PyPDF2
 import io
-import streamlit as st
-import os
+import logging
+from typing import Dict, List, Tuple
 from app.models import DraftForm
+from app.form.draft import new_draft_form
+from app.form.layout import form_fingerprint, get_field_groups
+from app.form.computed import init_computed_fields
+from app.utils.files import FileSource, open_file_source
+from app.utils.metrics import instrumented
 
-def parse_pdf_form(form_filepath: str) -> DraftForm:
+def get_widget_geometry(reader) -> Dict[str, Tuple[int, List[float]]]:
+    """
+    Get the page and position ([x0, y0, x1, y1], in PDF points) of every field's widget, by field name.
+    Fields with several widgets (e.g. radio buttons) get the position of the first one.
+    """
+    geometry = {}
+    for page_index, page in enumerate(reader.pages):
+        annotations = page.get("/Annots")
+        for annotation in (annotations.get_object() if annotations is not None else []):
+            annotation = annotation.get_object()
+            if annotation.get("/Subtype") != "/Widget" or "/Rect" not in annotation:
+                continue
+            name = annotation.get("/T")
+            if name is None and "/Parent" in annotation:
+                name = annotation["/Parent"].get_object().get("/T")
+            if name is not None and str(name) not in geometry:
+                x0, y0, x1, y1 = [float(coordinate) for coordinate in annotation["/Rect"]]
+                geometry[str(name)] = (page_index, [min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)])
+    return geometry
+
+@instrumented("parse_pdf_form", kind="pdf")
+def parse_pdf_form(form_source: FileSource, form_filename: str = None) -> DraftForm:
     """
     Parse a PDF form and return the data as a dictionary in the required format.
+    The form can be a path on disk or an in-memory buffer (e.g. a Streamlit upload).
     """
+    import PyPDF2
+
     fields = []
     checkbox_groups = {}  # Dictionary to group checkboxes
+    geometry = {}
     
     try:
-        with open(os.path.join(os.getcwd(), form_filepath), "rb") as f:
+        with open_file_source(form_source) as f:
             reader = PyPDF2.PdfReader(f)
             if hasattr(reader, "get_fields") and callable(getattr(reader, "get_fields")):
                 pdf_fields = reader.get_fields()
@@ -20,6 +49,7 @@ def parse_pdf_form(form_filepath: str) -> DraftForm:
                 pdf_fields = None
                 
             if pdf_fields:
+                geometry = get_widget_geometry(reader)
                 # First pass: collect all checkboxes
                 for field_name, field in pdf_fields.items():
                     field_type = field.get("/FT")
@@ -43,9 +73,10 @@ def parse_pdf_form(form_filepath: str) -> DraftForm:
                                 options = [str(opt) for opt in opts] if isinstance(opts, list) else [str(opts)]
                         
                         # Check if it's a list box (multiple selection dropdown)
-                        if field.get("/Ff", 0) & 0x20000:  # 0x20000 is the flag for multiple selection
+                        if field.get("/Ff", 0) & 0x200000:  # 0x200000 is the flag for multiple selection (0x20000 is the combo box flag)
                             type_str = "list_box"
                         
+                        page, rect = geometry.get(field_name, (None, None))
                         fields.append({
                             "label": field_name,
                             "description": field.get("/TU", ""),
@@ -54,11 +85,14 @@ def parse_pdf_form(form_filepath: str) -> DraftForm:
                             "value": field.get("/V", ""),
                             "options": options,
                             "lastProcessed": "",
-                            "lastSurveyed": ""
+                            "lastSurveyed": "",
+                            "page": page,
+                            "rect": rect,
                         })
                 
                 # Second pass: add grouped checkboxes
                 for base_name, checkboxes in checkbox_groups.items():
+                    page, rect = geometry.get(checkboxes[0]["name"], (None, None))
                     fields.append({
                         "label": base_name,
                         "description": checkboxes[0]["description"],
@@ -67,21 +101,25 @@ def parse_pdf_form(form_filepath: str) -> DraftForm:
                         "value": [cb["value"] for cb in checkboxes],
                         "options": [cb["name"] for cb in checkboxes],
                         "lastProcessed": "",
-                        "lastSurveyed": ""
+                        "lastSurveyed": "",
+                        "page": page,
+                        "rect": rect,
                     })
     except Exception as e:
         raise Exception(f"Error parsing PDF form: {str(e)}")
         
-    return {
-        "formFileName": form_filepath,
-        "lastSaved": "",
-        "fields": fields
-    }
+    # The fields are grouped into logical blocks once per form template
+    fingerprint = form_fingerprint(fields)
+    # The fields computed from other fields (see app/form/computed.py) are neither prefilled nor asked
+    init_computed_fields(fields, fingerprint)
+    return new_draft_form(form_filename or (form_source if isinstance(form_source, str) else ""), fields, fingerprint, get_field_groups(fields, fingerprint))
 
 
-def fill_pdf_form(pdf_path: str, draft_form: DraftForm) -> bytes:
+@instrumented("fill_pdf_form", kind="pdf")
+def fill_pdf_form(pdf_source: FileSource, draft_form: DraftForm) -> bytes:
     """
     Fill the PDF form with the provided data and return the filled PDF as bytes.
+    The form can be a path on disk or an in-memory buffer (e.g. a Streamlit upload).
     Handles various types of PDF form fields including:
     - Text fields (/Tx)
     - Checkboxes (/Btn)
@@ -90,9 +128,11 @@ def fill_pdf_form(pdf_path: str, draft_form: DraftForm) -> bytes:
     - List boxes (/Ch with multiple selection)
     - Formatted fields
     """
+    import PyPDF2
+
     try:
         # Read the original PDF
-        with open(pdf_path, "rb") as f:
+        with open_file_source(pdf_source) as f:
             reader = PyPDF2.PdfReader(f)
             writer = PyPDF2.PdfWriter()
             
@@ -128,9 +168,10 @@ def fill_pdf_form(pdf_path: str, draft_form: DraftForm) -> bytes:
                 # For other fields, use the value as is
                 field_values[label] = value
             
-            # Update the writer's form fields
-            # TODO: Will this work for forms with more than one page?
-            writer.update_page_form_field_values(writer.pages[0], field_values)
+            # Update the writer's form fields, on every page with widgets
+            for page in writer.pages:
+                if "/Annots" in page:
+                    writer.update_page_form_field_values(page, field_values)
             
             # Write to bytes buffer
             output_buffer = io.BytesIO()
@@ -140,5 +181,5 @@ def fill_pdf_form(pdf_path: str, draft_form: DraftForm) -> bytes:
             return output_buffer.getvalue()
             
     except Exception as e:
-        st.error(f"Error filling PDF form: {str(e)}")
+        logging.error(f"Error filling PDF form: {str(e)}")
         raise Exception(f"Error filling PDF form: {str(e)}")
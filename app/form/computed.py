@@ -0,0 +1,329 @@
+"""
+Computed fields: form fields derived from other fields (e.g. the sums and differences of a tax form), computed
+locally instead of being prefilled or asked to the user.
+
+The rules of a form template are declared in a JSON file of FORM_RULES_PATH (defaults to app/docs/rules), keyed by
+the template's fingerprint (see `form_fingerprint` in app/form/layout.py):
+
+    {"fingerprint": "<fingerprint>", "fields": {"<label>": {"formula": "max(0, {<label>} - {<label>})"}}}
+
+A formula is an arithmetic expression (+, -, *, /, numbers, parentheses, min, max, abs and round) over other fields,
+referenced by label in braces. Empty inputs count as 0: a field is computed once one of its inputs has a value.
+The inputs only take numbers (see `is_valid_input`): an answer that isn't a number is rejected and asked again,
+with a hint that a number is expected (see `rejected_answers_hint`).
+The formulas of a template are compiled once into a dependency graph, so when some fields change, only the computed
+fields that depend on them are computed again, in dependency order.
+"""
+import os
+import re
+import ast
+import json
+import logging
+import operator
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from app.models import DraftForm
+from app.form.draft import change_batch, set_field_value, SOURCE_COMPUTED
+from app.form.fields import is_unset_value
+
+MAX_CACHED_TEMPLATES = 64
+
+REFERENCE_PATTERN = re.compile(r"\{([^{}]+)\}")
+FUNCTIONS = {"min": min, "max": max, "abs": abs, "round": round}
+OPERATORS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv}
+
+@dataclass(frozen=True)
+class ComputedField:
+    index: int
+    expression: ast.Expression  # The formula, with its inputs as names (_0, _1...)
+    inputs: Tuple[int, ...]  # Field indexes of the inputs
+
+@dataclass(frozen=True)
+class FormRules:
+    fields: Dict[int, ComputedField]  # Computed fields by index
+    order: Tuple[int, ...]  # Computed fields in dependency order (inputs first)
+    dependents: Dict[int, Tuple[int, ...]]  # Field index -> computed fields using it as an input
+
+_rule_files: Dict[str, Dict[str, Dict[str, Any]]] = {}
+_rules_cache: "OrderedDict[str, Optional[FormRules]]" = OrderedDict()
+_rules_lock = threading.Lock()
+
+def get_rules_path() -> str:
+    return os.getenv("FORM_RULES_PATH") or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "docs", "rules")
+
+def _load_rule_files(rules_path: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Read the rules of every template in the rules directory, once per directory
+
+    Returns:
+        The formulas of every template by label, by fingerprint
+    """
+    with _rules_lock:
+        if rules_path in _rule_files:
+            return _rule_files[rules_path]
+    templates = {}
+    if os.path.isdir(rules_path):
+        for filename in sorted(os.listdir(rules_path)):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(rules_path, filename), "r") as f:
+                    data = json.load(f)
+                templates[data["fingerprint"]] = {label: rule["formula"] for label, rule in data["fields"].items()}
+            except Exception as e:
+                logging.warning(f"Could not read the form rules {filename}: {str(e)}")
+    with _rules_lock:
+        _rule_files[rules_path] = templates
+    return templates
+
+def _check_expression(expression: ast.Expression) -> None:
+    for node in ast.walk(expression):
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or node.keywords:
+                raise ValueError(f"Unsupported function: {ast.unparse(node.func)}")
+        elif isinstance(node, ast.Name):
+            if node.id not in FUNCTIONS and not re.fullmatch(r"_\d+", node.id):
+                raise ValueError(f"Unknown name: {node.id} (fields are referenced by label in braces)")
+        elif isinstance(node, ast.Constant):
+            if not isinstance(node.value, (int, float)) or isinstance(node.value, bool):
+                raise ValueError(f"Unsupported constant: {node.value!r}")
+        elif isinstance(node, ast.BinOp):
+            if type(node.op) not in OPERATORS:
+                raise ValueError(f"Unsupported operator: {ast.unparse(node)}")
+        elif isinstance(node, ast.UnaryOp):
+            if not isinstance(node.op, (ast.USub, ast.UAdd)):
+                raise ValueError(f"Unsupported operator: {ast.unparse(node)}")
+        elif not isinstance(node, (ast.Expression, ast.Load, ast.operator, ast.unaryop)):
+            raise ValueError(f"Unsupported expression: {ast.unparse(node)}")
+
+def compile_formula(formula: str, label_index: Dict[str, int]) -> Tuple[ast.Expression, Tuple[int, ...]]:
+    """
+    Compile a formula, with its field references replaced by names (_0 for the first input, _1...)
+
+    Returns:
+        The expression and the field indexes of its inputs
+    """
+    inputs: List[int] = []
+
+    def reference(match: re.Match) -> str:
+        label = match.group(1)
+        if label not in label_index:
+            raise ValueError(f"Unknown field: {label}")
+        if label_index[label] not in inputs:
+            inputs.append(label_index[label])
+        return f"_{inputs.index(label_index[label])}"
+
+    expression = ast.parse(REFERENCE_PATTERN.sub(reference, formula).strip(), mode="eval")
+    _check_expression(expression)
+    return expression, tuple(inputs)
+
+def compile_rules(formulas: Dict[str, str], labels: List[str]) -> FormRules:
+    """
+    Compile the formulas of a template into its dependency graph (see the module's docstring)
+
+    Raises:
+        ValueError: If a formula is invalid, references an unknown field or the formulas depend on each other in a cycle
+    """
+    label_index = {label: i for i, label in enumerate(labels)}
+    fields = {}
+    for label, formula in formulas.items():
+        if label not in label_index:
+            raise ValueError(f"Unknown field: {label}")
+        expression, inputs = compile_formula(formula, label_index)
+        fields[label_index[label]] = ComputedField(label_index[label], expression, inputs)
+
+    dependents: Dict[int, List[int]] = {}
+    for field in fields.values():
+        for input_index in field.inputs:
+            dependents.setdefault(input_index, []).append(field.index)
+    # Topological order of the computed fields (Kahn's algorithm), in form order among independent fields
+    pending_inputs = {index: sum(1 for i in field.inputs if i in fields) for index, field in fields.items()}
+    ready = sorted(index for index, count in pending_inputs.items() if count == 0)
+    order = []
+    while ready:
+        index = ready.pop(0)
+        order.append(index)
+        for dependent in dependents.get(index, ()):
+            pending_inputs[dependent] -= 1
+            if pending_inputs[dependent] == 0:
+                ready.append(dependent)
+        ready.sort()
+    if len(order) < len(fields):
+        cycle = sorted(labels[index] for index, count in pending_inputs.items() if count > 0)
+        raise ValueError(f"The formulas of these fields depend on each other: {', '.join(cycle)}")
+    return FormRules(fields, tuple(order), {index: tuple(targets) for index, targets in dependents.items()})
+
+def get_form_rules(fields: List[Dict[str, Any]], fingerprint: str) -> Optional[FormRules]:
+    """
+    Get the compiled rules of a form template (see `compile_rules`), compiled once per template
+
+    Returns:
+        The rules, or None if the template has no rules (or invalid ones)
+    """
+    if not fingerprint:
+        return None
+    with _rules_lock:
+        if fingerprint in _rules_cache:
+            _rules_cache.move_to_end(fingerprint)
+            return _rules_cache[fingerprint]
+    formulas = _load_rule_files(get_rules_path()).get(fingerprint)
+    rules = None
+    if formulas:
+        try:
+            rules = compile_rules(formulas, [field["label"] for field in fields])
+        except (ValueError, SyntaxError) as e:
+            logging.warning(f"Invalid rules for the form template {fingerprint}: {str(e)}")
+    with _rules_lock:
+        _rules_cache[fingerprint] = rules
+        while len(_rules_cache) > MAX_CACHED_TEMPLATES:
+            _rules_cache.popitem(last=False)
+    return rules
+
+def parse_number(value: Any) -> Optional[float]:
+    """
+    Parse the value of an input field as a number ("1,234.50", "$12", "(300)" for -300)
+
+    Returns:
+        The number, or None if the field is empty
+
+    Raises:
+        ValueError: If the value isn't a number
+    """
+    if isinstance(value, list) or is_unset_value(value):
+        return None
+    text = str(value).strip().replace(",", "").replace("$", "").replace(" ", "")
+    if text.startswith("(") and text.endswith(")"):
+        text = f"-{text[1:-1]}"
+    return float(text) if text else None
+
+def is_valid_input(draft_form: DraftForm, index: int, value: Any) -> bool:
+    """
+    Whether a value can be set on a field: the inputs of computed fields only take numbers (or an empty value),
+    otherwise the fields computed from them couldn't be computed, and would never be asked either.
+    A field given an invalid value stays unanswered, so it's asked again (see `rejected_answers_hint`).
+    """
+    rules = get_form_rules(draft_form["fields"], draft_form.get("fingerprint"))
+    if rules is None or index not in rules.dependents:
+        return True
+    try:
+        parse_number(value)
+    except ValueError:
+        return False
+    return True
+
+def rejected_answers_hint(draft_form: DraftForm, indexes: Iterable[int]) -> str:
+    """
+    Tell the user why their last answers to some fields were rejected (see `is_valid_input`), before the fields
+    are asked again. Returns "" if none of the fields had an answer rejected.
+    """
+    rejected_answers = draft_form.get("rejectedAnswers") or {}
+    rejected = [str(rejected_answers[index]) for index in indexes if index in rejected_answers]
+    if not rejected:
+        return ""
+    answers = ", ".join(f'"{value}"' for value in rejected)
+    return f"{answers} {'is not a number' if len(rejected) == 1 else 'are not numbers'}: a number is expected here (e.g. 1,250.00)."
+
+def format_number(number: float) -> str:
+    number = round(number, 2)
+    return str(int(number)) if number == int(number) else f"{number:.2f}"
+
+def _evaluate(node: ast.AST, values: List[float]) -> float:
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body, values)
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Name):
+        return values[int(node.id[1:])]
+    if isinstance(node, ast.BinOp):
+        return OPERATORS[type(node.op)](_evaluate(node.left, values), _evaluate(node.right, values))
+    if isinstance(node, ast.UnaryOp):
+        operand = _evaluate(node.operand, values)
+        return -operand if isinstance(node.op, ast.USub) else operand
+    # A call (checked by `_check_expression`)
+    return FUNCTIONS[node.func.id](*[_evaluate(arg, values) for arg in node.args])
+
+def _is_undetermined(index: int, draft_form: DraftForm, rules: FormRules) -> bool:
+    """
+    Whether a computed field is empty because one of its inputs (directly or not) isn't a number
+    """
+    field = rules.fields.get(index)
+    if field is None or not is_unset_value(draft_form["fields"][index]["value"]):
+        return False
+    return any(
+        not is_unset_value(draft_form["fields"][i]["value"]) or _is_undetermined(i, draft_form, rules)
+        for i in field.inputs
+    )
+
+def compute_value(field: ComputedField, draft_form: DraftForm, rules: FormRules) -> str:
+    """
+    Compute the value of a field from the current values of its inputs
+
+    Returns:
+        The value, or "" if none of its inputs has a value or one of them isn't a number
+    """
+    fields = draft_form["fields"]
+    try:
+        numbers = [parse_number(fields[index]["value"]) for index in field.inputs]
+        if all(number is None for number in numbers):
+            return ""
+        # An empty computed input doesn't count as 0 when it couldn't be computed
+        if any(_is_undetermined(index, draft_form, rules) for index in field.inputs):
+            return ""
+        return format_number(_evaluate(field.expression, [number or 0.0 for number in numbers]))
+    except (ValueError, ArithmeticError):
+        return ""
+
+def init_computed_fields(fields: List[Dict[str, Any]], fingerprint: str) -> List[int]:
+    """
+    Mark the computed fields of a new form and compute them from the values already in the form, before the draft
+    form is created: they're part of the form's initial state, not changes to undo.
+
+    Returns:
+        The indexes of the computed fields
+    """
+    rules = get_form_rules(fields, fingerprint)
+    if rules is None:
+        return []
+    form = {"fields": fields}
+    for index in rules.order:
+        fields[index]["computed"] = True
+        fields[index]["value"] = compute_value(rules.fields[index], form, rules)
+    return list(rules.order)
+
+def recompute_fields(draft_form: DraftForm, changed_indexes: Optional[Iterable[int]] = None) -> List[int]:
+    """
+    Compute again the fields that depend on the changed fields, directly or through other computed fields
+    (and the changed fields themselves if they're computed, e.g. after an undo). The computed values are set like
+    any other value (see `set_field_value`), in the same revision as the changes that caused them when called in
+    their `change_batch`, so they're undone together.
+
+    Args:
+        draft_form: The form (updated in place)
+        changed_indexes: The fields whose value changed. Defaults to all the fields.
+
+    Returns:
+        The indexes of the computed fields whose value changed
+    """
+    fields = draft_form["fields"]
+    rules = get_form_rules(fields, draft_form.get("fingerprint"))
+    if rules is None:
+        return []
+    if changed_indexes is None:
+        affected = set(rules.fields)
+    else:
+        pending = list(changed_indexes)
+        affected = {index for index in pending if index in rules.fields}
+        while pending:
+            for dependent in rules.dependents.get(pending.pop(), ()):
+                if dependent not in affected:
+                    affected.add(dependent)
+                    pending.append(dependent)
+
+    recomputed_indexes = []
+    with change_batch(draft_form):
+        for index in rules.order:
+            if index in affected and set_field_value(draft_form, index, compute_value(rules.fields[index], draft_form, rules), SOURCE_COMPUTED):
+                recomputed_indexes.append(index)
+    return recomputed_indexes
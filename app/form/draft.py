@@ -0,0 +1,162 @@
+from bisect import bisect_right
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from app.models import DraftForm, FieldChange, FormField
+from app.form.fields import FieldStore, blank_value
+
+# Sources of a field value
+SOURCE_FORM = "form"  # Value already in the PDF form
+SOURCE_PREFILL = "prefill"  # Value found in a support document (see the field's docId)
+SOURCE_USER = "user"  # Answer given by the user in the chat
+SOURCE_MEMORY = "memory"  # Answer confirmed by the user in a previous form (see app/form/memory.py)
+SOURCE_COMPUTED = "computed"  # Value computed from other fields (see app/form/computed.py)
+
+def new_draft_form(form_file_name: str, fields: List[FormField], fingerprint: str = "", groups: List[List[int]] = None) -> DraftForm:
+    """
+    Create a versioned draft form, with its fields in an indexed field store (see app/form/fields.py).
+    Every field starts at revision 0. Without `groups` (see app/form/layout.py), every field is in a group of its own.
+    """
+    for field in fields:
+        field["revision"] = 0
+        field["source"] = SOURCE_FORM if field["value"] else None
+    return {
+        "formFileName": form_file_name,
+        "lastSaved": "",
+        "revision": 0,
+        "changeLog": [],
+        "fields": FieldStore(fields),
+        "fingerprint": fingerprint,
+        "groups": groups if groups is not None else [[i] for i in range(len(fields))],
+        "rejectedAnswers": {},
+    }
+
+# The batch of changes in progress: [draft form, revision of the batch (None until its first change)]
+_change_batch: ContextVar[Optional[List[Any]]] = ContextVar("change_batch", default=None)
+
+@contextmanager
+def change_batch(draft_form: DraftForm) -> Iterator[None]:
+    """
+    Record the changes made to the form in the block under a single revision, so they're undone together
+    (e.g. the answers of a chat message and the fields computed from them, see app/form/computed.py).
+    Batches of the same form can be nested: the inner batch is part of the outer one.
+    """
+    batch = _change_batch.get()
+    if batch is not None and batch[0] is draft_form:
+        yield
+        return
+    token = _change_batch.set([draft_form, None])
+    try:
+        yield
+    finally:
+        _change_batch.reset(token)
+
+def set_field_value(draft_form: DraftForm, index: int, value: Any, source: str, doc_id: Optional[str] = None) -> Optional[FieldChange]:
+    """
+    Set the value of a field, bumping the form's revision and recording the change in the form's change log.
+    Within a `change_batch`, only the batch's first change bumps the revision.
+    Setting a field to the value it already has is a no-op.
+
+    Args:
+        draft_form: The draft form to update (updated in place)
+        index: Index of the field in the form
+        value: The new value
+        source: Where the value comes from (see the SOURCE_* constants)
+        doc_id: The support document the value comes from, if any
+
+    Returns:
+        The recorded change, or None if the value didn't change
+    """
+    field = draft_form["fields"][index]
+    if field["value"] == value and field["docId"] == doc_id:
+        return None
+
+    batch = _change_batch.get()
+    if batch is not None and batch[0] is draft_form and batch[1] is not None:
+        revision = batch[1]
+    else:
+        draft_form["revision"] += 1
+        revision = draft_form["revision"]
+        if batch is not None and batch[0] is draft_form:
+            batch[1] = revision
+    change = {
+        "revision": revision,
+        "index": index,
+        "value": value,
+        "source": source,
+        "docId": doc_id,
+        "previousValue": field["value"],
+        "previousSource": field["source"],
+        "previousDocId": field["docId"],
+        "previousRevision": field["revision"],
+    }
+    draft_form["changeLog"].append(change)
+    draft_form["fields"].set_value(index, value, doc_id)
+    field["source"] = source
+    field["revision"] = change["revision"]
+    return change
+
+def get_changes_since(draft_form: DraftForm, revision: int) -> List[FieldChange]:
+    """
+    Get the changes made to the form after the given revision, oldest first.
+    Only the changes after the revision are visited (the change log is ordered by revision).
+    """
+    change_log = draft_form["changeLog"]
+    start = bisect_right(change_log, revision, key=lambda change: change["revision"])
+    return change_log[start:]
+
+def get_changed_fields_since(draft_form: DraftForm, revision: int) -> Dict[int, Dict[str, Any]]:
+    """
+    Diff the current form against the given revision.
+
+    Returns:
+        The changed fields by index, as {"previousValue": <value at the revision>, "field": <current field>}.
+        Fields that were changed and then set back to their value at the revision are left out.
+    """
+    changed_fields = {}
+    for change in get_changes_since(draft_form, revision):
+        if change["index"] not in changed_fields:
+            changed_fields[change["index"]] = {"previousValue": change["previousValue"], "field": draft_form["fields"][change["index"]]}
+    return {
+        index: changed_field for index, changed_field in changed_fields.items()
+        if changed_field["field"]["value"] != changed_field["previousValue"]
+    }
+
+def undo_changes(draft_form: DraftForm, to_revision: Optional[int] = None) -> List[FieldChange]:
+    """
+    Undo the changes made after `to_revision` (by default, the last change or `change_batch`), newest first.
+    The fields go back to their values at that revision, but the form's revision isn't lowered: revision numbers
+    are never reused, so the revisions marked before the undo (e.g. by `get_changed_fields_since` callers) still
+    refer to the same changes.
+
+    Returns:
+        The undone changes
+    """
+    change_log = draft_form["changeLog"]
+    if to_revision is None:
+        to_revision = change_log[-1]["revision"] - 1 if change_log else draft_form["revision"]
+
+    undone_changes = []
+    while change_log and change_log[-1]["revision"] > to_revision:
+        change = change_log.pop()
+        field = draft_form["fields"][change["index"]]
+        draft_form["fields"].set_value(change["index"], change["previousValue"], change["previousDocId"])
+        field["source"] = change["previousSource"]
+        field["revision"] = change["previousRevision"]
+        undone_changes.append(change)
+    return undone_changes
+
+def clear_values_from_docs(draft_form: DraftForm, doc_ids: Iterable[str]) -> List[int]:
+    """
+    Clear the values that were found in the given support documents (e.g. documents that were removed),
+    using the form's provenance index: only the fields that came from these documents are visited.
+
+    Returns:
+        The indexes of the cleared fields
+    """
+    fields = draft_form["fields"]
+    cleared_indexes = sorted({index for doc_id in doc_ids for index in fields.indexes_from_doc(doc_id)})
+    with change_batch(draft_form):
+        for index in cleared_indexes:
+            set_field_value(draft_form, index, blank_value(fields[index]), SOURCE_PREFILL)
+    return cleared_indexes
@@ -0,0 +1,179 @@
+import re
+from bisect import bisect_left, insort
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+# Keys of a form field (see `FormField` in app/models.py). "error" is only set when prefilling the field failed.
+FIELD_KEYS = ("label", "description", "type", "docId", "value", "options", "lastProcessed", "lastSurveyed", "revision", "source", "page", "rect", "computed")
+
+class FieldRecord(Mapping):
+    """
+    A form field stored in slots instead of a dict, which takes a fraction of the memory.
+    It reads like a read-only dict (`field["value"]`, `dict(field)`, JSON encoding with `default=dict`).
+    Metadata can be set like in a dict, but the value and docId can only be changed through `FieldStore.set_value`
+    (see `set_field_value` in app/form/draft.py), which keeps the store's indexes up to date.
+    """
+    __slots__ = FIELD_KEYS + ("error",)
+
+    def __init__(self, label: str, description: str, type: str, docId: Optional[str], value: Any, options: List[str],
+                 lastProcessed: str = "", lastSurveyed: str = "", revision: int = 0, source: Optional[str] = None,
+                 page: Optional[int] = None, rect: Optional[List[float]] = None, computed: bool = False, error: Optional[str] = None):
+        self.label = label
+        self.description = description
+        self.type = type
+        self.docId = docId
+        self.value = value
+        self.options = options
+        self.lastProcessed = lastProcessed
+        self.lastSurveyed = lastSurveyed
+        self.revision = revision
+        self.source = source
+        self.page = page
+        self.rect = rect
+        self.computed = computed
+        self.error = error
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "error" and self.error is None or key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key in ("value", "docId"):
+            raise TypeError("Field values are set with set_field_value (see app/form/draft.py)")
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __iter__(self) -> Iterator[str]:
+        yield from FIELD_KEYS
+        if self.error is not None:
+            yield "error"
+
+    def __len__(self) -> int:
+        return len(FIELD_KEYS) + (self.error is not None)
+
+    def copy(self) -> Dict[str, Any]:
+        return dict(self)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+def is_empty(field: FieldRecord) -> bool:
+    return field.value == ""
+
+# Fields answered by choosing among their options
+CHOICE_FIELD_TYPES = ("dropdown", "list_box", "checkbox_group")
+
+def is_unset_value(value: Any) -> bool:
+    """
+    Whether a value doesn't answer its field: an empty value, no selected option or a checkbox group with every box off
+    """
+    if isinstance(value, list):
+        return all(item == "/Off" for item in value)
+    return value == ""
+
+def blank_value(field: FieldRecord) -> Any:
+    """
+    The value of a field with nothing chosen (e.g. every box of a checkbox group off)
+    """
+    if field["type"] == "checkbox_group":
+        return ["/Off"] * len(field["options"])
+    return [] if field["type"] == "list_box" else ""
+
+def is_unanswered(field: FieldRecord) -> bool:
+    """
+    Whether the field is still to be asked to the user. Computed fields (see app/form/computed.py) are never asked.
+    TODO: Extend this to support other field types
+    """
+    return field.value == "" and field.type == "text" and not field.computed
+
+# Words that don't tell fields apart: widget types and filler words
+NOISE_WORDS = {
+    "text", "box", "combo", "list", "check", "formatted", "field", "input", "the", "a", "an", "of", "your",
+    "enter", "please", "here", "and", "or", "to", "in", "on", "for", "if", "any", "line", "nr", "no",
+}
+# Words with the same meaning in form fields
+SYNONYMS = {
+    "given": "first", "forename": "first", "family": "last", "surname": "last", "street": "address",
+    "zip": "postcode", "postal": "postcode", "telephone": "phone", "mobile": "phone", "cell": "phone",
+    "mail": "email", "dob": "birth", "town": "city", "employer": "company", "ssn": "social",
+}
+
+def canonicalize_field(label: str, description: str) -> str:
+    """
+    Canonical text of a field: the words of its label and description, lower-cased, without noise words.
+    Machine-generated labels (e.g. "f1_01[0]") carry no meaning and are left out.
+    """
+    words = []
+    for text in (label, description):
+        if not text or re.search(r"[_\[\]]", text):
+            continue
+        # Split camelCase names (e.g. "firstName")
+        text = re.sub(r"([a-z])([A-Z])", r"\1 \2", text)
+        words.extend(SYNONYMS.get(word, word) for word in re.findall(r"[a-z]+|\d+", text.lower()) if word not in NOISE_WORDS)
+    return " ".join(dict.fromkeys(words))
+
+class FieldStore(list):
+    """
+    The fields of a draft form, with indexes kept up to date on every write:
+    - label -> field index
+    - ordered set of the empty fields (the form is complete when there are none)
+    - ordered set of the unanswered fields (empty text fields that aren't computed, which are asked to the user in order)
+    - provenance: support document ID -> fields whose value was found in that document
+
+    Finding the next field to ask and checking if the form is complete take O(1).
+    """
+    __slots__ = ("_label_index", "_empty", "_unanswered", "_provenance")
+
+    def __init__(self, fields: Iterable[Dict[str, Any]] = ()):
+        super().__init__(field if isinstance(field, FieldRecord) else FieldRecord(**field) for field in fields)
+        self._label_index = {field.label: i for i, field in enumerate(self)}
+        self._empty = [i for i, field in enumerate(self) if is_empty(field)]
+        self._unanswered = [i for i, field in enumerate(self) if is_unanswered(field)]
+        self._provenance: Dict[str, Set[int]] = {}
+        for i, field in enumerate(self):
+            if field.docId:
+                self._provenance.setdefault(field.docId, set()).add(i)
+
+    def index_of(self, label: str) -> Optional[int]:
+        return self._label_index.get(label)
+
+    def set_value(self, index: int, value: Any, doc_id: Optional[str] = None) -> None:
+        field = self[index]
+        if field.docId:
+            self._provenance[field.docId].discard(index)
+            if not self._provenance[field.docId]:
+                del self._provenance[field.docId]
+        if doc_id:
+            self._provenance.setdefault(doc_id, set()).add(index)
+        field.value = value
+        field.docId = doc_id
+        for indexes, included in ((self._empty, is_empty(field)), (self._unanswered, is_unanswered(field))):
+            position = bisect_left(indexes, index)
+            is_indexed = position < len(indexes) and indexes[position] == index
+            if included and not is_indexed:
+                insort(indexes, index)
+            elif not included and is_indexed:
+                del indexes[position]
+
+    def empty_indexes(self) -> List[int]:
+        return list(self._empty)
+
+    def unanswered_indexes(self) -> List[int]:
+        return list(self._unanswered)
+
+    def indexes_from_doc(self, doc_id: str) -> List[int]:
+        """
+        Get the fields whose value was found in the given support document
+        """
+        return sorted(self._provenance.get(doc_id, ()))
+
+    def first_unanswered(self) -> Optional[int]:
+        return self._unanswered[0] if self._unanswered else None
+
+    def unanswered_count(self) -> int:
+        return len(self._unanswered)
+
+    def is_complete(self) -> bool:
+        return not self._empty
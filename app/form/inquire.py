@@ -1,10 +1,6 @@
 from typing import Dict, List, TypedDict, Annotated, Union
 import os
-from langchain_ollama import ChatOllama
-from langgraph.graph import StateGraph, END
-from langgraph.graph.message import add_messages
-from langchain_core.messages import SystemMessage
-from app.utils.llm import clean_llm_response
+from app.utils.llm import ainvoke_llm, clean_llm_response
 from app.models import FormField
 
 async def field_surveyor(form_fields: List[FormField], unanswered_field: FormField) -> str:
@@ -43,11 +39,41 @@ async def text_field_surveyor(form_fields: List[FormField], unanswered_field: Fo
     Ask a polite and clear question that will help the user answer the field. /no_think
     """
 
-    model = ChatOllama(model=os.getenv("QUESTIONS_LLM"), temperature=0.0)
-    response = await model.ainvoke(PROMPT)
+    response = await ainvoke_llm("QUESTIONS_LLM", PROMPT, "text_field_surveyor")
     question = clean_llm_response(response.content)
     return question
 
+async def group_field_surveyor(form_fields: List[FormField], group_fields: List[FormField]) -> str:
+    """
+    Given a group of text fields that belong together in the form (e.g. the parts of a name or an address, see
+    app/form/layout.py), come up with one question that will solicit the information needed to answer all of them.
+    """
+    fields = "\n".join(
+        f"""<field>
+            <label>{field["label"]}</label>
+            <description>{field["description"]}</description>
+            <type>{field["type"]}</type>
+        </field>"""
+        for field in group_fields
+    )
+    PROMPT = f"""
+    You are a friendly and helpful assistant that wants to help a user answer a group of related fields in a form.
+    You are given information about the form fields and your goal is to come up with a single question that will solicit the information needed to answer all of them.
+
+    As context, take into account all the fields in the form and the user's previous answers:
+    <form>
+        {form_fields}
+    </form>
+    
+    The fields that the user needs to answer are:
+    {fields}
+
+    Ask a polite and clear question that will help the user answer all these fields in one reply. /no_think
+    """
+
+    response = await ainvoke_llm("QUESTIONS_LLM", PROMPT, "group_field_surveyor")
+    return clean_llm_response(response.content)
+
 def checkbox_field_surveyor(form_fields: List[FormField], unanswered_field: FormField) -> str:
     """
     Given a checkbox field, the goal is to come up with a question that will solicit the information needed to answer the field.
@@ -0,0 +1,98 @@
+"""
+Layout-aware grouping of form fields into logical blocks (name parts, address blocks, dependent rows...),
+so the user is asked one question per block instead of one per field.
+
+Text fields are grouped in form order: a field joins the previous field's group when it's on the same page as
+one of the group's fields and
+- on the same row, or
+- on the next row, close below it, with a label sharing a word with it (e.g. "Address 1" and "Address 2").
+The grouping is computed once per form template (see `form_fingerprint`).
+"""
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from app.form.fields import canonicalize_field, is_unanswered
+
+MAX_CACHED_TEMPLATES = 64
+
+_groups_cache: "OrderedDict[str, List[List[int]]]" = OrderedDict()
+_groups_cache_lock = threading.Lock()
+
+def form_fingerprint(fields: List[Dict[str, Any]]) -> str:
+    """
+    Fingerprint of a form template: its fields' names, types and geometry (not their values)
+    """
+    template = [[field["label"], field["type"], field.get("page"), field.get("rect")] for field in fields]
+    return hashlib.sha256(json.dumps(template).encode("utf-8")).hexdigest()
+
+def _label_words(field: Dict[str, Any]) -> set:
+    return {word for word in canonicalize_field(field["label"], field["description"]).split() if not word.isdigit()}
+
+def _same_row(rect: List[float], other: List[float]) -> bool:
+    overlap = min(rect[3], other[3]) - max(rect[1], other[1])
+    return overlap >= 0.5 * min(rect[3] - rect[1], other[3] - other[1])
+
+def _belongs_with(field: Dict[str, Any], previous: Dict[str, Any]) -> bool:
+    if field.get("rect") is None or previous.get("rect") is None or field.get("page") != previous.get("page"):
+        return False
+    rect, previous_rect = field["rect"], previous["rect"]
+    if _same_row(rect, previous_rect):
+        return True
+    # The next row, at most two field heights below
+    gap = previous_rect[1] - rect[3]
+    is_next_row = 0 <= gap <= 2 * (rect[3] - rect[1])
+    return is_next_row and bool(_label_words(field) & _label_words(previous))
+
+def group_fields(fields: List[Dict[str, Any]]) -> List[List[int]]:
+    """
+    Group the text fields of a form into logical blocks (see the module's docstring), up to FIELD_GROUP_MAX_SIZE
+    fields per block (defaults to 6). The other fields are in groups of their own.
+
+    Returns:
+        The field indexes of every group, in form order
+    """
+    max_size = int(os.getenv("FIELD_GROUP_MAX_SIZE", "6"))
+    groups = []
+    last_text_group = None
+    for index, field in enumerate(fields):
+        if field["type"] != "text":
+            groups.append([index])
+            continue
+        if last_text_group and len(last_text_group) < max_size and any(_belongs_with(field, fields[i]) for i in last_text_group):
+            last_text_group.append(index)
+        else:
+            last_text_group = [index]
+            groups.append(last_text_group)
+    return groups
+
+def get_field_groups(fields: List[Dict[str, Any]], fingerprint: Optional[str] = None) -> List[List[int]]:
+    """
+    Get the groups of a form's fields (see `group_fields`), computed once per template
+    """
+    fingerprint = fingerprint or form_fingerprint(fields)
+    with _groups_cache_lock:
+        if fingerprint in _groups_cache:
+            _groups_cache.move_to_end(fingerprint)
+            return [list(group) for group in _groups_cache[fingerprint]]
+    groups = group_fields(fields)
+    with _groups_cache_lock:
+        _groups_cache[fingerprint] = groups
+        while len(_groups_cache) > MAX_CACHED_TEMPLATES:
+            _groups_cache.popitem(last=False)
+    return [list(group) for group in groups]
+
+def get_pending_group(draft_form: Dict[str, Any]) -> List[int]:
+    """
+    Get the unanswered fields of the group of the next field to ask (the first unanswered one), which are asked together
+    """
+    fields = draft_form["fields"]
+    index = fields.first_unanswered()
+    if index is None:
+        return []
+    for group in draft_form.get("groups") or []:
+        if index in group:
+            return [i for i in group if i >= index and is_unanswered(fields[i])]
+    return [index]
@@ -0,0 +1,208 @@
+"""
+Answer memory: the values a user confirmed in previous forms (by downloading the filled form), used to fill
+the same fields of new forms (name, address, SSN, employer...) without prefill LLM calls or chat questions.
+
+It's opt-in (ANSWER_MEMORY=true) and stored locally, one file per user under ANSWER_MEMORY_PATH, encrypted
+with a key derived from ANSWER_MEMORY_KEY for that user. Fields are matched on the meaning of their label and
+description: the canonical text of a field is embedded in a hashed n-gram vector, and looked up with a
+nearest-neighbour search (cosine similarity of at least ANSWER_MEMORY_MIN_SIMILARITY). The least recently used
+answers are evicted beyond ANSWER_MEMORY_MAX_ENTRIES, and answers unused for ANSWER_MEMORY_MAX_AGE_DAYS expire.
+"""
+import os
+import hmac
+import json
+import time
+import zlib
+import base64
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import Dict, List, Optional
+import numpy as np
+from app.models import DraftForm
+from app.form.fields import canonicalize_field
+from app.form.draft import change_batch, set_field_value, SOURCE_MEMORY
+from app.form.computed import is_valid_input, recompute_fields
+from app.utils.metrics import record_cache
+
+VECTOR_SIZE = 1024
+
+def _feature_index(feature: str) -> int:
+    return zlib.crc32(feature.encode("utf-8")) % VECTOR_SIZE
+
+def embed_field(canonical_text: str) -> np.ndarray:
+    """
+    Embed a field's canonical text in a normalized vector of hashed word unigrams, bigrams and character trigrams
+    """
+    vector = np.zeros(VECTOR_SIZE, dtype=np.float32)
+    words = canonical_text.split()
+    for word in words:
+        vector[_feature_index(f"w:{word}")] += 1.0
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            vector[_feature_index(f"c:{padded[i:i + 3]}")] += 0.5
+    for first, second in zip(words, words[1:]):
+        vector[_feature_index(f"b:{first} {second}")] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def _numbers(canonical_text: str) -> List[str]:
+    return [word for word in canonical_text.split() if word.isdigit()]
+
+class AnswerMemory:
+    """
+    The confirmed answers of a user, as {"text": <canonical field text>, "label", "description", "value",
+    "lastUsed": <timestamp>, "uses"}, with their vectors in a matrix for the nearest-neighbour search.
+    """
+
+    def __init__(self, filepath: str, fernet):
+        self.filepath = filepath
+        self._fernet = fernet
+        self._lock = threading.Lock()
+        self.entries: List[Dict] = []
+        if os.path.exists(filepath):
+            try:
+                with open(filepath, "rb") as f:
+                    self.entries = json.loads(fernet.decrypt(f.read()))
+            except Exception as e:
+                logging.error(f"Could not read the answer memory {filepath}: {str(e)}")
+        self._vectors = self._build_vectors()
+
+    def _build_vectors(self) -> np.ndarray:
+        if not self.entries:
+            return np.zeros((0, VECTOR_SIZE), dtype=np.float32)
+        return np.vstack([embed_field(entry["text"]) for entry in self.entries])
+
+    def _nearest(self, text: str) -> Optional[int]:
+        if not len(self._vectors):
+            return None
+        similarities = self._vectors @ embed_field(text)
+        nearest = int(np.argmax(similarities))
+        min_similarity = float(os.getenv("ANSWER_MEMORY_MIN_SIMILARITY", "0.85"))
+        # Numbered fields (e.g. "Address 1" and "Address 2") only match the same numbers
+        if similarities[nearest] < min_similarity or _numbers(self.entries[nearest]["text"]) != _numbers(text):
+            return None
+        return nearest
+
+    def recall(self, label: str, description: str) -> Optional[str]:
+        """
+        Get the answer to the field closest to the given one, if any is close enough
+        """
+        text = canonicalize_field(label, description)
+        if not text:
+            return None
+        with self._lock:
+            nearest = self._nearest(text)
+            record_cache("answer_memory", nearest is not None)
+            if nearest is None:
+                return None
+            entry = self.entries[nearest]
+            entry["lastUsed"] = time.time()
+            entry["uses"] += 1
+            return entry["value"]
+
+    def remember(self, label: str, description: str, value: str) -> None:
+        text = canonicalize_field(label, description)
+        if not text or not value:
+            return
+        with self._lock:
+            for entry in self.entries:
+                if entry["text"] == text:
+                    entry.update(value=value, lastUsed=time.time())
+                    return
+            self.entries.append({"text": text, "label": label, "description": description, "value": value, "lastUsed": time.time(), "uses": 0})
+            self._vectors = np.vstack([self._vectors, embed_field(text)])
+
+    def evict(self) -> None:
+        """
+        Drop the expired answers and the least recently used ones beyond the size limit
+        """
+        max_entries = int(os.getenv("ANSWER_MEMORY_MAX_ENTRIES", "500"))
+        expires_at = time.time() - float(os.getenv("ANSWER_MEMORY_MAX_AGE_DAYS", "365")) * 86400
+        with self._lock:
+            entries = [entry for entry in self.entries if entry["lastUsed"] >= expires_at]
+            entries.sort(key=lambda entry: entry["lastUsed"], reverse=True)
+            if len(entries) != len(self.entries) or len(entries) > max_entries:
+                self.entries = entries[:max_entries]
+                self._vectors = self._build_vectors()
+
+    def save(self) -> None:
+        self.evict()
+        with self._lock:
+            token = self._fernet.encrypt(json.dumps(self.entries).encode("utf-8"))
+        directory = os.path.dirname(self.filepath)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_filepath = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(token)
+        os.replace(tmp_filepath, self.filepath)
+
+_memories: Dict[str, AnswerMemory] = {}
+_memories_lock = threading.Lock()
+
+def is_answer_memory_enabled() -> bool:
+    return os.getenv("ANSWER_MEMORY", "false").lower() == "true"
+
+def get_answer_memory(user_id: Optional[str]) -> Optional[AnswerMemory]:
+    """
+    Get the answer memory of a user (loaded once per process), or None if the answer memory is disabled.
+    The memory is encrypted with a key derived from ANSWER_MEMORY_KEY and the user ID: without the key,
+    the memory stays disabled.
+    """
+    if not user_id or not is_answer_memory_enabled():
+        return None
+    secret = os.getenv("ANSWER_MEMORY_KEY")
+    if not secret:
+        logging.warning("ANSWER_MEMORY is enabled but ANSWER_MEMORY_KEY is not set: the answer memory is disabled")
+        return None
+
+    from cryptography.fernet import Fernet
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+    # The file name doesn't reveal the user ID
+    filename = hmac.new(secret.encode("utf-8"), user_id.encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+    filepath = os.path.join(os.getcwd(), os.getenv("ANSWER_MEMORY_PATH", "answer_memory"), f"{filename}.bin")
+    with _memories_lock:
+        if filepath not in _memories:
+            key = HKDF(algorithm=hashes.SHA256(), length=32, salt=b"form-pilot-answer-memory", info=user_id.encode("utf-8")).derive(secret.encode("utf-8"))
+            _memories[filepath] = AnswerMemory(filepath, Fernet(base64.urlsafe_b64encode(key)))
+        return _memories[filepath]
+
+def recall_answers(draft_form: DraftForm, user_id: Optional[str]) -> List[int]:
+    """
+    Fill the unanswered fields of the form with the user's remembered answers, before prefilling the form
+    or asking the user: the fields filled from memory are neither prefilled nor asked.
+
+    Returns:
+        The indexes of the fields filled from memory
+    """
+    memory = get_answer_memory(user_id)
+    if memory is None:
+        return []
+    recalled_indexes = []
+    fields = draft_form["fields"]
+    with change_batch(draft_form):
+        for index in fields.unanswered_indexes():
+            value = memory.recall(fields[index]["label"], fields[index]["description"])
+            if value and is_valid_input(draft_form, index, value):
+                set_field_value(draft_form, index, value, SOURCE_MEMORY)
+                recalled_indexes.append(index)
+        recompute_fields(draft_form, recalled_indexes)
+    if recalled_indexes:
+        memory.save()
+    return recalled_indexes
+
+def remember_answers(draft_form: DraftForm, user_id: Optional[str]) -> None:
+    """
+    Remember the answers of the form's text fields, once the user confirmed them (e.g. by downloading the filled form).
+    Computed fields (see app/form/computed.py) are left out: they're derived from the form's other answers.
+    """
+    memory = get_answer_memory(user_id)
+    if memory is None:
+        return
+    for field in draft_form["fields"]:
+        if field["type"] == "text" and field["value"] and not field["computed"]:
+            memory.remember(field["label"], field["description"], str(field["value"]))
+    memory.save()
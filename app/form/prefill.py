@@ -1,40 +1,92 @@
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 import os
+import re
 import json
-from langchain_ollama import ChatOllama
-from langchain_core.prompts import ChatPromptTemplate
+import math
+import time
+import threading
+from collections import OrderedDict
+from langchain_core.messages import HumanMessage, SystemMessage
 from datetime import datetime
 from app.models import SupportDoc, FormField, DraftForm
-from app.utils.llm import get_llm
+from app.utils.llm import ainvoke_llm, clean_llm_response, response_logprobs
+from app.utils.model_manager import is_local_model, resolve_model
+from app.utils.metrics import instrumented, record_prefill_cascade
+from app.utils.scheduler import llm_context, PRIORITY_BULK
+from app.context.chunks import ChunkCache, select_chunks
+from app.context.facts import select_facts, facts_to_string
+from app.form.draft import change_batch, set_field_value, clear_values_from_docs, SOURCE_PREFILL
+from app.form.fields import CHOICE_FIELD_TYPES, is_unset_value
+from app.form.computed import is_valid_input, recompute_fields
 
-def doc_data_to_string(doc_data: Dict) -> str:
+def doc_data_to_string(doc_data: Dict, chunks: List[str]) -> str:
     """
-    Convert a document data dictionary to a string
+    Convert a document data dictionary and some of its chunks to a string
 
     Returns:
         A string of the form:
         <reference_start>
            Document ID: {doc_data['docId']}
-           Content: {doc_data['content']}
+           Content: {chunks}
         <reference_end>
     """
+    content = "\n...\n".join(chunks)
     return f"""
     <reference>
         <document_id>
             {doc_data['docId']}
         </document_id>
         <content>
-            {doc_data['content']}
+            {content}
         </content>
     </reference>
     """
 
+def build_field_context(field: FormField, docs_data: List[SupportDoc], chunk_cache: ChunkCache) -> str:
+    """
+    Build the context for a field from the facts of the documents' fact sheets that match the field (up to
+    PREFILL_MAX_FACTS, defaults to 20, see app/context/facts.py). The raw text is only used for the documents
+    without a fact sheet, or when no fact matches the field: then only the document chunks relevant to the field
+    are read from disk, and the context size is bounded by PREFILL_CONTEXT_CHARS (defaults to 12000 characters).
+    """
+    return build_context(f"{field['label']} {field['description']}", docs_data, chunk_cache)
+
+def build_context(query: str, docs_data: List[SupportDoc], chunk_cache: ChunkCache) -> str:
+    """
+    Build the context relevant to a query (e.g. a field's label and description, see `build_field_context`)
+    """
+    fact_docs = [doc for doc in docs_data if doc.get("factsPath")]
+    selected_facts = select_facts(query, fact_docs, chunk_cache, int(os.getenv("PREFILL_MAX_FACTS", "20")))
+    facts_by_doc = {}
+    for doc, fact in selected_facts:
+        facts_by_doc.setdefault(doc["docId"], (doc, []))[1].append(fact)
+    if selected_facts:
+        docs_data = [doc for doc in docs_data if not doc.get("factsPath")]
+
+    max_chars = int(os.getenv("PREFILL_CONTEXT_CHARS", "12000"))
+    selected_chunks = select_chunks(query, docs_data, chunk_cache, max_chars)
+    chunks_by_doc = {}
+    for doc, chunk_index in selected_chunks:
+        chunks_by_doc.setdefault(doc["docId"], (doc, []))[1].append(chunk_cache.get_chunk(doc, chunk_index))
+    return "\n".join(
+        [facts_to_string(doc, facts) for doc, facts in facts_by_doc.values()]
+        + [doc_data_to_string(doc, chunks) for doc, chunks in chunks_by_doc.values()]
+    )
+
+def facts_match(query: str, docs_data: List[SupportDoc], chunk_cache: ChunkCache) -> bool:
+    """
+    Whether the fact sheets cover a query: some fact matches it, or no document has a fact sheet.
+    Otherwise, the query needs the raw text of the documents (see `build_context`).
+    """
+    fact_docs = [doc for doc in docs_data if doc.get("factsPath")]
+    return not fact_docs or bool(select_facts(query, fact_docs, chunk_cache, 1))
+
 def parse_llm_response(response):
     """
     Parse the LLM response into a dictionary.
     """
-    # Remove markdown code blocks if present
-    content = response.strip()
+    # Remove the think tags (e.g. Qwen3) and markdown code blocks if present
+    content = clean_llm_response(response)
     
     # Remove ```json and ``` markers
     if content.startswith('```json'):
@@ -52,61 +104,180 @@ def parse_llm_response(response):
         # Ensure required keys exist with defaults
         return {
             "value": data.get("value", ""),
-            "docId": data.get("docId")
+            "docId": data.get("docId"),
+            "confidence": data.get("confidence"),
+            "evidence": data.get("evidence") or "",
         }
-    except json.JSONDecodeError as e:
+    except (json.JSONDecodeError, AttributeError) as e:
         raise ValueError(f"Failed to parse JSON: {e}")
 
-async def text_field_processor(field: FormField, context: str) -> FormField:
+def normalize_text(text: str) -> str:
+    return " ".join(str(text).split()).casefold()
+
+def check_answer(answer: Dict[str, Any], context: str) -> Optional[str]:
     """
-    Uses an LLM to find the answer to the field using the context data. If the context data is not enough for filling the field, leave the field empty.
+    Check an answer of the first model of the prefill cascade (see `cascade_text_field_processor`).
+
+    Returns:
+        Why the answer must be escalated ("low_confidence" or "evidence"), or None if it's accepted
     """
-    llm = get_llm("PREFILL_LLM")
+    try:
+        confidence = float(answer["confidence"])
+    except (TypeError, ValueError):
+        confidence = 0.0
+    if confidence < float(os.getenv("PREFILL_MIN_CONFIDENCE", "0.7")):
+        return "low_confidence"
+    # An empty answer needs no evidence. A value must be backed by a quote of the document it was found in.
+    if answer["value"] == "":
+        return None
+    evidence = normalize_text(answer["evidence"])
+    if not evidence or not answer["docId"] or str(answer["docId"]) not in context or evidence not in normalize_text(context):
+        return "evidence"
+    return None
 
-    SYSTEM_PROMPT = """
+# The instructions and the context come first, in the system message, and only the field changes between calls:
+# calls with the same context share a byte-identical prefix, which the model server reuses (KV cache)
+PREFILL_SYSTEM_PROMPT = """
         Your task is to find the answers for fields in a form.
-        You are given the following context to answer the fields:
-
-        <context>
-            {context}
-        </context>
-
         Respond with valid JSON only.
 
         Example of correct response:
-        {{"value": <field_value>, "docId": <document_id>}}
+        {{"value": <field_value>, "docId": <document_id>, "confidence": <number between 0 and 1>, "evidence": <exact quote of the document that contains the value>}}
 
         You can only use the context to answer the fields. 
         If the context is not enough to answer, you can only return an empty value:
-        {{"value": "", "docId": null}}
+        {{"value": "", "docId": null, "confidence": <number between 0 and 1>, "evidence": ""}}
+
+        You are given the following context to answer the fields:
+
+        <context>
+            {context}
+        </context>
     """
-    prompt = ChatPromptTemplate([
-        ("system", SYSTEM_PROMPT),
-        ("user", """Please answer the following field:
+PREFILL_FIELD_PROMPT = """Please answer the following field:
             <field>
                 <label>
-                    {field[label]}
+                    {label}
                 </label>
                 <description>
-                    {field[description]}
+                    {description}
                 </description>
                 <type>
-                    {field[type]}
+                    {type}
                 </type>
             </field>
             If you don't know the answer, please return an empty value.
             """
-        )
-    ])
-    messages = prompt.format_messages(field=field, context=context)
+MAX_CACHED_PROMPTS = 32
+
+_shared_contexts: "OrderedDict[Tuple, Optional[str]]" = OrderedDict()
+_system_messages: "OrderedDict[str, SystemMessage]" = OrderedDict()
+_prompts_lock = threading.Lock()
+
+def _cache_get(cache: OrderedDict, key: Any, build: Callable[[], Any]) -> Any:
+    with _prompts_lock:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+    value = build()
+    with _prompts_lock:
+        cache[key] = value
+        while len(cache) > MAX_CACHED_PROMPTS:
+            cache.popitem(last=False)
+    return value
+
+def get_shared_context(docs_data: List[SupportDoc], chunk_cache: ChunkCache) -> Optional[str]:
+    """
+    Get the context shared by all the fields of the form: the fact sheets of the documents (see app/context/facts.py),
+    and the full text of the documents without a fact sheet. It's built once per set of documents (the context version:
+    documents are content-addressed), in document ID order, so all the prefill calls of the session get the same prompt
+    prefix (see `PREFILL_SYSTEM_PROMPT`).
+
+    The fields that no fact matches get their own context instead, with the raw text of the documents relevant
+    to them (see `facts_match`).
+
+    Returns:
+        The shared context, or None if it's larger than PREFILL_SHARED_CONTEXT_CHARS (defaults to PREFILL_CONTEXT_CHARS)
+        or PREFILL_SHARED_CONTEXT=false: then every field gets its own context (see `build_field_context`)
+    """
+    if os.getenv("PREFILL_SHARED_CONTEXT", "true").lower() != "true" or not docs_data:
+        return None
+    max_chars = int(os.getenv("PREFILL_SHARED_CONTEXT_CHARS") or os.getenv("PREFILL_CONTEXT_CHARS", "12000"))
+    docs_data = sorted(docs_data, key=lambda doc: doc["docId"])
+
+    def build() -> Optional[str]:
+        parts = []
+        total_chars = 0
+        for doc in docs_data:
+            facts = chunk_cache.get_facts(doc)
+            if facts:
+                parts.append(facts_to_string(doc, facts))
+                total_chars += len(parts[-1])
+            else:
+                total_chars += doc["size"]
+                if total_chars > max_chars:
+                    return None
+                parts.append(doc_data_to_string(doc, [chunk_cache.get_chunk(doc, chunk["index"]) for chunk in doc["chunks"]]))
+            if total_chars > max_chars:
+                return None
+        return "\n".join(parts)
+
+    version = (max_chars, tuple((doc["docId"], doc.get("factsPath"), tuple(doc.get("factsFailedChunks") or ())) for doc in docs_data))
+    return _cache_get(_shared_contexts, version, build)
+
+def prefill_system_message(context: str) -> SystemMessage:
+    """
+    Get the system message of the prefill calls with a context, built once per context
+    """
+    return _cache_get(_system_messages, context, lambda: SystemMessage(content=PREFILL_SYSTEM_PROMPT.format(context=context)))
+
+async def text_field_processor(field: FormField, context: str, type: str = "PREFILL_LLM", kind: str = "text_field_processor") -> Dict[str, Any]:
+    """
+    Uses an LLM to find the answer to the field using the context data. If the context data is not enough for filling the field, leave the field empty.
+
+    Args:
+        field: The field to answer
+        context: The context shared by all the fields (see `get_shared_context`), or the support documents' chunks
+            relevant to the field (see `build_field_context`)
+        type: The LLM to use (see `get_llm`)
+        kind: The call site, for the metrics
+
+    Returns:
+        The answer as {"value": <field value>, "docId": <document the value was found in>,
+        "confidence": <0 to 1>, "evidence": <quote of the document backing the value>}
+    """
+    messages = [
+        prefill_system_message(context),
+        HumanMessage(content=PREFILL_FIELD_PROMPT.format(label=field["label"], description=field["description"], type=field["type"])),
+    ]
+    response = await ainvoke_llm(type, messages, kind)
+    return parse_llm_response(response.content)
+
+async def cascade_text_field_processor(field: FormField, context: str) -> Dict[str, Any]:
+    """
+    Answer a text field with a cascade of models: the field goes to the small, fast PREFILL_LLM first.
+    Its answer is only escalated to the larger PREFILL_ESCALATION_LLM if it can't be parsed, its confidence
+    is below PREFILL_MIN_CONFIDENCE or its evidence isn't found in the context (see `check_answer`).
+    Without PREFILL_ESCALATION_LLM (or when both roles are served by the same model), the PREFILL_LLM answer is used as it is.
 
-    response = await llm.ainvoke(messages)
-    output_field = field.copy()
-    parsed_response = parse_llm_response(response.content)
-    output_field["value"] = parsed_response["value"]
-    output_field["docId"] = parsed_response["docId"]
-    output_field["lastProcessed"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    return output_field
+    Returns:
+        The answer as {"value": <field value>, "docId": <document the value was found in>}
+    """
+    # No cascade without an escalation model, or when the roles share a model (see app/utils/model_manager.py)
+    if not os.getenv("PREFILL_ESCALATION_LLM") or resolve_model("PREFILL_ESCALATION_LLM") == resolve_model("PREFILL_LLM"):
+        answer = await text_field_processor(field, context)
+        return {"value": answer["value"], "docId": answer["docId"]}
+
+    start = time.perf_counter()
+    try:
+        answer = await text_field_processor(field, context)
+        reason = check_answer(answer, context)
+    except ValueError:
+        reason = "parse_error"
+    record_prefill_cascade(reason, time.perf_counter() - start)
+    if reason:
+        answer = await text_field_processor(field, context, "PREFILL_ESCALATION_LLM", "text_field_processor_escalation")
+    return {"value": answer["value"], "docId": answer["docId"]}
 
 
 def format_pdf_value(value: Any, field_type: str, options: List[str] = None) -> Any:
@@ -128,140 +299,256 @@ def format_pdf_value(value: Any, field_type: str, options: List[str] = None) ->
         return str(value) if value is not None else ""
 
 
-async def checkbox_field_processor(field: FormField, context: str) -> FormField:
+CHOICE_FIELDS_PROMPT = """Please choose the options of the following fields:
+            <fields>
+                {fields}
+            </fields>
+            Only choose the options supported by the context. If no option is supported, answer null for a field
+            with one choice and [] for a field with several choices.
+            Respond with valid JSON only, with the numbers of the chosen options by field number, e.g.:
+            {example}
+            """
+CHOICE_FIELD_PROMPT = """<field number="{number}">
+                    <label>
+                        {label}
+                    </label>
+                    <description>
+                        {description}
+                    </description>
+                    <choices>
+                        {choices}
+                    </choices>
+                    <options>
+                        {options}
+                    </options>
+                </field>"""
+
+def choice_field_schema(field: FormField, doc_ids: List[str]) -> Dict[str, Any]:
     """
-    Process a checkbox field using the LLM.
+    JSON schema of the answer to a choice field: an option number (or null) for a dropdown, a list of distinct
+    option numbers for a list box or a checkbox group. With several documents, the answer also names the document.
     """
-    # TODO: Test implementation
-    try:
-        # Extract information from context
-        prompt = f"""Determine if the {field['label']} should be checked based on the following context.
-        Return a list of "/Yes" or "/Off" values for each checkbox in the group.
-        Context: {context}"""
-        
-        response = await get_llm().ainvoke(prompt)
-        value = response.content.strip()
-        
-        # Parse the response into a list of values
-        values = [v.strip() for v in value.split(",")]
-        values = [v if v in ["/Yes", "/Off"] else "/Off" for v in values]
-        
-        return {
-            "label": field["label"],
-            "type": field["type"],
-            "value": format_pdf_value(values, field["type"]),
-            "options": field.get("options", [])
-        }
-    except Exception as e:
-        return {
-            "label": field["label"],
-            "type": field["type"],
-            "value": ["/Off"] * len(field.get("options", [])),
-            "options": field.get("options", [])
-        }
-
+    numbers = list(range(1, len(field["options"]) + 1))
+    if field["type"] == "dropdown":
+        schema = {"enum": [None] + numbers}
+    else:
+        schema = {"type": "array", "items": {"enum": numbers}, "uniqueItems": True}
+    if len(doc_ids) < 2:
+        return schema
+    return {
+        "type": "object",
+        "properties": {"options": schema, "docId": {"enum": [None] + doc_ids}},
+        "required": ["options", "docId"],
+    }
 
-async def dropdown_field_processor(field: FormField, context: str) -> FormField:
+def choice_value(field: FormField, choice: Any) -> Any:
     """
-    Process a dropdown field using the LLM.
+    Convert the option numbers chosen by the model to the field's value (see `format_pdf_value`)
     """
-    # TODO: Test implementation
-    try:
-        # Extract information from context
-        prompt = f"""Select the most appropriate option for {field['label']} from the following options: {field['options']}
-        Based on the context: {context}
-        Return only the selected option."""
-        
-        response = await get_llm().ainvoke(prompt)
-        value = response.content.strip()
-        
-        # Validate the response is in the options list
-        if value not in field["options"]:
-            value = field["options"][0]
-        
-        return {
-            "label": field["label"],
-            "type": field["type"],
-            "value": format_pdf_value(value, field["type"], field["options"]),
-            "options": field["options"]
-        }
-    except Exception as e:
-        return {
-            "label": field["label"],
-            "type": field["type"],
-            "value": field["options"][0] if field["options"] else "",
-            "options": field["options"]
-        }
+    options = field["options"]
+    numbers = choice if isinstance(choice, list) else [choice]
+    chosen = [n for n in numbers if isinstance(n, int) and not isinstance(n, bool) and 1 <= n <= len(options)]
+    if field["type"] == "dropdown":
+        return options[chosen[0] - 1] if chosen else ""
+    if field["type"] == "list_box":
+        return [options[n - 1] for n in sorted(set(chosen))]
+    return ["/Yes" if n in chosen else "/Off" for n in range(1, len(options) + 1)]
 
+def choice_confidences(content: str, logprobs: Optional[List[Tuple[str, float]]]) -> Dict[str, float]:
+    """
+    Confidence of every answer of a choice response: the probability of the least likely token of the answer.
 
-async def list_box_field_processor(field: FormField, context: str) -> FormField:
+    Returns:
+        The confidence by field number, or {} if the log-probabilities don't match the response
     """
-    Process a list box field using the LLM.
+    if not logprobs or "".join(token for token, _ in logprobs) != content:
+        return {}
+    offsets = []
+    position = 0
+    for token, logprob in logprobs:
+        offsets.append((position, position + len(token), logprob))
+        position += len(token)
+    decoder = json.JSONDecoder()
+    confidences = {}
+    for match in re.finditer(r'"(\d+)"\s*:\s*', content):
+        try:
+            _, end = decoder.raw_decode(content, match.end())
+        except json.JSONDecodeError:
+            continue
+        span_logprobs = [logprob for start, stop, logprob in offsets if start < end and stop > match.end()]
+        if span_logprobs:
+            confidences[match.group(1)] = math.exp(min(span_logprobs))
+    return confidences
+
+async def choice_fields_processor(fields: List[FormField], context: str, doc_ids: List[str]) -> List[Dict[str, Any]]:
     """
-    # TODO: Test implementation
+    Answer a batch of choice fields (dropdowns, list boxes and checkbox groups) with one call: the model scores the
+    fields' fixed options, and its output is constrained to their numbers (see `choice_field_schema`), so it can't
+    answer an option that doesn't exist nor ramble. Where the model returns the log-probabilities of its tokens,
+    answers less likely than PREFILL_MIN_CONFIDENCE are left out (see `choice_confidences`).
+
+    Args:
+        fields: The fields to answer
+        context: The context shared by all the fields (see `get_shared_context`), or the support documents' chunks
+            relevant to the fields
+        doc_ids: The IDs of the support documents in the context
+
+    Returns:
+        The answers, in the order of the fields, as {"value": <field value>, "docId": <document the value was found in>}
+    """
+    prompts = []
+    for number, field in enumerate(fields, start=1):
+        options = "\n".join(f"{i}. {option}" for i, option in enumerate(field["options"], start=1))
+        choices = "one option" if field["type"] == "dropdown" else "any number of options"
+        prompts.append(CHOICE_FIELD_PROMPT.format(number=number, label=field["label"], description=field["description"], choices=choices, options=options))
+    example = '{"1": 2, "2": [1, 3], "3": null}' if len(doc_ids) < 2 else '{"1": {"options": 2, "docId": "<document_id>"}, "2": {"options": [], "docId": null}}'
+    messages = [
+        prefill_system_message(context),
+        HumanMessage(content=CHOICE_FIELDS_PROMPT.format(fields="\n".join(prompts), example=example)),
+    ]
+    schema = {
+        "type": "object",
+        "properties": {str(number): choice_field_schema(field, doc_ids) for number, field in enumerate(fields, start=1)},
+    }
+    # Local (Ollama) models don't return log-probabilities (see `_bind_output` in app/utils/llm.py)
+    use_logprobs = os.getenv("PREFILL_CHOICE_LOGPROBS", "true").lower() == "true" and not is_local_model(resolve_model("PREFILL_LLM"))
+    response = await ainvoke_llm("PREFILL_LLM", messages, "choice_fields_processor", output_schema=schema, logprobs=use_logprobs)
+    content = clean_llm_response(response.content).removeprefix("```json").removeprefix("```").removesuffix("```").strip()
     try:
-        # Extract information from context
-        prompt = f"""Select all applicable options for {field['label']} from the following options: {field['options']}
-        Based on the context: {context}
-        Return a comma-separated list of selected options."""
-        
-        response = await get_llm().ainvoke(prompt)
-        values = [v.strip() for v in response.content.split(",")]
-        
-        # Filter out invalid selections
-        values = [v for v in values if v in field["options"]]
-        
-        return {
-            "label": field["label"],
-            "type": field["type"],
-            "value": format_pdf_value(values, field["type"], field["options"]),
-            "options": field["options"]
-        }
-    except Exception as e:
-        return {
-            "label": field["label"],
-            "type": field["type"],
-            "value": [],
-            "options": field["options"]
-        }
+        data = json.loads(content)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Failed to parse JSON: {e}")
+    if not isinstance(data, dict):
+        raise ValueError("The choices are not a JSON object")
+    confidences = choice_confidences(content, response_logprobs(response)) if use_logprobs else {}
+    min_confidence = float(os.getenv("PREFILL_MIN_CONFIDENCE", "0.7"))
+
+    answers = []
+    for number, field in enumerate(fields, start=1):
+        answer = data.get(str(number))
+        doc_id = doc_ids[0] if len(doc_ids) == 1 else None
+        if isinstance(answer, dict):
+            doc_id = answer.get("docId") if answer.get("docId") in doc_ids else None
+            answer = answer.get("options")
+        if confidences.get(str(number), 1.0) < min_confidence:
+            answer = None
+        value = choice_value(field, answer)
+        answers.append({"value": value, "docId": doc_id if not is_unset_value(value) else None})
+    return answers
 
 
-async def prefill_in_memory_form(draft_form: DraftForm, docs_data: List[SupportDoc]) -> DraftForm:
+@instrumented("prefill_field_values", kind="prefill")
+async def prefill_field_values(draft_form: DraftForm, docs_data: List[SupportDoc], chunk_cache: ChunkCache = None, on_progress: Callable[[int, int], None] = None, indexes: List[int] = None) -> List[Dict[str, Any]]:
     """
-    Loops through all form fields and calls the corresponding field processor for each field.
+    Find values for the empty fields of the form in the support documents: every text field is answered by
+    its own call, and the choice fields are answered together (see `choice_fields_processor`). The form is only read: the values are applied by `apply_prefill_values`.
 
     Args:
-        draft_form: The form data to prefill
+        draft_form: The form to prefill
         docs_data: The supporting documents to use for context
+        chunk_cache: The session's cache of materialized document chunks (bounded by the session memory cap)
+        on_progress: Called with (processed fields, total fields) after each field is processed
+        indexes: Only prefill these fields (e.g. the fields cleared by `remove_support_docs`). Defaults to all the fields.
 
     Returns:
-        A dictionary with the updated form data
+        The values found, as {"index", "value", "docId", "lastProcessed"} (plus "error" if the field failed)
     """
-    form_fields = draft_form["fields"]
-    output_form = draft_form.copy()
-    output_fields = []
-    # supporting documents
-    context = "\n".join([doc_data_to_string(doc) for doc in docs_data])
+    if chunk_cache is None:
+        chunk_cache = ChunkCache()
+    # Fields that already have a value are left as they are
+    fields = draft_form["fields"]
+    candidate_indexes = range(len(fields)) if indexes is None else indexes
+    candidate_indexes = [i for i in candidate_indexes if is_unset_value(fields[i]["value"])]
+    # Computed fields (see app/form/computed.py) are computed from the prefilled values instead
+    text_fields = [(i, fields[i]) for i in candidate_indexes if fields[i]["type"] == "text" and not fields[i]["computed"]]
+    choice_fields = [(i, fields[i]) for i in candidate_indexes if fields[i]["type"] in CHOICE_FIELD_TYPES and fields[i]["options"]]
+    total = len(text_fields) + len(choice_fields)
+    prefill_values = []
 
-    for field in form_fields:
-        output_field = field.copy()  # Always start with a copy
+    def add_prefill_value(prefill_value: Dict[str, Any]) -> None:
+        prefill_value["lastProcessed"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        prefill_values.append(prefill_value)
+        if on_progress:
+            on_progress(len(prefill_values), total)
 
-        try:
-            if field["type"] == "text":
-                output_field = await text_field_processor(field, context)
-            elif field["type"] == "checkbox":
-                # output_field = checkbox_field_processor(field, context)
-                pass
-            elif field["type"] == "dropdown":
-                # output_field = dropdown_field_processor(field, context)
-                pass
-            else:
-                raise ValueError(f"Unsupported field type: {field['type']}")
-        except Exception as e:
-            output_field["lastProcessed"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            output_field["error"] = str(e)
+    # Prefill calls are background work: chat calls go first (see app/utils/scheduler.py)
+    with llm_context(priority=PRIORITY_BULK):
+        shared_context = get_shared_context(docs_data, chunk_cache) if total else None
+        for i, field in text_fields:
+            prefill_value = {"index": i, "value": "", "docId": None}
+            try:
+                if shared_context and facts_match(f"{field['label']} {field['description']}", docs_data, chunk_cache):
+                    context = shared_context
+                else:
+                    context = build_field_context(field, docs_data, chunk_cache)
+                prefill_value.update(await cascade_text_field_processor(field, context))
+            except Exception as e:
+                prefill_value["error"] = str(e)
+            add_prefill_value(prefill_value)
+
+        # The choice fields are answered in batches of PREFILL_CHOICE_BATCH_SIZE fields, one call per batch
+        batch_size = int(os.getenv("PREFILL_CHOICE_BATCH_SIZE", "25"))
+        doc_ids = [doc["docId"] for doc in docs_data]
+        for start in range(0, len(choice_fields), batch_size):
+            batch = choice_fields[start:start + batch_size]
+            batch_values = [{"index": i, "value": "", "docId": None} for i, _ in batch]
+            try:
+                query = " ".join(f"{field['label']} {field['description']}" for _, field in batch)
+                if shared_context and facts_match(query, docs_data, chunk_cache):
+                    context = shared_context
+                else:
+                    context = build_context(query, docs_data, chunk_cache)
+                answers = await choice_fields_processor([field for _, field in batch], context, doc_ids)
+                for prefill_value, answer in zip(batch_values, answers):
+                    prefill_value.update(answer)
+            except Exception as e:
+                for prefill_value in batch_values:
+                    prefill_value["error"] = str(e)
+            for prefill_value in batch_values:
+                add_prefill_value(prefill_value)
 
-        output_fields.append(output_field)
+    return prefill_values
 
-    output_form["fields"] = output_fields
-    return output_form
+def apply_prefill_values(draft_form: DraftForm, prefill_values: List[Dict[str, Any]]) -> DraftForm:
+    """
+    Apply the values found by `prefill_field_values` to the form, as one revision (see `change_batch`).
+    Fields that were answered in the meantime keep their answer. The fields computed from the prefilled fields
+    are computed again (see app/form/computed.py).
+    """
+    prefilled_indexes = []
+    with change_batch(draft_form):
+        for prefill_value in prefill_values:
+            field = draft_form["fields"][prefill_value["index"]]
+            field["lastProcessed"] = prefill_value["lastProcessed"]
+            if "error" in prefill_value:
+                field["error"] = prefill_value["error"]
+            if is_unset_value(field["value"]) and not is_unset_value(prefill_value["value"]) and is_valid_input(draft_form, prefill_value["index"], prefill_value["value"]):
+                set_field_value(draft_form, prefill_value["index"], prefill_value["value"], SOURCE_PREFILL, prefill_value["docId"])
+                prefilled_indexes.append(prefill_value["index"])
+        recompute_fields(draft_form, prefilled_indexes)
+    return draft_form
+
+async def prefill_in_memory_form(draft_form: DraftForm, docs_data: List[SupportDoc], chunk_cache: ChunkCache = None, on_progress: Callable[[int, int], None] = None, indexes: List[int] = None) -> DraftForm:
+    """
+    Prefill the empty fields of the form with the support documents (see `prefill_field_values`).
+    The form is updated in place: the changes are recorded in its change log.
+
+    Returns:
+        The updated form
+    """
+    prefill_values = await prefill_field_values(draft_form, docs_data, chunk_cache, on_progress, indexes)
+    return apply_prefill_values(draft_form, prefill_values)
+
+def remove_support_docs(draft_form: DraftForm, docs_data: List[SupportDoc], doc_ids: Set[str]) -> Tuple[List[SupportDoc], List[int]]:
+    """
+    Remove support documents from the context and clear the values that were found in them
+    (see `clear_values_from_docs`). Only the cleared fields need to be prefilled again, from the remaining documents.
+
+    Returns:
+        The remaining support documents and the indexes of the cleared fields
+    """
+    remaining_docs = [doc for doc in docs_data if doc["docId"] not in doc_ids]
+    with change_batch(draft_form):
+        cleared_indexes = clear_values_from_docs(draft_form, doc_ids)
+        recompute_fields(draft_form, cleared_indexes)
+    return remaining_docs, cleared_indexes
@@ -1,34 +1,43 @@
 from typing import Dict, List
 from app.models import DraftForm, FormField
+from app.form.draft import get_changed_fields_since, SOURCE_PREFILL
+from app.form.fields import is_unset_value
 
-def get_prefilled_fields_status(previous_form: DraftForm, current_form: DraftForm) -> Dict[str, List[FormField]]:
+def get_prefilled_fields_status(draft_form: DraftForm, since_revision: int) -> Dict[str, List[FormField]]:
     """
-    Compare the previous and current form fields.
+    Find the fields prefilled since the given revision of the form (from its change log) and the fields that are still empty.
 
     Returns a dictionary with the following keys:
     - prefilled_fields: List[FormField]
     - empty_fields: List[FormField]
     """
-    prefilled_fields = []
-    empty_fields = []
-
-    for i, field in enumerate(previous_form["fields"]):
-        # TODO: Extend this to support other field types
-        if field["value"] == "" and field["type"] == "text":
-            if (previous_form["fields"][i]["value"] == current_form["fields"][i]["value"]):
-                empty_fields.append(field)
-            else:
-                prefilled_fields.append(current_form["fields"][i])
+    prefilled_fields = [
+        changed_field["field"] for changed_field in get_changed_fields_since(draft_form, since_revision).values()
+        if is_unset_value(changed_field["previousValue"]) and changed_field["field"]["source"] == SOURCE_PREFILL
+    ]
+    fields = draft_form["fields"]
+    empty_fields = [fields[i] for i in fields.unanswered_indexes()]
     return {
         "prefilled_fields": prefilled_fields,
         "empty_fields": empty_fields
     }
 
+def get_reprefilled_fields_status(draft_form: DraftForm, indexes: List[int]) -> Dict[str, List[FormField]]:
+    """
+    Find which of the fields cleared when support documents were removed were prefilled again from the remaining documents.
+
+    Returns a dictionary with the following keys:
+    - prefilled_fields: List[FormField]
+    - empty_fields: List[FormField]
+    """
+    fields = [draft_form["fields"][i] for i in indexes]
+    return {
+        "prefilled_fields": [field for field in fields if not is_unset_value(field["value"])],
+        "empty_fields": [field for field in fields if is_unset_value(field["value"])]
+    }
+
 def check_if_form_complete(draft_form: DraftForm) -> bool:
     """
     Check if the form is complete.
     """
-    for field in draft_form["fields"]:
-        if field["value"] == "":
-            return False
-    return True
\ No newline at end of file
+    return draft_form["fields"].is_complete()
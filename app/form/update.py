@@ -1,17 +1,95 @@
+import os
 import re
+import json
+import logging
+from typing import Dict, List
 from app.models import DraftForm
+from app.form.draft import change_batch, set_field_value, SOURCE_USER
+from app.form.layout import get_pending_group
+from app.form.computed import is_valid_input, recompute_fields
+from app.utils.llm import ainvoke_llm, clean_llm_response
 
-def update_draft_form(draft_form: DraftForm, message: str) -> DraftForm:
+# A message that may answer several fields: a list of values (e.g. "John Smith, 123 Main St, Springfield IL 62704")
+MULTI_ANSWER_PATTERN = re.compile(r"[,;\n]| and ")
+
+def parse_extracted_answers(content: str, pending_indexes: List[int]) -> Dict[int, str]:
+    """
+    Parse the extracted answers ({"<field number>": "<value>"}) into values by field index
+    """
+    content = clean_llm_response(content).removeprefix("```json").removeprefix("```").removesuffix("```").strip()
+    data = json.loads(content)
+    if not isinstance(data, dict):
+        raise ValueError("The extracted answers are not a JSON object")
+    answers = {}
+    for number, value in data.items():
+        position = int(number) - 1
+        if 0 <= position < len(pending_indexes) and value not in (None, ""):
+            answers[pending_indexes[position]] = str(value).strip()
+    return answers
+
+async def extract_answers(draft_form: DraftForm, message: str) -> Dict[int, str]:
+    """
+    Map the user's message onto the next unanswered fields: a message like "John Smith, 123 Main St, Springfield IL 62704"
+    answers several fields at once. The extraction is limited to the next ANSWER_EXTRACTION_FIELDS unanswered fields
+    (defaults to 5, or the size of the group of fields asked) and only runs when the message looks like a list of values
+    or answers a group of fields asked together: otherwise, or if the extraction fails, the message answers the field
+    that was asked (the first unanswered one).
+
+    Returns:
+        The answers by field index
+    """
+    fields = draft_form["fields"]
+    # The fields of a logical block were asked together (see `get_pending_group`)
+    group = get_pending_group(draft_form)
+    max_fields = max(int(os.getenv("ANSWER_EXTRACTION_FIELDS", "5")), len(group))
+    pending_indexes = fields.unanswered_indexes()[:max_fields]
+    if not pending_indexes:
+        return {}
+    if len(pending_indexes) == 1 or (len(group) < 2 and not MULTI_ANSWER_PATTERN.search(message.strip())):
+        return {pending_indexes[0]: message}
+
+    pending_fields = "\n".join(
+        f'{number}. <label>{fields[index]["label"]}</label> <description>{fields[index]["description"]}</description>'
+        for number, index in enumerate(pending_indexes, start=1)
+    )
+    PROMPT = f"""
+    You are helping a user fill out a form. The user was asked for field 1 (or for several fields at once), and may have answered the next fields in the same message.
+
+    The next fields of the form, in order:
+    {pending_fields}
+
+    The user's message:
+    <message>
+        {message}
+    </message>
+
+    Extract the answers to these fields from the message. Respond with valid JSON only, mapping the number of each field answered in the message to its value, e.g.:
+    {{"1": "<value>", "2": "<value>"}}
+    Leave out the fields that the message doesn't answer. /no_think
+    """
+    llm_type = "ANSWER_EXTRACTION_LLM" if os.getenv("ANSWER_EXTRACTION_LLM") else "QUESTIONS_LLM"
+    try:
+        response = await ainvoke_llm(llm_type, PROMPT, "answer_extraction")
+        answers = parse_extracted_answers(response.content, pending_indexes)
+    except Exception as e:
+        logging.warning(f"Could not extract the answers from the message: {str(e)}")
+        answers = {}
+    return answers or {pending_indexes[0]: message}
+
+async def update_draft_form(draft_form: DraftForm, message: str) -> DraftForm:
     """
-    Update the draft form with the user's response.
-    We assume that the fields are in the same order as they are being asked by the `form_completion_node`
-    (see `app/chat_agent/graph.py`)
+    Update the draft form with the user's response, which answers the field that was asked (the first unanswered
+    text field, see `form_inquirer_node` in app/chat_agent/graph.py) and possibly the next ones (see `extract_answers`).
+    The fields answered are skipped in the question sequence, and the fields computed from them are computed again
+    (see app/form/computed.py). The changes are undone together.
     """
-    # TODO: Make this implementation more robust. It would be good to refactor with the code in `form_completion_node`
-    for i, field in enumerate(draft_form["fields"]):
-        # Check for the first unanswered field
-        # TODO: Extend this to support other field types
-        if field["value"] == "" and field["type"] == "text":
-            draft_form["fields"][i]["value"] = message
-            break
+    answers = await extract_answers(draft_form, message)
+    # An answer that isn't a number for an input of a computed field is asked again, with a hint
+    # (see `rejected_answers_hint` in app/form/computed.py)
+    draft_form["rejectedAnswers"] = {index: value for index, value in answers.items() if not is_valid_input(draft_form, index, value)}
+    answers = {index: value for index, value in answers.items() if index not in draft_form["rejectedAnswers"]}
+    with change_batch(draft_form):
+        for index, value in answers.items():
+            set_field_value(draft_form, index, value, SOURCE_USER)
+        recompute_fields(draft_form, answers)
     return draft_form
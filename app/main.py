@@ -1,13 +1,12 @@
 import streamlit as st
 import os
 import sys
-import asyncio
-import nest_asyncio
-from typing import List
+from typing import Any, Dict, List
 from datetime import datetime
 import json
 import io
-import copy
+import uuid
+import functools
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, ToolMessage
 from app.chat_agent.graph import create_chat_graph, ChatAgentState
 from app.chat_agent.helpers import is_form_question
@@ -15,22 +14,33 @@ from app.utils.setup import setup
 from app.utils.llm import clean_llm_response
 from app.doc_handlers.pdf import parse_pdf_form, fill_pdf_form
 from app.context.loader import load_file_into_context
-from app.form.prefill import prefill_in_memory_form
-from app.utils.misc import save_file_to_disk
+from app.context.store import get_document_store
+from app.context.chunks import ChunkCache
+from app.form.prefill import prefill_field_values, apply_prefill_values, remove_support_docs
+from app.utils.misc import save_file_to_disk, persist_uploads
+from app.utils.jobs import Job, get_job_runner
+from app.utils import event_loop
+from app.utils.metrics import start_metrics_server
+from app.utils.scheduler import llm_context, set_llm_session
+from app.utils.model_manager import start_model_manager
+from app.models import DraftForm, SupportDoc
+from streamlit.runtime.uploaded_file_manager import UploadedFile
 from app.form.update import update_draft_form
-from app.form.status import get_prefilled_fields_status, check_if_form_complete
-from app.chat_agent.helpers import feedback_on_file_upload, feedback_on_support_docs_update
+from app.form.memory import recall_answers, remember_answers
+from app.form.status import get_prefilled_fields_status, get_reprefilled_fields_status, check_if_form_complete
+from app.chat_agent.helpers import feedback_on_file_upload, feedback_on_support_docs_update, feedback_on_support_docs_removal
 
 setup()
-
-# Patches asyncio to allow nested event loops
-nest_asyncio.apply()
+# Warm up the local models in the background, once per process
+start_model_manager()
 
 DEFAULT_AI_GREETING = """
     Hello! 👋 I'm Form Pilot, your form assistant. Need to fill out a form? I'm here to help. Please start by uploading a form.
 """
 SUPPORT_DOCS_PATH = os.path.join(os.getcwd(), os.getenv("SUPPORT_DOCS_PATH"))
 FORMS_PATH = os.path.join(os.getcwd(), os.getenv("FORMS_PATH"))
+# The Streamlit app runs locally, for a single user (see app/form/memory.py)
+ANSWER_MEMORY_USER = os.getenv("ANSWER_MEMORY_USER", "local")
 
 # ---------- Streamlit Page Configuration ----------
 st.set_page_config(page_title="Form Pilot", layout="wide")
@@ -63,42 +73,196 @@ st.markdown("""
 def reset_session_state():
     """Clear all session state variables"""
     # TODO: Clear file uploaders too
+    if st.session_state.get("prefill_job_id"):
+        cancel_prefill_job()
+    if "session_id" in st.session_state:
+        get_document_store(SUPPORT_DOCS_PATH).release(st.session_state.session_id)
+        get_document_store(FORMS_PATH).release(st.session_state.session_id)
     for key in list(st.session_state.keys()):
         del st.session_state[key]
 
-async def on_support_docs_change():
-    """Process support docs whenever the uploader changes"""   
-    for doc in st.session_state.support_docs:
-        if doc.name not in st.session_state.uploaded_doc_names and st.session_state.main_form_path:
-            filepath = save_file_to_disk(doc, SUPPORT_DOCS_PATH)
-            support_doc = await load_file_into_context(filepath)
-            st.session_state.context_docs.append(support_doc)
-            prefilled_form = await prefill_in_memory_form(st.session_state.draft_form, st.session_state.context_docs)
-            st.session_state.draft_form = prefilled_form
-            st.session_state.uploaded_doc_names.append(doc.name)
-    
-    # TODO: Handle the removal of support docs
-    # For now, we're only addressing the addition of support docs, not the removal
-    fields_changes = get_prefilled_fields_status(st.session_state.previous_draft_form, st.session_state.draft_form)    
-    feedback = await feedback_on_support_docs_update(st.session_state.chat_graph, fields_changes)
+@st.cache_resource(show_spinner=False)
+def start_metrics_export():
+    """
+    Serve the metrics (see app/utils/metrics.py) on METRICS_PORT, once per process. Disabled if METRICS_PORT isn't set.
+    """
+    port = os.getenv("METRICS_PORT")
+    return start_metrics_server(int(port)) if port else None
+
+@st.cache_resource(show_spinner=False)
+def get_chat_graph():
+    """
+    Get the chat graph, compiled once per process and shared by all the sessions.
+    It's created on first use, which keeps LangGraph and the model clients out of the cold start.
+    """
+    return create_chat_graph()
+
+async def ingest_and_prefill(job: Job, docs: List[UploadedFile], context_docs: List[SupportDoc], draft_form: DraftForm, chunk_cache: ChunkCache, session_id: str, indexes: List[int] = None, removed_doc_names: List[str] = None) -> Dict[str, Any]:
+    """
+    Background job: load the new support docs into context and prefill the draft form with them.
+    When support docs were only removed, just the fields that were cleared (`indexes`) are prefilled again.
+    It runs outside of the Streamlit script, so it doesn't touch the session state: the result
+    is applied by `apply_prefill_result` once the job is done.
+    """
+    store = get_document_store(SUPPORT_DOCS_PATH)
+    loaded_docs = []
+    uploaded_docs = []
+    for doc in docs:
+        job.update(message=f"Reading {doc.name} ...")
+        # Streamlit holds the upload in memory: it's read as it is, without a copy
+        digest = store.put(doc, doc.name, session_id, persist=persist_uploads())
+        support_doc = await load_file_into_context(doc, doc.name, store, digest=digest)
+        if support_doc:
+            loaded_docs.append(support_doc)
+        uploaded_docs.append({"name": doc.name, "fileId": doc.file_id, "docId": support_doc["docId"] if support_doc else None})
+
+    def on_progress(processed_fields: int, total_fields: int):
+        job.update(progress=processed_fields / total_fields, message=f"Prefilling the form ({processed_fields}/{total_fields} fields) ...")
+
+    with llm_context(session_id=session_id):
+        prefill_values = await prefill_field_values(draft_form, context_docs + loaded_docs, chunk_cache, on_progress, indexes)
+    return {
+        "uploaded_docs": uploaded_docs,
+        "context_docs": loaded_docs,
+        "prefill_values": prefill_values,
+        "indexes": indexes,
+        "removed_doc_names": removed_doc_names or [],
+    }
+
+def apply_prefill_result(result: Dict[str, Any]):
+    """Apply the result of a prefill job to the session state"""
+    context_doc_ids = {doc["docId"] for doc in st.session_state.context_docs}
+    st.session_state.context_docs.extend(doc for doc in result["context_docs"] if doc["docId"] not in context_doc_ids)
+    for doc in result["uploaded_docs"]:
+        st.session_state.uploaded_docs[doc["name"]] = {"fileId": doc["fileId"], "docId": doc["docId"]}
+    # The job prefilled all the fields left to prefill (the cleared ones included)
+    st.session_state.cleared_field_indexes = []
+    # The user may have answered some fields while the job was running: their answers are kept
+    revision = st.session_state.draft_form["revision"]
+    apply_prefill_values(st.session_state.draft_form, result["prefill_values"])
+
+    if result["uploaded_docs"]:
+        fields_changes = get_prefilled_fields_status(st.session_state.draft_form, revision)
+        feedback = event_loop.run(feedback_on_support_docs_update(get_chat_graph(), fields_changes))
+    else:
+        fields_changes = get_reprefilled_fields_status(st.session_state.draft_form, result["indexes"])
+        feedback = feedback_on_support_docs_removal(result["removed_doc_names"], fields_changes)
     # Append it to the message history
     st.session_state.messages.extend(feedback)
-    st.session_state.previous_draft_form = copy.deepcopy(st.session_state.draft_form)
+
+def remove_support_docs_from_session(doc_names: List[str]) -> List[int]:
+    """
+    Remove support docs from the context and clear the fields whose values were found in them.
+
+    Returns:
+        The indexes of the cleared fields
+    """
+    removed_doc_ids = {st.session_state.uploaded_docs.pop(name)["docId"] for name in doc_names}
+    # The same document may have been uploaded under another name
+    removed_doc_ids -= {doc["docId"] for doc in st.session_state.uploaded_docs.values()}
+    removed_doc_ids.discard(None)
+    st.session_state.context_docs, cleared_indexes = remove_support_docs(
+        st.session_state.draft_form, st.session_state.context_docs, removed_doc_ids
+    )
+    return cleared_indexes
+
+def cancel_prefill_job():
+    """Cancel the session's prefill job, and drop its result if it's done but wasn't applied yet"""
+    job_runner = get_job_runner()
+    job_runner.cancel(st.session_state.prefill_job_id)
+    job_runner.pop(st.session_state.prefill_job_id)
+    st.session_state.prefill_job_id = None
+
+def on_support_docs_change():
+    """
+    Submit a background job to process the support docs whenever the uploader changes.
+    Removing (or replacing) a support doc clears the fields that were prefilled from it, and only these
+    fields are prefilled again, from the remaining support docs.
+    """
+    if st.session_state.main_form is None:
+        return
+    current_docs = {doc.name: doc for doc in st.session_state.support_docs}
+    uploaded_docs = st.session_state.uploaded_docs
+    removed_doc_names = [
+        name for name, uploaded_doc in uploaded_docs.items()
+        if name not in current_docs or current_docs[name].file_id != uploaded_doc["fileId"]
+    ]
+    new_docs = [doc for doc in current_docs.values() if doc.name not in uploaded_docs or doc.name in removed_doc_names]
+    if removed_doc_names:
+        cleared_indexes = remove_support_docs_from_session(removed_doc_names)
+        st.session_state.cleared_field_indexes = sorted(set(st.session_state.cleared_field_indexes) | set(cleared_indexes))
+
+    # The previous job was submitted for other docs: the docs still pending (not in `uploaded_docs` yet) are
+    # processed again by the new job, and the ones removed from the uploader are dropped with its result
+    if st.session_state.prefill_job_id:
+        cancel_prefill_job()
+    if not new_docs and not (st.session_state.cleared_field_indexes and st.session_state.context_docs):
+        if removed_doc_names:
+            # Nothing left to prefill the cleared fields from
+            fields_changes = get_reprefilled_fields_status(st.session_state.draft_form, st.session_state.cleared_field_indexes)
+            st.session_state.messages.extend(feedback_on_support_docs_removal(removed_doc_names, fields_changes))
+            st.session_state.cleared_field_indexes = []
+        return
+    job = get_job_runner().submit(
+        functools.partial(
+            ingest_and_prefill,
+            docs=new_docs,
+            context_docs=list(st.session_state.context_docs),
+            draft_form=st.session_state.draft_form,
+            chunk_cache=st.session_state.chunk_cache,
+            session_id=st.session_state.session_id,
+            # New docs can fill any empty field, otherwise only the cleared fields are prefilled again
+            indexes=None if new_docs else list(st.session_state.cleared_field_indexes),
+            removed_doc_names=removed_doc_names,
+        ),
+        name="prefill",
+        supersede_key=f"{st.session_state.session_id}:prefill",
+    )
+    st.session_state.prefill_job_id = job.id
+
+@st.fragment(run_every=1)
+def prefill_job_status():
+    """Poll the prefill job: show its progress while it runs and apply its result when it's done"""
+    job_runner = get_job_runner()
+    job = job_runner.get(st.session_state.prefill_job_id)
+    if job is not None and job.is_active:
+        st.progress(job.progress, text=job.message or "Processing support documents ...")
+        return
+
+    st.session_state.prefill_job_id = None
+    if job is not None:
+        job_runner.pop(job.id)
+        if job.status == "done":
+            apply_prefill_result(job.result)
+        elif job.status == "failed":
+            st.session_state.messages.append(AIMessage(content=f"Sorry, I could not process the support documents: {job.error}"))
+    st.rerun()
+
+start_metrics_export()
 
 # ---------- Initialize Session State ----------
-if "main_form_path" not in st.session_state:
-    st.session_state.main_form_path = None
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+# The session's LLM calls are shared fairly with other sessions' (see app/utils/scheduler.py)
+set_llm_session(st.session_state.session_id)
+if "main_form" not in st.session_state:
+    st.session_state.main_form = None
 if "support_docs" not in st.session_state:
-    st.session_state.uploaded_doc_names = []
+    # Uploaded support docs by name: {"fileId": <Streamlit upload ID>, "docId": <document ID>}
+    st.session_state.uploaded_docs = {}
+    # Fields cleared by removing support docs, waiting to be prefilled again
+    st.session_state.cleared_field_indexes = []
+if "prefill_job_id" not in st.session_state:
+    st.session_state.prefill_job_id = None
 if "context_docs" not in st.session_state:
     st.session_state.context_docs = []
+    # Document chunks are read from disk on demand and cached up to the session memory cap
+    st.session_state.chunk_cache = ChunkCache()
 if "draft_form" not in st.session_state:
-    st.session_state.previous_draft_form = None
     st.session_state.draft_form = None
 if "is_form_complete" not in st.session_state:
     st.session_state.is_form_complete = False
-if 'chat_graph' not in st.session_state:
-    st.session_state.chat_graph = create_chat_graph()
+if 'messages' not in st.session_state:
     st.session_state.messages = [
         SystemMessage(content="You are a friendly and helpful assistant responsible for helping a user fill out a form."),
         AIMessage(content=DEFAULT_AI_GREETING)]
@@ -113,12 +277,16 @@ with st.sidebar:
         type=["pdf"],
         key="main_form_uploader",
     )
-    if main_form and not st.session_state.main_form_path:
-        st.session_state.main_form_path = save_file_to_disk(main_form, FORMS_PATH)
+    if main_form and st.session_state.main_form is None:
+        # The form is kept in memory (no disk round trip) unless persistence is enabled
+        st.session_state.main_form = main_form
+        if persist_uploads():
+            save_file_to_disk(main_form, FORMS_PATH, st.session_state.session_id)
         # The initial draft form is just the parsed form (not prefilled)
-        st.session_state.draft_form = parse_pdf_form(st.session_state.main_form_path)
-        st.session_state.previous_draft_form = copy.deepcopy(st.session_state.draft_form)
-        feedback = asyncio.run(feedback_on_file_upload(st.session_state.chat_graph, st.session_state.messages, st.session_state.draft_form))
+        st.session_state.draft_form = parse_pdf_form(st.session_state.main_form, main_form.name)
+        # Fields the user already answered in previous forms are neither prefilled nor asked
+        recall_answers(st.session_state.draft_form, ANSWER_MEMORY_USER)
+        feedback = event_loop.run(feedback_on_file_upload(get_chat_graph(), st.session_state.messages, st.session_state.draft_form))
         # Append it to the message history
         st.session_state.messages.extend(feedback)
         st.rerun()
@@ -131,8 +299,10 @@ with st.sidebar:
         type=["pdf", "docx", "txt", "png", "jpg", "jpeg"],
         accept_multiple_files=True,
         key="support_docs",
-        on_change=lambda: asyncio.run(on_support_docs_change())
+        on_change=on_support_docs_change
     )
+    if st.session_state.prefill_job_id:
+        prefill_job_status()
 
 
 # ---------- Main Section: Assistant Chat ----------
@@ -145,7 +315,7 @@ with st.container():
         
         with col_b:
             if st.session_state.draft_form:
-                filled_pdf_bytes = fill_pdf_form(st.session_state.main_form_path, st.session_state.draft_form)
+                filled_pdf_bytes = fill_pdf_form(st.session_state.main_form, st.session_state.draft_form)
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                 pdf_filename = f"form_{timestamp}.pdf"
             
@@ -156,6 +326,9 @@ with st.container():
                     file_name=pdf_filename,
                     mime="application/pdf",
                     help="Download the filled form in PDF format",
+                    # Downloading the filled form confirms its answers
+                    on_click=remember_answers,
+                    args=(st.session_state.draft_form, ANSWER_MEMORY_USER),
                 )
                 st.markdown("</div>", unsafe_allow_html=True)
 
@@ -192,7 +365,7 @@ if not st.session_state.is_form_complete:
         is_user_responding_question = is_form_question(previous_message.content)
         if is_user_responding_question:
             # If the user is submitting an answer to a form field, we need to update the draft form
-            st.session_state.draft_form = update_draft_form(st.session_state.draft_form, user_message.content)
+            st.session_state.draft_form = event_loop.run(update_draft_form(st.session_state.draft_form, user_message.content))
         st.session_state.messages.append(user_message)
 
         # Display user message in chat history immediately
@@ -211,15 +384,15 @@ if not st.session_state.is_form_complete:
             state = ChatAgentState(
                 messages=st.session_state.messages, 
                 draft_form=st.session_state.draft_form,
-                form_filepath=st.session_state.main_form_path
+                form_filepath=st.session_state.draft_form["formFileName"]
             )
             
             # Process with the graph
             with st.chat_message("assistant"):
                 with st.spinner("Thinking..."):
                     try:
-                        # With nest_asyncio, this should work even in nested loops
-                        result = asyncio.run(st.session_state.chat_graph.ainvoke(state))
+                        # Runs on the process-wide event loop, where the LLM clients live
+                        result = event_loop.run(get_chat_graph().ainvoke(state))
                     except Exception as e:
                         st.error(f"Error processing request: {e}")
                     
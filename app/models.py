@@ -1,13 +1,18 @@
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 
 @dataclass
 class SupportDoc:
-    docId: str  # filepath + timestamp
-    docType: str  # "word", "pdf", or "text"
+    docId: str  # SHA-256 of the document bytes
+    docType: str  # "word", "pdf", "text" or "image"
     dateCreated: str  # ISO format timestamp
-    content: str  # The text content of the document
+    size: int  # Size of the extracted text in bytes
+    chunks: List[Dict[str, int]]  # Chunk offsets in the content file: {"index", "start", "end"}
+    contentPath: str  # Path of the extracted text on disk (chunks are read on demand)
+    indexPath: str  # Path of the inverted index of the terms of each chunk
+    factsPath: Optional[str]  # Path of the fact sheet of the document, if it was extracted (see app/context/facts.py)
+    factsFailedChunks: List[int]  # Chunks left out of the fact sheet because their extraction failed
 
 @dataclass
 class FormField:
@@ -19,9 +24,31 @@ class FormField:
     options: List[str]
     lastProcessed: str
     lastSurveyed: str
+    revision: int  # Form revision of the last change to the value
+    source: Optional[str]  # Where the value comes from: "form", "prefill", "user", "memory" or "computed" (see app/form/draft.py)
+    page: Optional[int]  # Page of the field's widget
+    rect: Optional[List[float]]  # Position of the field's widget on the page: [x0, y0, x1, y1], in PDF points
+    computed: bool  # Whether the value is computed from other fields (see app/form/computed.py)
+
+@dataclass
+class FieldChange:
+    revision: int  # Form revision created by the change
+    index: int  # Index of the changed field
+    value: str | List[str]
+    source: str
+    docId: Optional[str]
+    previousValue: str | List[str]
+    previousSource: Optional[str]
+    previousDocId: Optional[str]
+    previousRevision: int
 
 @dataclass
 class DraftForm:
     formFileName: str
     lastSaved: str
-    fields: List[FormField]
\ No newline at end of file
+    revision: int  # Incremented on every field change
+    changeLog: List[FieldChange]  # Ordered by revision
+    fields: List[FormField]  # A FieldStore of FieldRecords (see app/form/fields.py)
+    fingerprint: str  # Fingerprint of the form template (see app/form/layout.py)
+    groups: List[List[int]]  # Field indexes of the logical blocks of the form, asked together (see app/form/layout.py)
+    rejectedAnswers: Dict[int, str]  # Answers of the user's last message that were rejected, by field index (see app/form/update.py)
\ No newline at end of file
@@ -0,0 +1,46 @@
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import Future
+from typing import Any, Coroutine
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Get the process-wide event loop. It's created on first use and runs forever in a background
+    thread, so async resources (e.g. the HTTP connection pools of the LLM clients) live across
+    chat turns, uploads and background jobs.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="event-loop", daemon=True).start()
+    return _loop
+
+async def _run_in_context(coro: Coroutine, context: contextvars.Context) -> Any:
+    return await asyncio.get_running_loop().create_task(coro, context=context)
+
+def submit(coro: Coroutine) -> Future:
+    """
+    Schedule a coroutine on the process-wide event loop from any thread, without waiting for it.
+    The coroutine runs in a copy of the caller's context (e.g. the session its LLM calls are scheduled for,
+    see app/utils/scheduler.py).
+    """
+    return asyncio.run_coroutine_threadsafe(_run_in_context(coro, contextvars.copy_context()), get_event_loop())
+
+def run(coro: Coroutine, timeout: float = None) -> Any:
+    """
+    Run a coroutine on the process-wide event loop and wait for its result.
+    This is the thread-safe replacement for `asyncio.run` in the Streamlit script.
+    """
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    if running_loop is get_event_loop():
+        coro.close()
+        raise RuntimeError("run() can't be called from the event loop thread: await the coroutine instead")
+    return submit(coro).result(timeout)
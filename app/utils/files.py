@@ -0,0 +1,96 @@
+import os
+import io
+import shutil
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, Union
+
+# A document can be given as a path on disk, as bytes or as a binary buffer (e.g. a Streamlit UploadedFile)
+FileSource = Union[str, bytes, bytearray, memoryview, BinaryIO]
+
+class BufferReader(io.RawIOBase):
+    """
+    Read-only, seekable stream over a bytes-like object.
+    Unlike io.BytesIO, wrapping a memoryview doesn't copy the underlying buffer.
+    """
+
+    def __init__(self, buffer: bytes | bytearray | memoryview):
+        self._view = memoryview(buffer).cast("B")
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        size = min(len(b), len(self._view) - self._position)
+        b[:size] = self._view[self._position:self._position + size]
+        self._position += size
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        elif whence == io.SEEK_END:
+            self._position = len(self._view) + offset
+        self._position = max(self._position, 0)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+@contextmanager
+def open_file_source(source: FileSource) -> Iterator[BinaryIO]:
+    """
+    Open a file source as a seekable binary stream, without copying in-memory buffers.
+    Streams are rewound but not closed: they belong to the caller.
+    """
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            yield f
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        with BufferReader(source) as f:
+            yield f
+    else:
+        source.seek(0)
+        yield source
+        source.seek(0)
+
+def source_digest(source: FileSource) -> str:
+    """
+    Compute the SHA-256 hex digest of a file source without loading files on disk into memory
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(source).hexdigest()
+    with open_file_source(source) as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+def read_source_bytes(source: FileSource) -> bytes | memoryview:
+    """
+    Get the content of a file source as a bytes-like object, avoiding copies where possible
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return source
+    if isinstance(source, io.BytesIO):
+        return source.getvalue()
+    with open_file_source(source) as f:
+        return f.read()
+
+def _spool_threshold() -> int:
+    return int(os.getenv("UPLOAD_SPOOL_THRESHOLD_MB", "32")) * 1024 * 1024
+
+def detach_upload(file: BinaryIO) -> BinaryIO:
+    """
+    Copy an upload into a buffer owned by the caller, so it outlives the request it came from.
+    The copy stays in memory up to UPLOAD_SPOOL_THRESHOLD_MB and is spooled to a temporary file past that.
+    """
+    spooled_file = tempfile.SpooledTemporaryFile(max_size=_spool_threshold())
+    file.seek(0)
+    shutil.copyfileobj(file, spooled_file)
+    spooled_file.seek(0)
+    return spooled_file
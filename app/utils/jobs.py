@@ -0,0 +1,123 @@
+import uuid
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass, field
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional
+from app.utils.event_loop import submit
+
+@dataclass
+class Job:
+    id: str
+    name: str
+    status: str = "pending"  # "pending", "running", "done", "failed" or "cancelled"
+    progress: float = 0.0  # From 0 to 1
+    message: str = ""
+    result: Any = None
+    error: Optional[str] = None
+    supersede_key: Optional[str] = None
+    future: Optional[Future] = field(default=None, repr=False)
+
+    def update(self, progress: float = None, message: str = None) -> None:
+        """
+        Report the progress of the job. Called by the job itself.
+        """
+        if progress is not None:
+            self.progress = progress
+        if message is not None:
+            self.message = message
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in ("pending", "running")
+
+class JobRunner:
+    """
+    Runs jobs (coroutines) on the process-wide event loop living in a background thread, so they are
+    decoupled from the Streamlit script: a rerun or a disconnect doesn't interrupt them, and the
+    UI stays responsive while they run. The UI polls the job state with `get`.
+
+    Jobs submitted with the same `supersede_key` replace each other: submitting a new job
+    cancels the previous one if it's still running.
+    """
+
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        self._active_by_key: Dict[str, str] = {}
+        # Cancelling a job runs its done callback synchronously, which takes the lock again
+        self._lock = threading.RLock()
+
+    async def _run(self, job: Job, job_fn: Callable[[Job], Awaitable[Any]]) -> Any:
+        job.status = "running"
+        try:
+            job.result = await job_fn(job)
+            job.progress = 1.0
+            job.status = "done"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+        except Exception as e:
+            logging.exception(f"Job {job.name} ({job.id}) failed")
+            job.error = str(e)
+            job.status = "failed"
+        return job.result
+
+    def submit(self, job_fn: Callable[[Job], Awaitable[Any]], name: str, supersede_key: str = None) -> Job:
+        """
+        Submit a job. `job_fn` is an async function that receives the Job, so it can report its progress.
+        """
+        job = Job(id=uuid.uuid4().hex, name=name, supersede_key=supersede_key)
+        with self._lock:
+            if supersede_key and supersede_key in self._active_by_key:
+                self.cancel(self._active_by_key[supersede_key])
+                self._active_by_key.pop(supersede_key, None)
+            self._jobs[job.id] = job
+            if supersede_key:
+                self._active_by_key[supersede_key] = job.id
+        job.future = submit(self._run(job, job_fn))
+        job.future.add_done_callback(lambda _: self._on_done(job))
+        return job
+
+    def _on_done(self, job: Job) -> None:
+        with self._lock:
+            if job.future.cancelled():
+                job.status = "cancelled"
+                # Nobody collects the result of a cancelled (or superseded) job, so it's dropped here
+                self._jobs.pop(job.id, None)
+            if job.supersede_key and self._active_by_key.get(job.supersede_key) == job.id:
+                del self._active_by_key[job.supersede_key]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancel a job. Returns True if the job was still running.
+        """
+        job = self._jobs.get(job_id)
+        if job is None or not job.is_active:
+            return False
+        logging.info(f"Cancelling job {job.name} ({job.id})")
+        job.future.cancel()
+        return True
+
+    def pop(self, job_id: str) -> Optional[Job]:
+        """
+        Remove a finished job from the runner once its result has been collected.
+        Cancelled jobs are removed as soon as they stop.
+        """
+        return self._jobs.pop(job_id, None)
+
+_job_runner = None
+_job_runner_lock = threading.Lock()
+
+def get_job_runner() -> JobRunner:
+    """
+    Get the process-wide job runner
+    """
+    global _job_runner
+    with _job_runner_lock:
+        if _job_runner is None:
+            _job_runner = JobRunner()
+    return _job_runner
@@ -1,10 +1,24 @@
 import os
-from langchain_openai import ChatOpenAI
-from langchain_ollama import ChatOllama
+import json
+import time
+import asyncio
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+from app.utils.metrics import LLM_COALESCED_CALLS, record_llm_call
+from app.utils.model_manager import is_local_model, model_options, record_load_duration, resolve_model
+from app.utils.scheduler import get_scheduler
+
+_llm_clients = {}
+_llm_clients_lock = threading.Lock()
 
 def get_llm(type: str, temperature: float = 0.0):
     """
     Get an LLM instance based on the specified type.
+    Instances are created once per process and reused, so their async HTTP clients (and connection
+    pools) live across calls. They must only be used from the process-wide event loop
+    (see `app/utils/event_loop.py`). The model of a role is resolved by the model manager
+    (see app/utils/model_manager.py).
     
     Args:
         type (str): The type of LLM to use (PREFILL_LLM, QUESTIONS_LLM, ANSWER_JUDGE_LLM, etc.)
@@ -13,18 +27,155 @@ def get_llm(type: str, temperature: float = 0.0):
     Returns:
         An instance of either ChatOpenAI or ChatOllama
     """
-    model_name = os.getenv(type)
-    # TODO: use a more robust way to check if the model is an OpenAI model
-    is_openai_model = model_name.startswith("gpt")
+    model_name = resolve_model(type)
     if model_name is None:
         raise ValueError(f"Model name not found for {type}")
 
-    if is_openai_model:
+    key = (model_name, temperature)
+    with _llm_clients_lock:
+        if key not in _llm_clients:
+            _llm_clients[key] = _create_llm(model_name, temperature)
+        return _llm_clients[key]
+
+@dataclass(eq=False)
+class InFlightCall:
+    task: asyncio.Task
+    waiters: int = 0
+
+# Calls in flight by (event loop, model, temperature, prompt, output options), shared by identical concurrent calls
+_in_flight_calls: Dict[Tuple, InFlightCall] = {}
+_in_flight_calls_lock = threading.Lock()
+
+def _input_key(input: Any) -> str:
+    """
+    Key of a prompt: the role and content of its messages (message IDs and metadata are left out)
+    """
+    if hasattr(input, "to_messages"):
+        input = input.to_messages()
+    if isinstance(input, list):
+        input = [
+            [message.type, message.content] if hasattr(message, "content") else message
+            for message in input
+        ]
+    return json.dumps(input, sort_keys=True, default=str)
+
+def _bind_output(model, model_name: str, output_schema: Optional[Dict[str, Any]], logprobs: bool):
+    """
+    Constrain a model's output to a JSON schema (Ollama's structured outputs, OpenAI's JSON schema response format)
+    and ask for the log-probabilities of its tokens. Only OpenAI models are asked for log-probabilities: the Ollama
+    client rejects the option.
+    """
+    kwargs = {}
+    if output_schema is not None:
+        if is_local_model(model_name):
+            kwargs["format"] = output_schema
+        else:
+            kwargs["response_format"] = {"type": "json_schema", "json_schema": {"name": "response", "schema": output_schema}}
+    if logprobs and not is_local_model(model_name):
+        kwargs["logprobs"] = True
+    return model.bind(**kwargs) if kwargs else model
+
+def response_logprobs(response: Any) -> Optional[List[Tuple[str, float]]]:
+    """
+    Get the (token, log-probability) pairs of a response, or None if the model didn't return them
+    """
+    logprobs = (getattr(response, "response_metadata", None) or {}).get("logprobs")
+    # OpenAI nests the tokens in "content"
+    if isinstance(logprobs, dict):
+        logprobs = logprobs.get("content")
+    if not logprobs:
+        return None
+    return [(item["token"], item["logprob"]) for item in logprobs]
+
+async def ainvoke_llm(type: str, input: Any, kind: str, temperature: float = 0.0, output_schema: Optional[Dict[str, Any]] = None, logprobs: bool = False):
+    """
+    Call an LLM (see `get_llm`) and record the call's latency, tokens and errors (see app/utils/metrics.py).
+    All the LLM calls of the app go through this function. The calls are queued by the scheduler when the model
+    is busy (see app/utils/scheduler.py).
+
+    Identical concurrent calls (same model, temperature and prompt) are coalesced: they share one upstream call,
+    which is only cancelled if all of them go away.
+
+    Args:
+        type (str): The type of LLM to use (PREFILL_LLM, QUESTIONS_LLM, ANSWER_JUDGE_LLM, etc.)
+        input: The prompt or messages
+        kind (str): The call site, used to break down the metrics (e.g. "supervisor")
+        temperature (float, optional): The temperature for the model. Defaults to 0.0.
+        output_schema (dict, optional): A JSON schema the response must follow (see `_bind_output`)
+        logprobs (bool, optional): Return the log-probabilities of the response's tokens (see `response_logprobs`)
+
+    Returns:
+        The model's response message
+    """
+    model_name = resolve_model(type)
+    model = _bind_output(get_llm(type, temperature), model_name, output_schema, logprobs)
+    loop = asyncio.get_running_loop()
+    key = (loop, model_name, temperature, _input_key(input), json.dumps(output_schema, sort_keys=True), logprobs)
+    with _in_flight_calls_lock:
+        call = _in_flight_calls.get(key)
+        is_leader = call is None
+        if is_leader:
+            call = InFlightCall(loop.create_task(_invoke_llm(model, model_name, input, kind)))
+            _in_flight_calls[key] = call
+            call.task.add_done_callback(lambda _: _forget_call(key, call))
+        else:
+            LLM_COALESCED_CALLS.inc(kind=kind, model=model_name)
+        call.waiters += 1
+
+    try:
+        response = await asyncio.shield(call.task)
+    except asyncio.CancelledError:
+        with _in_flight_calls_lock:
+            call.waiters -= 1
+            is_last_waiter = call.waiters == 0
+            # The task may take a while to finish cancelling: an identical call made in the meantime starts a new one
+            if is_last_waiter and _in_flight_calls.get(key) is call:
+                del _in_flight_calls[key]
+        if is_last_waiter:
+            call.task.cancel()
+        raise
+    # The callers may change their response (e.g. add it to their chat history): each gets its own
+    return response if is_leader else response.model_copy(deep=True)
+
+def _forget_call(key: Tuple, call: InFlightCall) -> None:
+    with _in_flight_calls_lock:
+        if _in_flight_calls.get(key) is call:
+            del _in_flight_calls[key]
+
+async def _invoke_llm(model, model_name: str, input: Any, kind: str):
+    async with get_scheduler().slot(model_name):
+        start = time.perf_counter()
+        response = None
+        error = None
+        try:
+            response = await model.ainvoke(input)
+            record_load_duration(model_name, response)
+            return response
+        except Exception as e:
+            error = e.__class__.__name__
+            raise
+        finally:
+            usage = getattr(response, "usage_metadata", None) or {}
+            record_llm_call(
+                kind,
+                model_name,
+                time.perf_counter() - start,
+                usage.get("input_tokens", 0),
+                usage.get("output_tokens", 0),
+                error,
+            )
+
+def _create_llm(model_name: str, temperature: float):
+    # The model clients are imported on first use to keep the app's cold start fast
+    if not is_local_model(model_name):
         if not os.getenv("OPENAI_API_KEY"):
             raise ValueError("OPENAI_API_KEY environment variable is not set")
+        from langchain_openai import ChatOpenAI
         return ChatOpenAI(model=model_name, temperature=temperature)
     else:
-        return ChatOllama(model=model_name, temperature=temperature)
+        from langchain_ollama import ChatOllama
+        # The keep-alive and context size of the model (see `model_options`)
+        return ChatOllama(model=model_name, temperature=temperature, **model_options(model_name))
 
 def clean_llm_response(text):
     """
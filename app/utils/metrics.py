@@ -0,0 +1,267 @@
+"""
+Instrumentation of LLM calls, graph nodes and other hot paths.
+
+Metrics are kept in memory and exported in the Prometheus text format (see `render_prometheus`):
+served at /metrics by the API server, and by `start_metrics_server` for the Streamlit app.
+LLM calls and spans are also appended to a local JSONL trace when METRICS_TRACE_PATH is set.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _labels_key(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(labels: Labels, **extra: str) -> str:
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    escaped = [(key, value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for key, value in items]
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = _labels_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(_labels_key(labels), 0)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {value:g}")
+        return "\n".join(lines)
+
+class Gauge(Counter):
+    def render(self) -> str:
+        return super().render().replace(f"# TYPE {self.name} counter", f"# TYPE {self.name} gauge")
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # labels -> (bucket counts, sum, count)
+        self._values: Dict[Labels, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = _labels_key(labels)
+        with self._lock:
+            bucket_counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    bucket_counts[i] += 1
+            self._values[key] = [bucket_counts, total + value, count + 1]
+
+    def mean(self, **labels: Any) -> Optional[float]:
+        with self._lock:
+            _, total, count = self._values.get(_labels_key(labels)) or (None, 0.0, 0)
+        return total / count if count else None
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (bucket_counts, total, count) in sorted(self._values.items()):
+                for upper_bound, bucket_count in zip(self.buckets, bucket_counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(labels, le=f'{upper_bound:g}')} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_format_labels(labels, le='+Inf')} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {total:g}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines)
+
+LLM_CALLS = Counter("formpilot_llm_calls_total", "LLM calls by call site, model and status.")
+LLM_DURATION = Histogram("formpilot_llm_call_duration_seconds", "Latency of LLM calls.")
+LLM_TOKENS = Counter("formpilot_llm_tokens_total", "Prompt and completion tokens of LLM calls.")
+SPAN_DURATION = Histogram("formpilot_span_duration_seconds", "Latency of graph nodes and other instrumented functions.")
+SPAN_ERRORS = Counter("formpilot_span_errors_total", "Errors raised by graph nodes and other instrumented functions.")
+CACHE_REQUESTS = Counter("formpilot_cache_requests_total", "Cache lookups by cache and result (hit or miss).")
+PREFILL_CASCADE = Counter("formpilot_prefill_cascade_total", "Prefill answers of the first model, accepted or escalated (by reason).")
+PREFILL_CASCADE_SAVED = Counter(
+    "formpilot_prefill_cascade_saved_seconds_total",
+    "Estimated latency saved by accepted first-model answers (mean escalation latency minus first-model latency).",
+)
+PREFILL_CASCADE_OVERHEAD = Counter("formpilot_prefill_cascade_overhead_seconds_total", "First-model latency spent on escalated answers.")
+LLM_COALESCED_CALLS = Counter("formpilot_llm_coalesced_calls_total", "LLM calls served by an identical call already in flight.")
+LLM_QUEUE_DEPTH = Gauge("formpilot_llm_queue_depth", "LLM calls waiting for a model slot, by model and priority class.")
+LLM_QUEUE_WAIT = Histogram("formpilot_llm_queue_wait_seconds", "Time LLM calls waited for a model slot, by model and priority class.")
+MODEL_EVENTS = Counter("formpilot_model_events_total", "Local model loads, evictions (before the keep-alive expired) and expiries.")
+MODEL_LOADED = Gauge("formpilot_model_loaded", "Local models loaded in memory (1) or not (0).")
+MODEL_LOAD_DURATION = Histogram("formpilot_model_load_duration_seconds", "Load time reported by Ollama for warm-ups and calls, by model.")
+METRICS = (
+    LLM_CALLS, LLM_DURATION, LLM_TOKENS, LLM_COALESCED_CALLS, SPAN_DURATION, SPAN_ERRORS, CACHE_REQUESTS,
+    PREFILL_CASCADE, PREFILL_CASCADE_SAVED, PREFILL_CASCADE_OVERHEAD, LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT,
+    MODEL_EVENTS, MODEL_LOADED, MODEL_LOAD_DURATION,
+)
+
+_trace_lock = threading.Lock()
+
+def write_trace(event: Dict[str, Any]) -> None:
+    """
+    Append an event to the JSONL trace at METRICS_TRACE_PATH (no trace is written if it's not set)
+    """
+    trace_path = os.getenv("METRICS_TRACE_PATH")
+    if not trace_path:
+        return
+    line = json.dumps({"time": datetime.now(timezone.utc).isoformat(), **event}) + "\n"
+    try:
+        with _trace_lock:
+            os.makedirs(os.path.dirname(os.path.abspath(trace_path)), exist_ok=True)
+            with open(trace_path, "a", encoding="utf-8") as f:
+                f.write(line)
+    except OSError as e:
+        logging.warning(f"Could not write to the metrics trace {trace_path}: {str(e)}")
+
+def record_llm_call(kind: str, model: str, duration: float, prompt_tokens: int = 0, completion_tokens: int = 0, error: Optional[str] = None) -> None:
+    """
+    Record an LLM call.
+
+    Args:
+        kind: The call site (e.g. "supervisor", "text_field_processor")
+        model: The model name
+        duration: The call latency in seconds
+        prompt_tokens: Number of prompt tokens reported by the model
+        completion_tokens: Number of completion tokens reported by the model
+        error: The error type, if the call failed
+    """
+    LLM_CALLS.inc(kind=kind, model=model, status="error" if error else "ok")
+    LLM_DURATION.observe(duration, kind=kind, model=model)
+    LLM_TOKENS.inc(prompt_tokens, kind=kind, model=model, type="prompt")
+    LLM_TOKENS.inc(completion_tokens, kind=kind, model=model, type="completion")
+    write_trace({
+        "type": "llm",
+        "kind": kind,
+        "model": model,
+        "durationMs": round(duration * 1000, 3),
+        "promptTokens": prompt_tokens,
+        "completionTokens": completion_tokens,
+        "error": error,
+    })
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+def record_prefill_cascade(reason: Optional[str], duration: float) -> None:
+    """
+    Record an answer of the first model of the prefill cascade (see `cascade_text_field_processor` in app/form/prefill.py).
+    The escalation rate is escalated / (accepted + escalated). The latency saved by an accepted answer is estimated with
+    the mean latency of the escalation model so far.
+
+    Args:
+        reason: Why the answer was escalated, or None if it was accepted
+        duration: The latency of the first model, in seconds
+    """
+    saved = 0.0
+    if reason:
+        PREFILL_CASCADE.inc(outcome="escalated", reason=reason)
+        PREFILL_CASCADE_OVERHEAD.inc(duration)
+    else:
+        PREFILL_CASCADE.inc(outcome="accepted", reason="none")
+        escalation_latency = LLM_DURATION.mean(kind="text_field_processor_escalation", model=os.getenv("PREFILL_ESCALATION_LLM"))
+        if escalation_latency is not None:
+            saved = max(escalation_latency - duration, 0.0)
+            PREFILL_CASCADE_SAVED.inc(saved)
+    write_trace({"type": "cascade", "escalated": bool(reason), "reason": reason, "durationMs": round(duration * 1000, 3), "savedMs": round(saved * 1000, 3)})
+
+def record_model_event(model: str, event: str) -> None:
+    """
+    Record a local model being loaded ("load") or unloaded ("eviction" or "expiry"), see app/utils/model_manager.py
+    """
+    MODEL_EVENTS.inc(model=model, event=event)
+    if event == "load":
+        MODEL_LOADED.inc(model=model)
+    else:
+        MODEL_LOADED.dec(model=model)
+    logging.info(f"Model {model}: {event}")
+    write_trace({"type": "model", "model": model, "event": event})
+
+@contextmanager
+def span(name: str, kind: str) -> Iterator[None]:
+    """
+    Time a block of code (sync or async) and record its errors
+    """
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = e.__class__.__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        SPAN_DURATION.observe(duration, name=name, kind=kind)
+        if error:
+            SPAN_ERRORS.inc(name=name, kind=kind, error=error)
+        write_trace({"type": "span", "name": name, "kind": kind, "durationMs": round(duration * 1000, 3), "error": error})
+
+def instrumented(name: str, kind: str):
+    """
+    Decorator recording the latency and errors of a function or coroutine function (see `span`)
+    """
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name, kind):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, kind):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def render_prometheus() -> str:
+    return "\n".join(metric.render() for metric in METRICS) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Serve the metrics at http://<host>:<port>/metrics from a background thread
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
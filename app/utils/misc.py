@@ -1,12 +1,20 @@
 import os
 from streamlit.runtime.uploaded_file_manager import UploadedFile
+from app.context.store import get_document_store
 
-def save_file_to_disk(file: UploadedFile, path: str) -> str:
+def save_file_to_disk(file: UploadedFile, path: str, session_id: str = None) -> str:
     """
-    Save a file to disk and return the path.
+    Save a file to the content-addressed document store located at `path` and return the
+    path of the stored file. Files are keyed on the SHA-256 of their bytes, so uploading the
+    same file twice only stores it once, and same-named files never overwrite each other.
     """
-    os.makedirs(path, exist_ok=True)
-    filepath = os.path.join(path, file.name)
-    with open(filepath, "wb") as f:
-        f.write(file.read())
-    return filepath
\ No newline at end of file
+    store = get_document_store(path)
+    digest = store.put(file.getbuffer(), file.name, session_id)
+    return store.blob_path(digest)
+
+def persist_uploads() -> bool:
+    """
+    Whether uploaded files should be persisted to disk (opt-in with PERSIST_UPLOADS=true).
+    By default, uploads are only kept in memory (or in a temporary file when they are very large).
+    """
+    return os.getenv("PERSIST_UPLOADS", "false").lower() == "true"
@@ -0,0 +1,231 @@
+"""
+Lifecycle of the local (Ollama) models: which model serves each role, how long it stays loaded and with which
+context size, warm-up at startup and tracking of the loads and evictions.
+
+- Roles: the models are configured per role (PREFILL_LLM, QUESTIONS_LLM...). With several local models, they
+  evict each other from memory, and every switch pays the model load time. With MODEL_CONSOLIDATION=on, every
+  local role is served by one resident model (MODEL_RESIDENT_LLM, defaults to QUESTIONS_LLM). With
+  MODEL_CONSOLIDATION=auto, the roles are consolidated when the local models don't fit in
+  MODEL_MEMORY_BUDGET_MB together.
+- Options: keep_alive and num_ctx per role (<ROLE>_KEEP_ALIVE and <ROLE>_NUM_CTX, defaulting to MODEL_KEEP_ALIVE
+  and MODEL_NUM_CTX). Ollama reloads a model when it's called with another context size, so the roles sharing a
+  model share its options: the largest context size and the longest keep-alive.
+- Warm-up: `start_model_manager` loads the local models in the background at startup (MODEL_WARM_UP), so the
+  first prefill or question doesn't pay the load time, then watches the loaded models every
+  MODEL_MONITOR_INTERVAL seconds to record the loads, evictions and expiries (see `record_model_event`).
+"""
+import os
+import re
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from app.utils.metrics import MODEL_LOAD_DURATION, record_model_event
+
+# The roles of the app's models, the interactive ones first (they're warmed up first)
+ROLES = ("CHAT_LLM", "QUESTIONS_LLM", "ANSWER_EXTRACTION_LLM", "ANSWER_JUDGE_LLM", "PREFILL_LLM", "PREFILL_ESCALATION_LLM")
+
+_resident_model: Optional[str] = None
+_manager_thread: Optional[threading.Thread] = None
+_manager_lock = threading.Lock()
+
+def is_local_model(model_name: str) -> bool:
+    # TODO: use a more robust way to check if the model is an OpenAI model
+    return not model_name.startswith("gpt")
+
+def _local_roles() -> List[str]:
+    return [role for role in ROLES if os.getenv(role) and is_local_model(os.getenv(role))]
+
+def _get_resident_model() -> Optional[str]:
+    mode = os.getenv("MODEL_CONSOLIDATION", "off").lower()
+    if mode == "on":
+        return os.getenv("MODEL_RESIDENT_LLM") or os.getenv("QUESTIONS_LLM")
+    # Decided at startup (see `plan_consolidation`)
+    return _resident_model if mode == "auto" else None
+
+def resolve_model(type: str) -> Optional[str]:
+    """
+    Get the model serving a role: the role's model, or the resident model when the local roles are consolidated
+    """
+    model_name = os.getenv(type)
+    resident_model = _get_resident_model()
+    if model_name and resident_model and is_local_model(model_name):
+        return resident_model
+    return model_name
+
+_DURATION_UNITS = {"ns": 1e-9, "us": 1e-6, "µs": 1e-6, "ms": 1e-3, "s": 1, "m": 60, "h": 3600}
+_DURATION_PATTERN = re.compile(r"(\d+(?:\.\d*)?|\.\d+)(ns|us|µs|ms|s|m|h)")
+
+def _keep_alive_seconds(keep_alive: str) -> float:
+    """
+    Duration of an Ollama keep-alive: a number of seconds ("300") or a Go duration ("30m", "1h30m", "-1s"...).
+    A negative duration keeps the model loaded forever.
+
+    Raises:
+        ValueError: If the keep-alive isn't a valid duration
+    """
+    keep_alive = keep_alive.strip()
+    sign = -1 if keep_alive.startswith("-") else 1
+    duration = keep_alive.lstrip("+-")
+    try:
+        value = float(duration)
+    except ValueError:
+        parts = _DURATION_PATTERN.findall(duration)
+        if not parts or "".join(number + unit for number, unit in parts) != duration:
+            raise ValueError(f"Invalid keep-alive duration: {keep_alive}")
+        value = sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+    value *= sign
+    return float("inf") if value < 0 else value
+
+def model_options(model_name: str) -> Dict[str, Any]:
+    """
+    Get the keep_alive and num_ctx options of a local model, from the roles it serves (see the module's docstring)
+    """
+    keep_alives, num_ctxs = [], []
+    for role in _local_roles():
+        if resolve_model(role) != model_name:
+            continue
+        keep_alive = os.getenv(f"{role}_KEEP_ALIVE") or os.getenv("MODEL_KEEP_ALIVE")
+        num_ctx = os.getenv(f"{role}_NUM_CTX") or os.getenv("MODEL_NUM_CTX")
+        if keep_alive:
+            keep_alives.append(keep_alive)
+        if num_ctx:
+            num_ctxs.append(int(num_ctx))
+    options = {}
+    if keep_alives:
+        try:
+            options["keep_alive"] = max(keep_alives, key=_keep_alive_seconds)
+        except ValueError as e:
+            # Ollama validates the keep-alive itself
+            logging.warning(f"Could not compare the keep-alives of model {model_name}: {str(e)}")
+            options["keep_alive"] = keep_alives[0]
+    if num_ctxs:
+        options["num_ctx"] = max(num_ctxs)
+    return options
+
+def local_models() -> List[str]:
+    """
+    The local models serving the app's roles, in warm-up order
+    """
+    return list(dict.fromkeys(resolve_model(role) for role in _local_roles()))
+
+def _get_client():
+    from ollama import Client
+    return Client()
+
+def plan_consolidation(client=None) -> Optional[str]:
+    """
+    With MODEL_CONSOLIDATION=auto, decide whether the local roles are consolidated onto the resident model:
+    they are if the local models are larger than MODEL_MEMORY_BUDGET_MB together.
+
+    Returns:
+        The resident model, or None if every role keeps its model
+    """
+    global _resident_model
+    _resident_model = None
+    budget_mb = os.getenv("MODEL_MEMORY_BUDGET_MB")
+    resident_model = os.getenv("MODEL_RESIDENT_LLM") or os.getenv("QUESTIONS_LLM")
+    models = local_models()
+    if os.getenv("MODEL_CONSOLIDATION", "off").lower() != "auto" or not budget_mb or not resident_model or len(models) < 2:
+        return None
+    try:
+        sizes = {model.model: model.size or 0 for model in (client or _get_client()).list().models}
+    except Exception as e:
+        logging.warning(f"Could not get the sizes of the local models: {str(e)}")
+        return None
+    total_mb = sum(sizes.get(model, 0) for model in models) / (1024 * 1024)
+    if total_mb <= float(budget_mb):
+        return None
+    logging.info(f"The local models need {total_mb:.0f} MB (budget {budget_mb} MB): consolidating the roles onto {resident_model}")
+    _resident_model = resident_model
+    return resident_model
+
+def warm_up_models(client=None) -> Dict[str, float]:
+    """
+    Load the local models with their options, so that their first calls don't pay the load time.
+
+    Returns:
+        The warm-up time of every model, in seconds
+    """
+    client = client or _get_client()
+    durations = {}
+    for model_name in local_models():
+        options = model_options(model_name)
+        start = time.perf_counter()
+        try:
+            # An empty prompt only loads the model
+            response = client.generate(
+                model=model_name,
+                prompt="",
+                keep_alive=options.get("keep_alive"),
+                options={"num_ctx": options["num_ctx"]} if "num_ctx" in options else None,
+            )
+        except Exception as e:
+            logging.warning(f"Could not warm up the model {model_name}: {str(e)}")
+            continue
+        durations[model_name] = time.perf_counter() - start
+        if response.load_duration:
+            MODEL_LOAD_DURATION.observe(response.load_duration / 1e9, model=model_name)
+        logging.info(f"Warmed up the model {model_name} in {durations[model_name]:.2f}s")
+    return durations
+
+def record_load_duration(model_name: str, response: Any) -> None:
+    """
+    Record the load time reported by Ollama for a call: a cold call's load time is the model's load time
+    """
+    load_duration = (getattr(response, "response_metadata", None) or {}).get("load_duration")
+    if load_duration:
+        MODEL_LOAD_DURATION.observe(load_duration / 1e9, model=model_name)
+
+class ModelMonitor:
+    """
+    Tracks the models loaded by Ollama: a model that's no longer loaded was evicted (to make room for another
+    model) if its keep-alive hadn't expired yet.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        # Model -> keep-alive expiry
+        self.loaded: Dict[str, Optional[datetime]] = {}
+
+    def poll(self) -> None:
+        try:
+            models = {model.model: model.expires_at for model in self.client.ps().models}
+        except Exception as e:
+            logging.warning(f"Could not get the loaded models: {str(e)}")
+            return
+        now = datetime.now(timezone.utc)
+        for model_name, expires_at in self.loaded.items():
+            if model_name not in models:
+                event = "eviction" if expires_at and expires_at > now else "expiry"
+                record_model_event(model_name, event)
+        for model_name in models:
+            if model_name not in self.loaded:
+                record_model_event(model_name, "load")
+        self.loaded = models
+
+def _run_manager() -> None:
+    client = _get_client()
+    plan_consolidation(client)
+    if os.getenv("MODEL_WARM_UP", "true").lower() == "true":
+        warm_up_models(client)
+    interval = float(os.getenv("MODEL_MONITOR_INTERVAL", "30"))
+    if interval <= 0:
+        return
+    monitor = ModelMonitor(client)
+    while True:
+        monitor.poll()
+        time.sleep(interval)
+
+def start_model_manager() -> Optional[threading.Thread]:
+    """
+    Start the model manager in a background thread, once per process: it doesn't hold up the app's startup.
+    Nothing is done when no role is served by a local model.
+    """
+    global _manager_thread
+    with _manager_lock:
+        if _manager_thread is None and _local_roles():
+            _manager_thread = threading.Thread(target=_run_manager, name="model-manager", daemon=True)
+            _manager_thread.start()
+        return _manager_thread
@@ -0,0 +1,166 @@
+"""
+Process-wide scheduler of the LLM calls, in front of the model clients (see `ainvoke_llm` in app/utils/llm.py).
+
+Every model gets a bounded number of concurrent calls (LLM_MAX_CONCURRENCY, or per model with
+LLM_CONCURRENCY="<model>=<n>,..."). When a model is busy, calls wait in its queue and are served:
+- by priority class: interactive (chat) calls first, then speculative calls, then bulk prefill calls
+- fairly between sessions within a class: sessions take turns, so one session's 150-field prefill
+  doesn't make another session's prefill wait until it's done
+
+The priority and session of the calls are taken from the context (see `llm_context`).
+"""
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Deque, Dict, Iterator, Optional
+from app.utils.metrics import LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT
+
+# Priority classes, served in this order
+PRIORITY_INTERACTIVE = 0  # The user is waiting for the response (e.g. a chat reply)
+PRIORITY_SPECULATIVE = 1  # Work done ahead of time, which the user may need soon
+PRIORITY_BULK = 2  # Background work (e.g. prefilling a form)
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_SPECULATIVE: "speculative", PRIORITY_BULK: "bulk"}
+
+_priority: ContextVar[int] = ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+_session: ContextVar[Optional[str]] = ContextVar("llm_session", default=None)
+
+@contextmanager
+def llm_context(session_id: Optional[str] = None, priority: Optional[int] = None) -> Iterator[None]:
+    """
+    Set the session and/or the priority class of the LLM calls made within the block
+    (including the tasks it starts, which inherit the context)
+    """
+    tokens = []
+    if session_id is not None:
+        tokens.append((_session, _session.set(session_id)))
+    if priority is not None:
+        tokens.append((_priority, _priority.set(priority)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+def set_llm_session(session_id: str) -> None:
+    """
+    Set the session of the LLM calls made from the current context (e.g. a Streamlit script run)
+    """
+    _session.set(session_id)
+
+def _model_capacity(model: str) -> int:
+    for entry in os.getenv("LLM_CONCURRENCY", "").split(","):
+        name, _, capacity = entry.strip().rpartition("=")
+        if name == model:
+            return max(int(capacity), 1)
+    return max(int(os.getenv("LLM_MAX_CONCURRENCY", "4")), 1)
+
+@dataclass(eq=False)
+class Waiter:
+    loop: asyncio.AbstractEventLoop
+    future: asyncio.Future
+    granted: bool = False
+
+@dataclass
+class ModelQueue:
+    capacity: int
+    active: int = 0
+    # priority -> session -> waiters, in arrival order. Sessions are rotated after each grant.
+    waiting: Dict[int, "OrderedDict[Optional[str], Deque[Waiter]]"] = field(default_factory=dict)
+
+    def has_waiters(self) -> bool:
+        return any(self.waiting.values())
+
+class LLMScheduler:
+    """
+    The slots of every model are shared by all the event loops of the process
+    (e.g. the app's event loop and the API server's), so the state is guarded by a thread lock.
+    """
+
+    def __init__(self):
+        self._queues: Dict[str, ModelQueue] = {}
+        self._lock = threading.Lock()
+
+    def _queue(self, model: str) -> ModelQueue:
+        if model not in self._queues:
+            self._queues[model] = ModelQueue(capacity=_model_capacity(model))
+        return self._queues[model]
+
+    @asynccontextmanager
+    async def slot(self, model: str) -> AsyncIterator[None]:
+        """
+        Hold one of the model's slots for the duration of a call, waiting in its queue if they're all taken
+        """
+        priority, session_id = _priority.get(), _session.get()
+        labels = {"model": model, "priority": PRIORITY_NAMES[priority]}
+        start = time.perf_counter()
+        waiter = None
+        with self._lock:
+            queue = self._queue(model)
+            if queue.active < queue.capacity and not queue.has_waiters():
+                queue.active += 1
+            else:
+                loop = asyncio.get_running_loop()
+                waiter = Waiter(loop, loop.create_future())
+                queue.waiting.setdefault(priority, OrderedDict()).setdefault(session_id, deque()).append(waiter)
+                LLM_QUEUE_DEPTH.inc(**labels)
+
+        if waiter:
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                self._abandon(model, priority, session_id, waiter, labels)
+                raise
+        LLM_QUEUE_WAIT.observe(time.perf_counter() - start, **labels)
+        try:
+            yield
+        finally:
+            self._release(model)
+
+    def _abandon(self, model: str, priority: int, session_id: Optional[str], waiter: Waiter, labels: Dict[str, str]) -> None:
+        with self._lock:
+            if not waiter.granted:
+                sessions = self._queues[model].waiting[priority]
+                sessions[session_id].remove(waiter)
+                if not sessions[session_id]:
+                    del sessions[session_id]
+                LLM_QUEUE_DEPTH.dec(**labels)
+                return
+        # The slot was granted but the call went away: hand it over (unless `_grant` already did)
+        if waiter.future.done() and not waiter.future.cancelled():
+            self._release(model)
+
+    def _release(self, model: str) -> None:
+        with self._lock:
+            queue = self._queues[model]
+            for priority in sorted(queue.waiting):
+                sessions = queue.waiting[priority]
+                if not sessions:
+                    continue
+                session_id, waiters = next(iter(sessions.items()))
+                waiter = waiters.popleft()
+                # The session goes to the back of the line
+                del sessions[session_id]
+                if waiters:
+                    sessions[session_id] = waiters
+                waiter.granted = True
+                LLM_QUEUE_DEPTH.dec(model=model, priority=PRIORITY_NAMES[priority])
+                # The slot is handed over as it is: `active` doesn't change
+                waiter.loop.call_soon_threadsafe(self._grant, model, waiter)
+                return
+            queue.active -= 1
+
+    def _grant(self, model: str, waiter: Waiter) -> None:
+        if waiter.future.cancelled():
+            self._release(model)
+        else:
+            waiter.future.set_result(None)
+
+_scheduler = LLMScheduler()
+
+def get_scheduler() -> LLMScheduler:
+    return _scheduler
@@ -0,0 +1,87 @@
+"""
+Per-turn overhead benchmark: `asyncio.run` per call vs. the process-wide event loop.
+
+Every "turn" makes one HTTP request to a local server, like a chat turn calling the LLM:
+- With `asyncio.run`, each turn creates and tears down an event loop, so the async HTTP client
+  (and its connection pool) can't outlive the turn: a new connection is opened every time.
+- With the long-lived loop (`app/utils/event_loop.py`), the client and its connections are reused.
+
+Usage (from the repository root):
+    python benchmarks/event_loop.py --turns 200
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from app.utils import event_loop
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = b'{"message": "ok"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_server() -> str:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/"
+
+def measure(turn, turns: int) -> dict:
+    durations = []
+    for _ in range(turns):
+        start = time.perf_counter()
+        turn()
+        durations.append((time.perf_counter() - start) * 1000)
+    return {"mean": statistics.mean(durations), "p50": statistics.median(durations), "p95": statistics.quantiles(durations, n=20)[-1]}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200, help="Number of turns per scenario")
+    args = parser.parse_args()
+    url = start_server()
+
+    async def request_with_new_client():
+        async with httpx.AsyncClient() as client:
+            return (await client.get(url)).status_code
+
+    shared_client = None
+
+    async def request_with_shared_client():
+        nonlocal shared_client
+        if shared_client is None:
+            shared_client = httpx.AsyncClient()
+        return (await shared_client.get(url)).status_code
+
+    async def noop():
+        return None
+
+    results = {
+        "asyncio.run (no I/O)": measure(lambda: asyncio.run(noop()), args.turns),
+        "long-lived loop (no I/O)": measure(lambda: event_loop.run(noop()), args.turns),
+        "asyncio.run + new HTTP client": measure(lambda: asyncio.run(request_with_new_client()), args.turns),
+        "long-lived loop + shared HTTP client": measure(lambda: event_loop.run(request_with_shared_client()), args.turns),
+    }
+
+    print(f"Per-turn overhead over {args.turns} turns (ms)")
+    for name, result in results.items():
+        print(f"  {name:40s} mean {result['mean']:7.3f}  p50 {result['p50']:7.3f}  p95 {result['p95']:7.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Load test for the headless API (`app/api/server.py`) against the stub LLM server.
+
+Starts the stub LLM server and the API server, then runs concurrent virtual users. Each user
+creates a session, uploads a form and a support document (which prefills the form), chats for
+a few turns and downloads the filled form.
+Reports the latency percentiles of every endpoint, the throughput and the errors.
+
+Usage (from the repository root):
+    python benchmarks/load_test.py --users 20 --tenants 4 --turns 3 --latency-ms 200
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+import subprocess
+from collections import defaultdict
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+from stub_llm import start_stub_server
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FORM_PATH = os.path.join(ROOT_DIR, "app", "docs", "forms", "form-example.pdf")
+SUPPORT_DOC = b"Name: Jane Doe\nAddress: 123 Main Street, Springfield\nPhone: 555-0100\nEmail: jane@example.com\n"
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    async def timed(self, name: str, request):
+        start = time.perf_counter()
+        try:
+            response = await request
+            response.raise_for_status()
+            return response
+        except Exception as e:
+            self.errors[f"{name}: {type(e).__name__}"] += 1
+            raise
+        finally:
+            self.latencies[name].append((time.perf_counter() - start) * 1000)
+
+async def read_ndjson(client: httpx.AsyncClient, name: str, recorder: Recorder, method: str, url: str, **kwargs) -> List[str]:
+    """
+    Stream an NDJSON response. Its latency is recorded for the whole stream and up to the first event.
+    """
+    start = time.perf_counter()
+    lines = []
+    try:
+        async with client.stream(method, url, **kwargs) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not lines:
+                    recorder.latencies[f"{name} (first event)"].append((time.perf_counter() - start) * 1000)
+                lines.append(line)
+    except Exception as e:
+        recorder.errors[f"{name}: {type(e).__name__}"] += 1
+        raise
+    finally:
+        recorder.latencies[name].append((time.perf_counter() - start) * 1000)
+    return lines
+
+async def virtual_user(client: httpx.AsyncClient, user: int, tenant: str, turns: int, recorder: Recorder):
+    headers = {"X-Tenant-ID": tenant}
+    response = await recorder.timed("POST /sessions", client.post("/sessions", headers=headers))
+    session_url = f"/sessions/{response.json()['session_id']}"
+
+    with open(FORM_PATH, "rb") as f:
+        form = f.read()
+    await recorder.timed("POST /form", client.post(f"{session_url}/form", headers=headers, files={"file": ("form-example.pdf", form, "application/pdf")}))
+    # Every user uploads a different document, so the document store cache doesn't hide the extraction cost
+    support_doc = SUPPORT_DOC + f"Reference: user-{user}\n".encode("utf-8")
+    await read_ndjson(client, "POST /documents", recorder, "POST", f"{session_url}/documents", headers=headers, files={"files": (f"support-{user}.txt", support_doc, "text/plain")})
+    for turn in range(turns):
+        await read_ndjson(client, "POST /chat", recorder, "POST", f"{session_url}/chat", headers=headers, json={"message": f"Answer {turn}"})
+    await recorder.timed("GET /form.pdf", client.get(f"{session_url}/form.pdf", headers=headers))
+    await recorder.timed("DELETE /sessions", client.delete(session_url, headers=headers))
+
+async def run_users(base_url: str, users: int, tenants: int, turns: int, recorder: Recorder) -> float:
+    async with httpx.AsyncClient(base_url=base_url, timeout=300) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(*[
+            virtual_user(client, user, f"tenant-{user % tenants}", turns, recorder) for user in range(users)
+        ], return_exceptions=True)
+        elapsed = time.perf_counter() - start
+    failed = sum(1 for result in results if isinstance(result, Exception))
+    print(f"{users - failed}/{users} users completed in {elapsed:.2f}s")
+    return elapsed
+
+def wait_for_server(base_url: str, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/health").status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"The API server didn't start within {timeout}s")
+
+def print_report(recorder: Recorder, elapsed: float) -> None:
+    requests = sum(len(latencies) for name, latencies in recorder.latencies.items() if "(first event)" not in name)
+    print(f"\nThroughput: {requests / elapsed:.1f} requests/s\n")
+    print(f"{'endpoint':<32} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, latencies in sorted(recorder.latencies.items()):
+        if len(latencies) > 1:
+            quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+            p95, p99 = quantiles[94], quantiles[98]
+        else:
+            p95 = p99 = latencies[0]
+        print(f"{name:<32} {len(latencies):>6} {statistics.median(latencies):>9.1f} {p95:>9.1f} {p99:>9.1f} {max(latencies):>9.1f}")
+    if recorder.errors:
+        print("\nErrors:")
+        for name, count in sorted(recorder.errors.items()):
+            print(f"  {name}: {count}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="Number of concurrent virtual users")
+    parser.add_argument("--tenants", type=int, default=4, help="Number of tenants the users are spread over")
+    parser.add_argument("--turns", type=int, default=3, help="Chat turns per user")
+    parser.add_argument("--latency-ms", type=float, default=200, help="Stub LLM latency before the first token")
+    parser.add_argument("--token-latency-ms", type=float, default=5, help="Stub LLM latency between streamed tokens")
+    parser.add_argument("--port", type=int, default=7862, help="Port of the API server")
+    args = parser.parse_args()
+
+    stub_url, _ = start_stub_server(latency_ms=args.latency_ms, token_latency_ms=args.token_latency_ms)
+    env = {
+        **os.environ,
+        "ENV": "production",
+        "OLLAMA_HOST": stub_url,
+        "OPENAI_BASE_URL": f"{stub_url}/v1",
+        "OPENAI_API_KEY": "stub",
+        # Like the default configuration: an OpenAI model for the chat, Ollama models for the rest
+        "CHAT_LLM": "gpt-stub",
+        "PREFILL_LLM": "stub-prefill",
+        "QUESTIONS_LLM": "stub-questions",
+        "ANSWER_JUDGE_LLM": "stub-judge",
+        "PERSIST_UPLOADS": "false",
+    }
+    base_url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.api.server:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=ROOT_DIR,
+        env=env,
+    )
+    try:
+        wait_for_server(base_url)
+        recorder = Recorder()
+        elapsed = asyncio.run(run_users(base_url, args.users, args.tenants, args.turns, recorder))
+        print_report(recorder, elapsed)
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Model manager benchmark (see `app/utils/model_manager.py`) against the stub LLM server, which simulates
+Ollama's model load time (`--load-latency-ms`).
+
+- First request: the latency of the first question and the first prefill call after startup, without the
+  manager (the calls pay the load time) and after its warm-up.
+- Role switching: questions and prefill calls taking turns when Ollama can only keep one model loaded
+  (`--max-loaded-models`), with each role on its own model and with the roles consolidated on one model.
+
+Usage (from the repository root):
+    python benchmarks/model_manager.py --load-latency-ms 1500
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_PATH)
+
+from stub_llm import StubModels, start_stub_server
+from app.utils.llm import ainvoke_llm, get_llm
+from app.utils.model_manager import warm_up_models
+from app.utils.event_loop import run
+
+QUESTION_PROMPT = "Ask a polite and clear question that will help the user answer this field. /no_think"
+PREFILL_PROMPT = "Your goal is to find the answers for fields in a form. /no_think"
+
+def configure_models(stub_url: str) -> None:
+    os.environ.update({
+        "OLLAMA_HOST": stub_url,
+        "OPENAI_BASE_URL": f"{stub_url}/v1",
+        "OPENAI_API_KEY": "stub",
+        "CHAT_LLM": "gpt-stub",
+        "PREFILL_LLM": "stub-prefill",
+        "QUESTIONS_LLM": "stub-questions",
+        "ANSWER_JUDGE_LLM": "stub-questions",
+        "MODEL_KEEP_ALIVE": "30m",
+    })
+    for name in ("PREFILL_ESCALATION_LLM", "ANSWER_EXTRACTION_LLM", "MODEL_RESIDENT_LLM"):
+        os.environ.pop(name, None)
+
+def timed_call(type: str, prompt: str) -> float:
+    start = time.perf_counter()
+    run(ainvoke_llm(type, prompt, "benchmark"))
+    return (time.perf_counter() - start) * 1000
+
+def reset_models(server, load_latency_ms: float, max_loaded_models: int = 0) -> StubModels:
+    """
+    Start over with no model loaded, like a fresh Ollama server
+    """
+    server.RequestHandlerClass.models = StubModels(load_latency_ms / 1000, max_loaded_models)
+    return server.RequestHandlerClass.models
+
+def first_request(server, load_latency_ms: float, warm_up: bool) -> Dict[str, float]:
+    reset_models(server, load_latency_ms)
+    result = {"warm_up_ms": 0.0}
+    if warm_up:
+        start = time.perf_counter()
+        warm_up_models()
+        result["warm_up_ms"] = (time.perf_counter() - start) * 1000
+    result["first_question_ms"] = timed_call("QUESTIONS_LLM", QUESTION_PROMPT)
+    result["first_prefill_ms"] = timed_call("PREFILL_LLM", PREFILL_PROMPT)
+    return result
+
+def role_switching(server, load_latency_ms: float, max_loaded_models: int, turns: int, consolidated: bool) -> Dict[str, float]:
+    os.environ["MODEL_CONSOLIDATION"] = "on" if consolidated else "off"
+    models = reset_models(server, load_latency_ms, max_loaded_models)
+    warm_up_models()
+    loads = models.loads
+    latencies: List[float] = []
+    for _ in range(turns):
+        latencies.append(timed_call("QUESTIONS_LLM", QUESTION_PROMPT))
+        latencies.append(timed_call("PREFILL_LLM", PREFILL_PROMPT))
+    os.environ["MODEL_CONSOLIDATION"] = "off"
+    return {"mean_call_ms": statistics.mean(latencies), "max_call_ms": max(latencies), "model_loads": models.loads - loads}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=20, help="Stub LLM latency before the first token")
+    parser.add_argument("--load-latency-ms", type=float, default=1000, help="Stub model load time")
+    parser.add_argument("--max-loaded-models", type=int, default=1, help="Models loaded at once in the role switching run")
+    parser.add_argument("--turns", type=int, default=5, help="Question/prefill turns in the role switching run")
+    args = parser.parse_args()
+
+    stub_url, server = start_stub_server(latency_ms=args.latency_ms)
+    configure_models(stub_url)
+    # Create the model clients first: only the model load time is measured
+    for type in ("QUESTIONS_LLM", "PREFILL_LLM"):
+        get_llm(type)
+
+    print(f"{'first request':<24} {'warm-up ms':>12} {'question ms':>12} {'prefill ms':>12}")
+    for name, warm_up in (("manager off", False), ("manager on", True)):
+        result = first_request(server, args.load_latency_ms, warm_up)
+        print(f"{name:<24} {result['warm_up_ms']:>12.1f} {result['first_question_ms']:>12.1f} {result['first_prefill_ms']:>12.1f}")
+
+    print(f"\n{'role switching':<24} {'mean ms':>12} {'max ms':>12} {'loads':>12}")
+    for name, consolidated in (("one model per role", False), ("consolidated", True)):
+        result = role_switching(server, args.load_latency_ms, args.max_loaded_models, args.turns, consolidated)
+        print(f"{name:<24} {result['mean_call_ms']:>12.1f} {result['max_call_ms']:>12.1f} {result['model_loads']:>12}")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+End-to-end pipeline benchmark against the stub LLM server (`benchmarks/stub_llm.py`).
+
+Runs the real pipeline on every bundled form in `app/docs/forms/`, stage by stage:
+- parse: `parse_pdf_form`
+- load: a generated support document loaded into an empty document store
+- prefill: `prefill_in_memory_form` with that document
+- chat: a scripted multi-turn chat through `create_chat_graph`
+- fill: `fill_pdf_form`
+
+Each stage reports its wall time (median of the runs), LLM calls and tokens (as counted by the
+stub server) and peak memory (traced with `tracemalloc`, which slows the run down a little: the
+baseline is measured the same way). A first warm-up run (imports, model clients) isn't reported.
+The result is compared with a saved baseline, and the run
+fails if a stage makes more LLM calls, or if its time, tokens or memory regressed by more than
+the allowed threshold.
+
+Usage (from the repository root):
+    python benchmarks/pipeline.py                     # Compare with the baseline
+    python benchmarks/pipeline.py --update-baseline   # Save the current result as the baseline
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_PATH)
+
+from langchain_core.messages import HumanMessage
+from stub_llm import StubStats, start_stub_server
+from app.chat_agent.graph import ChatAgentState, create_chat_graph
+from app.chat_agent.helpers import is_form_question
+from app.context.chunks import ChunkCache
+from app.context.loader import load_file_into_context
+from app.context.store import DocumentStore
+from app.doc_handlers.pdf import parse_pdf_form, fill_pdf_form
+from app.form.prefill import prefill_in_memory_form
+from app.form.status import check_if_form_complete
+from app.form.update import update_draft_form
+from app.utils.event_loop import run
+
+BASELINE_PATH = os.path.join(ROOT_PATH, "benchmarks", "pipeline_baseline.json")
+FORMS_PATH = os.path.join(ROOT_PATH, "app", "docs", "forms")
+STAGES = ["parse", "load", "prefill", "chat", "fill"]
+# Absolute slack over the baseline, so that short stages don't fail on noise
+TIME_SLACK_MS = 25
+MEMORY_SLACK_KB = 256
+CHAT_MESSAGES = ["Hi, can you help me fill this form?", "Jane Doe", "123 Main Street, Springfield", "555-0100", "jane@example.com"]
+
+def configure_models(stub_url: str) -> None:
+    """
+    Point the app's models at the stub server: an OpenAI model for the chat, Ollama models for the rest
+    (like the default configuration)
+    """
+    os.environ.update({
+        "OLLAMA_HOST": stub_url,
+        "OPENAI_BASE_URL": f"{stub_url}/v1",
+        "OPENAI_API_KEY": "stub",
+        "CHAT_LLM": "gpt-stub",
+        "PREFILL_LLM": "stub-prefill",
+        "QUESTIONS_LLM": "stub-questions",
+        "ANSWER_JUDGE_LLM": "stub-judge",
+    })
+
+def support_document(draft_form: Dict) -> str:
+    """
+    A support document with a line for every field of the form, between paragraphs of filler text,
+    so it spans several chunks
+    """
+    filler = "The applicant confirms that the information in this document is accurate and complete. " * 20
+    lines = []
+    for i, field in enumerate(draft_form["fields"]):
+        if i % 10 == 0:
+            lines.append(filler)
+        lines.append(f"{field['label']}: sample value {i}")
+    return "\n".join(lines)
+
+@contextmanager
+def measure(stats: StubStats, result: Dict):
+    """
+    Measure the wall time, LLM calls and tokens and peak memory of a stage into `result`
+    """
+    stats.reset()
+    tracemalloc.reset_peak()
+    start_memory, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    yield
+    result["wall_time_ms"] = (time.perf_counter() - start) * 1000
+    _, peak_memory = tracemalloc.get_traced_memory()
+    result["peak_memory_kb"] = max(peak_memory - start_memory, 0) / 1024
+    llm_stats = stats.to_dict()
+    result["llm_calls"] = llm_stats["calls"]
+    result["llm_tokens"] = llm_stats["prompt_tokens"] + llm_stats["completion_tokens"]
+
+async def chat(chat_graph, draft_form: Dict) -> None:
+    """
+    Scripted chat, turn by turn like the API server: answers to the form's questions update the draft form
+    """
+    messages = []
+    for message in CHAT_MESSAGES:
+        if messages and is_form_question(messages[-1].content):
+            draft_form = await update_draft_form(draft_form, message)
+        messages.append(HumanMessage(content=message))
+        if check_if_form_complete(draft_form):
+            break
+        final_state = await chat_graph.ainvoke(ChatAgentState(messages=messages, draft_form=draft_form, form_filepath=draft_form["formFileName"]))
+        messages = final_state["messages"]
+
+def run_form(form_path: str, chat_graph, stats: StubStats, work_dir: str) -> Dict[str, Dict]:
+    results = {stage: {} for stage in STAGES}
+    with measure(stats, results["parse"]):
+        draft_form = parse_pdf_form(form_path)
+
+    # A new store every run, so the document is extracted every time
+    doc_path = os.path.join(tempfile.mkdtemp(dir=work_dir), "support-doc.txt")
+    with open(doc_path, "w") as f:
+        f.write(support_document(draft_form))
+    store = DocumentStore(tempfile.mkdtemp(dir=work_dir))
+    with measure(stats, results["load"]):
+        support_doc = run(load_file_into_context(doc_path, store=store))
+
+    with measure(stats, results["prefill"]):
+        run(prefill_in_memory_form(draft_form, [support_doc], ChunkCache()))
+
+    with measure(stats, results["chat"]):
+        run(chat(chat_graph, draft_form))
+
+    with measure(stats, results["fill"]):
+        fill_pdf_form(form_path, draft_form)
+    return results
+
+def run_benchmark(forms: List[str], runs: int, stats: StubStats) -> Dict[str, Dict]:
+    chat_graph = create_chat_graph()
+    all_runs = []
+    tracemalloc.start()
+    with tempfile.TemporaryDirectory() as work_dir:
+        run_form(os.path.join(FORMS_PATH, forms[0]), chat_graph, stats, work_dir)
+        for _ in range(runs):
+            all_runs.append({form: run_form(os.path.join(FORMS_PATH, form), chat_graph, stats, work_dir) for form in forms})
+    tracemalloc.stop()
+
+    result = {}
+    for form in forms:
+        for stage in STAGES:
+            stage_runs = [form_runs[form][stage] for form_runs in all_runs]
+            result[f"{form}/{stage}"] = {
+                "wall_time_ms": statistics.median([run["wall_time_ms"] for run in stage_runs]),
+                "llm_calls": max(run["llm_calls"] for run in stage_runs),
+                "llm_tokens": max(run["llm_tokens"] for run in stage_runs),
+                "peak_memory_kb": max(run["peak_memory_kb"] for run in stage_runs),
+            }
+    return result
+
+def find_regressions(result: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float) -> List[str]:
+    regressions = []
+    for name, stage in result.items():
+        if name not in baseline:
+            continue
+        if stage["llm_calls"] > baseline[name]["llm_calls"]:
+            regressions.append(f"{name}: {stage['llm_calls']} LLM calls (baseline {baseline[name]['llm_calls']})")
+        for metric, slack in (("wall_time_ms", TIME_SLACK_MS), ("llm_tokens", 0), ("peak_memory_kb", MEMORY_SLACK_KB)):
+            limit = baseline[name][metric] * (1 + threshold) + slack
+            if stage[metric] > limit:
+                regressions.append(f"{name}: {metric} {stage[metric]:.1f} (baseline {baseline[name][metric]:.1f}, limit {limit:.1f})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--forms", nargs="+", default=sorted(f for f in os.listdir(FORMS_PATH) if f.endswith(".pdf")), help="Forms in app/docs/forms to run")
+    parser.add_argument("--runs", type=int, default=3, help="Number of runs (the median wall time is reported)")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Stub LLM latency before the first token")
+    parser.add_argument("--token-latency-ms", type=float, default=0, help="Stub LLM latency between streamed tokens")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed regression over the baseline (0.2 = 20%%)")
+    parser.add_argument("--update-baseline", action="store_true", help="Save the result as the new baseline")
+    args = parser.parse_args()
+
+    stub_url, server = start_stub_server(latency_ms=args.latency_ms, token_latency_ms=args.token_latency_ms)
+    configure_models(stub_url)
+    result = run_benchmark(args.forms, args.runs, server.RequestHandlerClass.stats)
+    server.shutdown()
+
+    print(f"{'form/stage':<32} {'time ms':>10} {'LLM calls':>10} {'tokens':>10} {'peak KB':>10}")
+    for name, stage in result.items():
+        print(f"{name:<32} {stage['wall_time_ms']:>10.1f} {stage['llm_calls']:>10} {stage['llm_tokens']:>10} {stage['peak_memory_kb']:>10.1f}")
+
+    if args.update_baseline:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Baseline saved to {BASELINE_PATH}")
+        return
+
+    if not os.path.exists(BASELINE_PATH):
+        print("No baseline found. Run with --update-baseline to save one.")
+        return
+
+    with open(BASELINE_PATH) as f:
+        baseline = json.load(f)
+    regressions = find_regressions(result, baseline, args.threshold)
+    if regressions:
+        print("FAILED: the pipeline regressed")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
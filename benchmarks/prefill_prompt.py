@@ -0,0 +1,80 @@
+"""
+Prefill prompt layout benchmark against the stub LLM server, which simulates prompt evaluation with a prefix
+(KV) cache: every prompt token costs `--prompt-token-latency-ms`, except the tokens of a prefix shared with a
+previous prompt.
+
+Prefills the bundled forms with a generated support document, with the context shared by all the fields
+(one byte-identical prompt prefix, reused across the field calls) and with a context per field
+(PREFILL_SHARED_CONTEXT=false, no reuse), and reports per field: the prompt tokens, the share of them
+that was cached, the prompt evaluation time and the wall time.
+
+Usage (from the repository root):
+    python benchmarks/prefill_prompt.py --prompt-token-latency-ms 0.5
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+from typing import Dict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_PATH)
+
+from stub_llm import StubPromptCache, start_stub_server
+from pipeline import FORMS_PATH, configure_models, support_document
+from app.context.chunks import ChunkCache
+from app.context.loader import load_file_into_context
+from app.context.store import DocumentStore
+from app.doc_handlers.pdf import parse_pdf_form
+from app.form.prefill import prefill_field_values
+from app.utils.event_loop import run
+
+def prefill_form(form_path: str, server, work_dir: str, shared_context: bool) -> Dict[str, float]:
+    os.environ["PREFILL_SHARED_CONTEXT"] = "true" if shared_context else "false"
+    draft_form = parse_pdf_form(form_path)
+    doc_path = os.path.join(tempfile.mkdtemp(dir=work_dir), "support-doc.txt")
+    with open(doc_path, "w") as f:
+        f.write(support_document(draft_form))
+    support_doc = run(load_file_into_context(doc_path, store=DocumentStore(tempfile.mkdtemp(dir=work_dir))))
+
+    # Nothing cached from the document loading or a previous run
+    server.RequestHandlerClass.prompt_cache = StubPromptCache()
+    stats = server.RequestHandlerClass.stats
+    stats.reset()
+    start = time.perf_counter()
+    run(prefill_field_values(draft_form, [support_doc], ChunkCache()))
+    wall_time_ms = (time.perf_counter() - start) * 1000
+    llm_stats = stats.to_dict()
+    calls = max(llm_stats["calls"], 1)
+    return {
+        "prompt_tokens": llm_stats["prompt_tokens"] / calls,
+        "cached": llm_stats["cached_prompt_tokens"] / max(llm_stats["prompt_tokens"], 1),
+        "prompt_eval_ms": llm_stats["prompt_eval_ms"] / calls,
+        "wall_time_ms": wall_time_ms / calls,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--forms", nargs="+", default=sorted(f for f in os.listdir(FORMS_PATH) if f.endswith(".pdf")), help="Forms in app/docs/forms to run")
+    parser.add_argument("--latency-ms", type=float, default=10, help="Stub LLM latency before the first token")
+    parser.add_argument("--prompt-token-latency-ms", type=float, default=0.5, help="Stub evaluation time of every prompt token that isn't cached")
+    args = parser.parse_args()
+
+    stub_url, server = start_stub_server(latency_ms=args.latency_ms, prompt_token_latency_ms=args.prompt_token_latency_ms)
+    configure_models(stub_url)
+
+    print(f"{'form/layout':<36} {'tokens':>10} {'cached':>10} {'eval ms':>10} {'wall ms':>10}   (per field)")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for form in args.forms:
+            for layout, shared_context in (("per-field context", False), ("shared prefix", True)):
+                result = prefill_form(os.path.join(FORMS_PATH, form), server, work_dir, shared_context)
+                print(
+                    f"{form + '/' + layout:<36} {result['prompt_tokens']:>10.0f} {result['cached']:>10.0%} "
+                    f"{result['prompt_eval_ms']:>10.1f} {result['wall_time_ms']:>10.1f}"
+                )
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Import-time / startup benchmark for the Streamlit entry point.
+
+Imports the modules loaded by `app/main.py` in a fresh interpreter with `python -X importtime`,
+a few times, and reports the median total import time and the heaviest top-level imports.
+The result is compared with a saved baseline, and the run fails if it regressed by more than
+the allowed threshold.
+
+Usage (from the repository root):
+    python benchmarks/startup.py                     # Compare with the baseline
+    python benchmarks/startup.py --update-baseline   # Save the current result as the baseline
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT_PATH, "benchmarks", "startup_baseline.json")
+
+# The modules imported by app/main.py when a session starts
+STARTUP_MODULES = [
+    "streamlit",
+    "langchain_core.messages",
+    "app.chat_agent.graph",
+    "app.chat_agent.helpers",
+    "app.utils.setup",
+    "app.utils.llm",
+    "app.doc_handlers.pdf",
+    "app.context.loader",
+    "app.context.store",
+    "app.context.chunks",
+    "app.form.prefill",
+    "app.utils.misc",
+    "app.utils.files",
+    "app.utils.jobs",
+    "app.utils.event_loop",
+    "app.utils.metrics",
+    "app.form.update",
+    "app.form.status",
+]
+
+def parse_importtime(output: str) -> dict:
+    """
+    Parse the output of `python -X importtime`.
+
+    Returns:
+        A dictionary with the cumulative import time (in microseconds) of each top-level import
+    """
+    top_level_imports = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        # Nested imports are indented: only keep the top-level ones
+        if name.startswith("  "):
+            continue
+        top_level_imports[name.strip()] = int(cumulative_us)
+    return top_level_imports
+
+def run_once() -> dict:
+    code = "; ".join([f"import {module}" for module in STARTUP_MODULES])
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT_PATH,
+        capture_output=True,
+        text=True,
+    )
+    wall_time = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to import the startup modules:\n{result.stderr[-2000:]}")
+    imports = parse_importtime(result.stderr)
+    return {
+        "wall_time_ms": wall_time * 1000,
+        "import_time_ms": sum(imports.values()) / 1000,
+        "imports": imports,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs (the median is reported)")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed regression over the baseline (0.2 = 20%%)")
+    parser.add_argument("--top", type=int, default=10, help="Number of heaviest imports to show")
+    parser.add_argument("--update-baseline", action="store_true", help="Save the result as the new baseline")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    result = {
+        "wall_time_ms": statistics.median([run["wall_time_ms"] for run in runs]),
+        "import_time_ms": statistics.median([run["import_time_ms"] for run in runs]),
+    }
+    heaviest_imports = sorted(runs[-1]["imports"].items(), key=lambda item: item[1], reverse=True)[:args.top]
+
+    print(f"Startup wall time:  {result['wall_time_ms']:.1f} ms (median of {args.runs} runs)")
+    print(f"Total import time:  {result['import_time_ms']:.1f} ms")
+    print("Heaviest top-level imports:")
+    for name, cumulative_us in heaviest_imports:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    if args.update_baseline:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Baseline saved to {BASELINE_PATH}")
+        return
+
+    if not os.path.exists(BASELINE_PATH):
+        print("No baseline found. Run with --update-baseline to save one.")
+        return
+
+    with open(BASELINE_PATH) as f:
+        baseline = json.load(f)
+    limit = baseline["import_time_ms"] * (1 + args.threshold)
+    print(f"Baseline import time: {baseline['import_time_ms']:.1f} ms (limit {limit:.1f} ms)")
+    if result["import_time_ms"] > limit:
+        print("FAILED: startup import time regressed")
+        sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
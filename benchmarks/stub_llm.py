@@ -0,0 +1,459 @@
+"""
+Stub LLM server for load tests and benchmarks.
+
+Serves canned responses over the OpenAI (`/v1/chat/completions`) and Ollama (`/api/chat`) chat
+APIs, streamed or not, with a configurable latency. The response to a prompt is the first canned
+response whose key is found in the prompt (see `DEFAULT_RESPONSES`).
+
+Ollama models can simulate their load time: a call to a model that isn't loaded waits `load_latency_ms`
+first, models stay loaded for their keep-alive, and the least recently used model is evicted beyond
+`max_loaded_models` (like Ollama's OLLAMA_MAX_LOADED_MODELS). `/api/generate` with an empty prompt loads
+a model, and `/api/ps` and `/api/tags` list the loaded and available models.
+
+Prompt evaluation can be simulated too: every prompt token costs `prompt_token_latency_ms`, except the tokens
+of the longest prefix shared with a previous prompt of the same model, which are cached (like the KV cache of
+Ollama's `prompt_cache_slots` parallel slots).
+
+Point the app at it with OLLAMA_HOST=<url> (model names not starting with "gpt") or
+OPENAI_BASE_URL=<url>/v1 (model names starting with "gpt").
+
+Usage (from the repository root):
+    python benchmarks/stub_llm.py --port 11435 --latency-ms 200 --token-latency-ms 5
+"""
+import re
+import json
+import time
+import argparse
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple, Union
+
+def extract_facts(prompt: str) -> str:
+    """
+    Fact sheet of the document in a fact extraction prompt (see app/context/facts.py): its "<attribute>: <value>" lines
+    """
+    document = prompt.split("<document>", 1)[-1].split("</document>", 1)[0]
+    facts = [
+        {"entity": "applicant", "attribute": attribute.strip(), "value": value.strip(), "source": line.strip()}
+        for line, attribute, value in re.findall(r"^(([^:\n]{1,80}):([^\n]+))$", document, re.MULTILINE)
+    ]
+    return json.dumps({"facts": facts})
+
+# Prompt substring -> response (or function of the prompt returning the response).
+# The first match wins, the last entry is the fallback.
+DEFAULT_RESPONSES: List[Tuple[str, Union[str, Callable[[str], str]]]] = [
+    ("choose the options of the following fields", "{}"),
+    ("find the answers for fields", '{"value": "", "docId": null, "confidence": 1.0, "evidence": ""}'),
+    ("Extract the facts of the following document", extract_facts),
+    ("Extract the answers to these fields", "{}"),
+    ("Select one of", "FormInquirer"),
+    ("Return a boolean value", "true"),
+    ("Ask a polite and clear question", "Could you please provide this information?"),
+    ("", "Happy to help! Let me know if you have any questions about the form."),
+]
+
+class StubStats:
+    """
+    Number of calls and (approximate, whitespace-separated) tokens served, and the simulated prompt evaluation
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls = 0
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+            self.cached_prompt_tokens = 0
+            self.prompt_eval_ms = 0.0
+
+    def record(self, prompt: str, completion: str, cached_prompt_tokens: int = 0, prompt_eval_ms: float = 0.0) -> None:
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += count_tokens(prompt)
+            self.completion_tokens += count_tokens(completion)
+            self.cached_prompt_tokens += cached_prompt_tokens
+            self.prompt_eval_ms += prompt_eval_ms
+
+    def to_dict(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "cached_prompt_tokens": self.cached_prompt_tokens,
+                "prompt_eval_ms": self.prompt_eval_ms,
+            }
+
+class StubPromptCache:
+    """
+    The prompts last evaluated in each slot of every model, to find the cached prefix of a new prompt
+    """
+
+    def __init__(self, slots: int = 4):
+        self.slots = max(slots, 1)
+        # Model -> token lists, least recently used first
+        self._prompts: Dict[str, List[List[str]]] = {}
+        self._lock = threading.Lock()
+
+    def evaluate(self, model: str, prompt: str) -> int:
+        """
+        Evaluate a prompt in the slot sharing its longest prefix (or the least recently used slot)
+
+        Returns:
+            The number of cached prompt tokens
+        """
+        tokens = prompt.split()
+        with self._lock:
+            prompts = self._prompts.setdefault(model, [])
+            best_slot, best_prefix = None, 0
+            for slot, cached_tokens in enumerate(prompts):
+                prefix = 0
+                for cached_token, token in zip(cached_tokens, tokens):
+                    if cached_token != token:
+                        break
+                    prefix += 1
+                if prefix > best_prefix:
+                    best_slot, best_prefix = slot, prefix
+            if best_slot is not None:
+                prompts.pop(best_slot)
+            elif len(prompts) >= self.slots:
+                prompts.pop(0)
+            prompts.append(tokens)
+        return best_prefix
+
+def keep_alive_seconds(keep_alive) -> float:
+    if keep_alive is None:
+        return 300.0
+    if isinstance(keep_alive, str) and keep_alive[-1:] in ("s", "m", "h"):
+        value = float(keep_alive[:-1]) * {"s": 1, "m": 60, "h": 3600}[keep_alive[-1]]
+    else:
+        value = float(keep_alive)
+    return float("inf") if value < 0 else value
+
+class StubModels:
+    """
+    The Ollama models loaded in memory, least recently used first, with their keep-alive expiry
+    """
+
+    def __init__(self, load_latency: float = 0.0, max_loaded_models: int = 0, model_size_mb: int = 4096):
+        self.load_latency = load_latency
+        self.max_loaded_models = max_loaded_models
+        self.model_size_mb = model_size_mb
+        self.loaded: "OrderedDict[str, float]" = OrderedDict()
+        self.known: set = set()
+        self.loads = 0
+        self._lock = threading.Lock()
+
+    def load(self, model: str, keep_alive=None) -> float:
+        """
+        Load a model, if it isn't loaded
+
+        Returns:
+            The load time, in seconds
+        """
+        with self._lock:
+            now = time.time()
+            for name, expires_at in list(self.loaded.items()):
+                if expires_at <= now:
+                    del self.loaded[name]
+            is_loaded = model in self.loaded
+            self.loaded.pop(model, None)
+            self.loaded[model] = now + keep_alive_seconds(keep_alive)
+            self.known.add(model)
+            if not is_loaded:
+                self.loads += 1
+            while self.max_loaded_models and len(self.loaded) > self.max_loaded_models:
+                self.loaded.popitem(last=False)
+        if is_loaded:
+            return 0.0
+        time.sleep(self.load_latency)
+        return self.load_latency
+
+    def ps(self) -> List[Dict]:
+        with self._lock:
+            now = time.time()
+            return [
+                {
+                    "name": name,
+                    "model": name,
+                    "size": self.model_size_mb * 1024 * 1024,
+                    "size_vram": self.model_size_mb * 1024 * 1024,
+                    "expires_at": datetime.fromtimestamp(min(expires_at, now + 10 * 365 * 86400), timezone.utc).isoformat(),
+                }
+                for name, expires_at in self.loaded.items()
+                if expires_at > now
+            ]
+
+    def tags(self) -> List[Dict]:
+        with self._lock:
+            return [{"name": name, "model": name, "size": self.model_size_mb * 1024 * 1024} for name in sorted(self.known)]
+
+def count_tokens(text: str) -> int:
+    return len(text.split())
+
+def split_tokens(text: str) -> List[str]:
+    """
+    Split a response into stream chunks, keeping the whitespace so the chunks add up to the response
+    """
+    tokens = []
+    for i, word in enumerate(text.split(" ")):
+        tokens.append(word if i == 0 else " " + word)
+    return tokens
+
+def prompt_text(messages: List[Dict]) -> str:
+    parts = []
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        parts.append(content)
+    return "\n".join(parts)
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    # Set by `start_stub_server`
+    responses: List[Tuple[str, str]] = DEFAULT_RESPONSES
+    latency: float = 0.0
+    token_latency: float = 0.0
+    prompt_token_latency: float = 0.0
+    stats: StubStats = None
+    models: StubModels = None
+    prompt_cache: StubPromptCache = None
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.send_json(self.stats.to_dict())
+        elif self.path == "/api/ps":
+            self.send_json({"models": self.models.ps()})
+        elif self.path == "/api/tags":
+            self.send_json({"models": self.models.tags()})
+        else:
+            # Ollama's and OpenAI's clients don't need anything else: answer health checks
+            self.send_json({"status": "ok"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.path == "/stats/reset":
+            self.stats.reset()
+            self.send_json(self.stats.to_dict())
+        elif self.path.endswith("/chat/completions"):
+            self.handle_chat(self.openai_chat, body)
+        elif self.path == "/api/chat":
+            self.handle_chat(self.ollama_chat, body)
+        elif self.path == "/api/generate":
+            self.handle_chat(self.ollama_generate, body)
+        else:
+            self.send_json({"error": f"Unknown endpoint {self.path}"}, status=404)
+
+    def handle_chat(self, handler, body: Dict) -> None:
+        try:
+            handler(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the call
+            self.close_connection = True
+
+    def complete(self, body: Dict) -> Tuple[str, str, int]:
+        """
+        Returns:
+            The prompt, the completion and the number of cached prompt tokens
+        """
+        prompt = prompt_text(body.get("messages", []))
+        completion = next(response for key, response in self.responses if key in prompt)
+        if callable(completion):
+            completion = completion(prompt)
+        cached_tokens = self.prompt_cache.evaluate(body.get("model", "stub"), prompt)
+        prompt_eval = (count_tokens(prompt) - cached_tokens) * self.prompt_token_latency
+        self.stats.record(prompt, completion, cached_tokens, prompt_eval * 1000)
+        time.sleep(self.latency + prompt_eval)
+        return prompt, completion, cached_tokens
+
+    def openai_chat(self, body: Dict):
+        prompt, completion, cached_tokens = self.complete(body)
+        model = body.get("model", "stub")
+        usage = {
+            "prompt_tokens": count_tokens(prompt),
+            "completion_tokens": count_tokens(completion),
+            "total_tokens": count_tokens(prompt) + count_tokens(completion),
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+        created = int(time.time())
+        if not body.get("stream"):
+            self.send_json({
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": completion}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        def chunk(delta: Dict, finish_reason: str = None, usage: Dict = None) -> bytes:
+            event = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if usage is None else [],
+            }
+            if usage is not None:
+                event["usage"] = usage
+            return f"data: {json.dumps(event)}\n\n".encode("utf-8")
+
+        self.start_stream("text/event-stream")
+        self.send_chunk(chunk({"role": "assistant", "content": ""}))
+        for token in split_tokens(completion):
+            time.sleep(self.token_latency)
+            self.send_chunk(chunk({"content": token}))
+        self.send_chunk(chunk({}, finish_reason="stop"))
+        if body.get("stream_options", {}).get("include_usage"):
+            self.send_chunk(chunk({}, usage=usage))
+        self.send_chunk(b"data: [DONE]\n\n")
+        self.end_stream()
+
+    def ollama_generate(self, body: Dict):
+        """
+        Only loads the model (an empty prompt), like the warm-up calls
+        """
+        model = body.get("model", "stub")
+        load_duration = self.models.load(model, body.get("keep_alive"))
+        self.send_json({
+            "model": model,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "response": "",
+            "done": True,
+            "done_reason": "load",
+            "load_duration": int(load_duration * 1e9),
+        })
+
+    def ollama_chat(self, body: Dict):
+        model = body.get("model", "stub")
+        load_duration = self.models.load(model, body.get("keep_alive"))
+        prompt, completion, cached_tokens = self.complete(body)
+        evaluated_tokens = count_tokens(prompt) - cached_tokens
+        created_at = datetime.now(timezone.utc).isoformat()
+        done = {
+            "model": model,
+            "created_at": created_at,
+            "message": {"role": "assistant", "content": ""},
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": 0,
+            "load_duration": int(load_duration * 1e9),
+            # Like Ollama, only the prompt tokens that weren't cached are evaluated
+            "prompt_eval_count": evaluated_tokens,
+            "prompt_eval_duration": int(evaluated_tokens * self.prompt_token_latency * 1e9),
+            "eval_count": count_tokens(completion),
+            "eval_duration": 0,
+        }
+        if body.get("stream") is False:
+            self.send_json({**done, "message": {"role": "assistant", "content": completion}})
+            return
+
+        self.start_stream("application/x-ndjson")
+        for token in split_tokens(completion):
+            time.sleep(self.token_latency)
+            event = {"model": model, "created_at": created_at, "message": {"role": "assistant", "content": token}, "done": False}
+            self.send_chunk((json.dumps(event) + "\n").encode("utf-8"))
+        self.send_chunk((json.dumps(done) + "\n").encode("utf-8"))
+        self.end_stream()
+
+    def send_json(self, data: Dict, status: int = 200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def start_stream(self, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def send_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+def start_stub_server(
+    host: str = "127.0.0.1",
+    port: int = 0,
+    latency_ms: float = 0.0,
+    token_latency_ms: float = 0.0,
+    responses: List[Tuple[str, str]] = None,
+    load_latency_ms: float = 0.0,
+    max_loaded_models: int = 0,
+    prompt_token_latency_ms: float = 0.0,
+    prompt_cache_slots: int = 4,
+) -> Tuple[str, ThreadingHTTPServer]:
+    """
+    Start the stub server in a background thread.
+
+    Returns:
+        The server's base URL and the server (`server.RequestHandlerClass.stats` holds the call counts,
+        `server.RequestHandlerClass.models` the loaded models)
+    """
+    handler = type("Handler", (StubLLMHandler,), {
+        "responses": responses or DEFAULT_RESPONSES,
+        "latency": latency_ms / 1000,
+        "token_latency": token_latency_ms / 1000,
+        "prompt_token_latency": prompt_token_latency_ms / 1000,
+        "stats": StubStats(),
+        "prompt_cache": StubPromptCache(prompt_cache_slots),
+        "models": StubModels(load_latency_ms / 1000, max_loaded_models),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-llm", daemon=True).start()
+    return f"http://{host}:{server.server_address[1]}", server
+
+def load_responses(path: str) -> List[Tuple[str, str]]:
+    """
+    Load canned responses from a JSON object of prompt substring -> response.
+    The default responses are kept as fallbacks.
+    """
+    with open(path, "r") as f:
+        return list(json.load(f).items()) + DEFAULT_RESPONSES
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency-ms", type=float, default=200, help="Delay before the first token of each response")
+    parser.add_argument("--token-latency-ms", type=float, default=5, help="Delay between streamed tokens")
+    parser.add_argument("--responses", help="JSON file of prompt substring -> canned response")
+    parser.add_argument("--load-latency-ms", type=float, default=0, help="Load time of an Ollama model that isn't loaded")
+    parser.add_argument("--max-loaded-models", type=int, default=0, help="Ollama models loaded at once (0 = no limit)")
+    parser.add_argument("--prompt-token-latency-ms", type=float, default=0, help="Evaluation time of every prompt token that isn't cached")
+    parser.add_argument("--prompt-cache-slots", type=int, default=4, help="Cached prompts per model")
+    args = parser.parse_args()
+
+    responses = load_responses(args.responses) if args.responses else None
+    url, server = start_stub_server(
+        args.host, args.port, args.latency_ms, args.token_latency_ms, responses, args.load_latency_ms, args.max_loaded_models,
+        args.prompt_token_latency_ms, args.prompt_cache_slots,
+    )
+    print(f"Stub LLM server listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
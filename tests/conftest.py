@@ -0,0 +1,11 @@
+import pytest
+from stub_llm import start_stub_server
+
+@pytest.fixture(scope="session")
+def stub_llm():
+    """
+    The stub LLM server (see benchmarks/stub_llm.py), with a latency long enough for calls to overlap
+    """
+    url, server = start_stub_server(latency_ms=200)
+    yield url, server.RequestHandlerClass.stats
+    server.shutdown()
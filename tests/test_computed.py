@@ -0,0 +1,80 @@
+import json
+import pytest
+from app.form import computed
+from app.form.computed import compile_rules, init_computed_fields, is_valid_input, recompute_fields, rejected_answers_hint
+from app.form.draft import new_draft_form, set_field_value, change_batch, undo_changes, SOURCE_USER, SOURCE_COMPUTED
+from app.form.layout import form_fingerprint
+
+LABELS = ["income", "interest", "total_income", "deductions", "taxable", "tax"]
+# Declared out of dependency order: "tax" depends on "taxable", which depends on "total_income"
+FORMULAS = {
+    "tax": "round({taxable} / 10)",
+    "taxable": "max(0, {total_income} - {deductions})",
+    "total_income": "{income} + {interest}",
+}
+
+def make_field(label: str) -> dict:
+    return {"label": label, "description": "", "type": "text", "docId": None, "value": "", "options": [], "lastProcessed": "", "lastSurveyed": ""}
+
+@pytest.fixture
+def draft_form(tmp_path, monkeypatch):
+    fields = [make_field(label) for label in LABELS]
+    fingerprint = form_fingerprint(fields)
+    (tmp_path / "rules.json").write_text(json.dumps({"fingerprint": fingerprint, "fields": {label: {"formula": formula} for label, formula in FORMULAS.items()}}))
+    monkeypatch.setenv("FORM_RULES_PATH", str(tmp_path))
+    monkeypatch.setattr(computed, "_rules_cache", type(computed._rules_cache)())
+    init_computed_fields(fields, fingerprint)
+    return new_draft_form("form.pdf", fields, fingerprint)
+
+def values(draft_form: dict) -> list:
+    return [field["value"] for field in draft_form["fields"]]
+
+def answer(draft_form: dict, label: str, value: str) -> None:
+    index = LABELS.index(label)
+    with change_batch(draft_form):
+        set_field_value(draft_form, index, value, SOURCE_USER)
+        recompute_fields(draft_form, [index])
+
+def test_rules_are_compiled_in_dependency_order():
+    rules = compile_rules(FORMULAS, LABELS)
+    assert rules.order == (2, 4, 5)
+    assert rules.dependents == {0: (2,), 1: (2,), 2: (4,), 3: (4,), 4: (5,)}
+
+def test_formulas_in_a_cycle_are_rejected():
+    with pytest.raises(ValueError):
+        compile_rules({"a": "{b} + 1", "b": "{a} + 1"}, ["a", "b"])
+
+def test_computed_fields_are_marked_and_never_asked(draft_form):
+    assert [field["computed"] for field in draft_form["fields"]] == [False, False, True, False, True, True]
+    assert draft_form["fields"].unanswered_indexes() == [0, 1, 3]
+    assert values(draft_form) == [""] * 6
+
+def test_changes_are_propagated_through_the_dependency_graph(draft_form):
+    answer(draft_form, "income", "1,000")
+    assert values(draft_form) == ["1,000", "", "1000", "", "1000", "100"]
+    answer(draft_form, "deductions", "$250")
+    assert values(draft_form) == ["1,000", "", "1000", "$250", "750", "75"]
+    assert draft_form["fields"][5]["source"] == SOURCE_COMPUTED
+
+def test_only_the_dependents_of_the_changed_fields_are_computed(draft_form):
+    answer(draft_form, "income", "1000")
+    changed = recompute_fields(draft_form, [LABELS.index("deductions")])
+    assert changed == []
+    set_field_value(draft_form, LABELS.index("deductions"), "400", SOURCE_USER)
+    assert recompute_fields(draft_form, [LABELS.index("deductions")]) == [4, 5]
+
+def test_computed_fields_are_undone_with_their_inputs(draft_form):
+    answer(draft_form, "income", "1000")
+    undone = undo_changes(draft_form)
+    recompute_fields(draft_form, [change["index"] for change in undone])
+    assert values(draft_form) == [""] * 6
+
+def test_inputs_only_take_numbers(draft_form):
+    assert is_valid_input(draft_form, LABELS.index("income"), "1,200.50")
+    assert not is_valid_input(draft_form, LABELS.index("income"), "about a thousand")
+    assert is_valid_input(draft_form, LABELS.index("tax"), "anything")
+
+def test_rejected_answers_get_a_hint(draft_form):
+    draft_form["rejectedAnswers"] = {LABELS.index("income"): "about a thousand"}
+    assert "a number is expected" in rejected_answers_hint(draft_form, [LABELS.index("income")])
+    assert rejected_answers_hint(draft_form, [LABELS.index("deductions")]) == ""
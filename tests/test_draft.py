@@ -0,0 +1,48 @@
+from app.form.draft import new_draft_form, set_field_value, undo_changes, change_batch, get_changed_fields_since, SOURCE_USER
+
+def make_field(label: str, value: str = "") -> dict:
+    return {"label": label, "description": "", "type": "text", "docId": None, "value": value, "options": [], "lastProcessed": "", "lastSurveyed": ""}
+
+def make_form(*labels: str) -> dict:
+    return new_draft_form("form.pdf", [make_field(label) for label in labels])
+
+def test_undo_restores_the_previous_values():
+    draft_form = make_form("name", "city")
+    set_field_value(draft_form, 0, "Ada", SOURCE_USER)
+    set_field_value(draft_form, 0, "Grace", SOURCE_USER)
+    undone = undo_changes(draft_form)
+    assert [change["value"] for change in undone] == ["Grace"]
+    field = draft_form["fields"][0]
+    assert field["value"] == "Ada" and field["source"] == SOURCE_USER and field["revision"] == 1
+
+def test_undo_keeps_the_revision_monotonic():
+    draft_form = make_form("name", "city")
+    set_field_value(draft_form, 0, "Ada", SOURCE_USER)
+    set_field_value(draft_form, 1, "London", SOURCE_USER)
+    assert draft_form["revision"] == 2
+    undo_changes(draft_form)
+    assert draft_form["revision"] == 2
+    # A new change gets a new revision: a revision number is never reused
+    change = set_field_value(draft_form, 1, "Paris", SOURCE_USER)
+    assert change["revision"] == 3
+    assert list(get_changed_fields_since(draft_form, 2)) == [1]
+
+def test_undo_to_a_revision():
+    draft_form = make_form("name", "city")
+    set_field_value(draft_form, 0, "Ada", SOURCE_USER)
+    set_field_value(draft_form, 1, "London", SOURCE_USER)
+    set_field_value(draft_form, 0, "Grace", SOURCE_USER)
+    undo_changes(draft_form, to_revision=0)
+    assert [field["value"] for field in draft_form["fields"]] == ["", ""]
+    assert draft_form["revision"] == 3
+    assert draft_form["fields"].unanswered_indexes() == [0, 1]
+
+def test_a_change_batch_is_undone_together():
+    draft_form = make_form("name", "city")
+    set_field_value(draft_form, 0, "Ada", SOURCE_USER)
+    with change_batch(draft_form):
+        set_field_value(draft_form, 0, "Grace", SOURCE_USER)
+        set_field_value(draft_form, 1, "London", SOURCE_USER)
+    assert draft_form["revision"] == 2
+    assert len(undo_changes(draft_form)) == 2
+    assert [field["value"] for field in draft_form["fields"]] == ["Ada", ""]
@@ -0,0 +1,56 @@
+import asyncio
+import pytest
+from app.utils import event_loop
+from app.utils.llm import ainvoke_llm, _in_flight_calls
+
+@pytest.fixture
+def stub_model(stub_llm, monkeypatch):
+    url, stats = stub_llm
+    monkeypatch.setenv("OLLAMA_HOST", url)
+    # A model of its own: the model clients are created once per process and used from the process-wide
+    # event loop (see `get_llm`)
+    monkeypatch.setenv("PREFILL_LLM", "stub-coalescing")
+    monkeypatch.delenv("MODEL_CONSOLIDATION", raising=False)
+    stats.reset()
+    return stats
+
+def test_identical_concurrent_calls_are_coalesced(stub_model):
+    async def main():
+        return await asyncio.gather(*[ainvoke_llm("PREFILL_LLM", "Hello", "test") for _ in range(3)])
+
+    responses = event_loop.run(main())
+    assert stub_model.calls == 1
+    assert len({response.content for response in responses}) == 1
+    # Every caller gets its own copy of the response
+    assert len({id(response) for response in responses}) == 3
+    assert not _in_flight_calls
+
+def test_different_calls_are_not_coalesced(stub_model):
+    async def main():
+        return await asyncio.gather(ainvoke_llm("PREFILL_LLM", "Hello", "test"), ainvoke_llm("PREFILL_LLM", "Hi", "test"))
+
+    event_loop.run(main())
+    assert stub_model.calls == 2
+
+def test_finished_call_is_not_reused(stub_model):
+    async def main():
+        await ainvoke_llm("PREFILL_LLM", "Hello", "test")
+        await ainvoke_llm("PREFILL_LLM", "Hello", "test")
+
+    event_loop.run(main())
+    assert stub_model.calls == 2
+
+def test_follower_keeps_the_call_when_the_leader_goes_away(stub_model):
+    async def main():
+        leader = asyncio.create_task(ainvoke_llm("PREFILL_LLM", "Hello", "test"))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(ainvoke_llm("PREFILL_LLM", "Hello", "test"))
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        response = await follower
+        assert leader.cancelled()
+        return response
+
+    assert event_loop.run(main()).content
+    assert stub_model.calls == 1
+    assert not _in_flight_calls
@@ -0,0 +1,100 @@
+import asyncio
+import pytest
+from app.utils.scheduler import LLMScheduler, llm_context, PRIORITY_BULK, PRIORITY_INTERACTIVE, PRIORITY_SPECULATIVE
+
+MODEL = "stub-model"
+
+@pytest.fixture(autouse=True)
+def one_slot(monkeypatch):
+    monkeypatch.setenv("LLM_MAX_CONCURRENCY", "1")
+    monkeypatch.delenv("LLM_CONCURRENCY", raising=False)
+
+async def call(scheduler: LLMScheduler, order: list, name: str, priority: int = PRIORITY_INTERACTIVE, session_id: str = None, hold: asyncio.Event = None):
+    with llm_context(session_id=session_id, priority=priority):
+        async with scheduler.slot(MODEL):
+            order.append(name)
+            if hold:
+                await hold.wait()
+
+async def run_queued(scheduler: LLMScheduler, calls: list) -> list:
+    """
+    Take the model's only slot, queue the calls (name, priority, session) in order, then release the slot
+
+    Returns:
+        The names of the calls, in the order they got the slot
+    """
+    order = []
+    release = asyncio.Event()
+    blocker = asyncio.create_task(call(scheduler, order, "blocker", hold=release))
+    await asyncio.sleep(0)
+    tasks = []
+    for name, priority, session_id in calls:
+        tasks.append(asyncio.create_task(call(scheduler, order, name, priority, session_id)))
+        await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(blocker, *tasks)
+    return order[1:]
+
+def test_priority_classes_are_served_in_order():
+    scheduler = LLMScheduler()
+    order = asyncio.run(run_queued(scheduler, [
+        ("bulk", PRIORITY_BULK, "a"),
+        ("speculative", PRIORITY_SPECULATIVE, "a"),
+        ("interactive", PRIORITY_INTERACTIVE, "a"),
+    ]))
+    assert order == ["interactive", "speculative", "bulk"]
+    assert scheduler._queues[MODEL].active == 0
+
+def test_sessions_take_turns_within_a_class():
+    scheduler = LLMScheduler()
+    order = asyncio.run(run_queued(scheduler, [
+        ("a1", PRIORITY_BULK, "a"),
+        ("a2", PRIORITY_BULK, "a"),
+        ("a3", PRIORITY_BULK, "a"),
+        ("b1", PRIORITY_BULK, "b"),
+        ("c1", PRIORITY_BULK, "c"),
+    ]))
+    assert order == ["a1", "b1", "c1", "a2", "a3"]
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def main(scheduler: LLMScheduler):
+        order = []
+        release = asyncio.Event()
+        blocker = asyncio.create_task(call(scheduler, order, "blocker", hold=release))
+        await asyncio.sleep(0)
+        abandoned = asyncio.create_task(call(scheduler, order, "abandoned"))
+        waiting = asyncio.create_task(call(scheduler, order, "waiting"))
+        await asyncio.sleep(0)
+        abandoned.cancel()
+        await asyncio.sleep(0)
+        assert [len(waiters) for waiters in scheduler._queues[MODEL].waiting[PRIORITY_INTERACTIVE].values()] == [1]
+        release.set()
+        await asyncio.gather(blocker, waiting)
+        assert abandoned.cancelled()
+        return order
+
+    scheduler = LLMScheduler()
+    assert asyncio.run(main(scheduler)) == ["blocker", "waiting"]
+    queue = scheduler._queues[MODEL]
+    assert queue.active == 0 and not queue.has_waiters()
+
+def test_slot_granted_to_a_cancelled_waiter_is_handed_over():
+    async def main(scheduler: LLMScheduler):
+        order = []
+        release = asyncio.Event()
+        blocker = asyncio.create_task(call(scheduler, order, "blocker", hold=release))
+        await asyncio.sleep(0)
+        abandoned = asyncio.create_task(call(scheduler, order, "abandoned"))
+        waiting = asyncio.create_task(call(scheduler, order, "waiting"))
+        await asyncio.sleep(0)
+        release.set()
+        # The blocker releases its slot to the first waiter, which goes away before it gets it
+        await asyncio.sleep(0)
+        abandoned.cancel()
+        await asyncio.gather(blocker, waiting)
+        return order
+
+    scheduler = LLMScheduler()
+    assert asyncio.run(main(scheduler)) == ["blocker", "waiting"]
+    queue = scheduler._queues[MODEL]
+    assert queue.active == 0 and not queue.has_waiters()